@@ -0,0 +1,60 @@
+# Importing all needed libraries.
+from sqlalchemy import text, BigInteger
+from sqlalchemy.dialects.postgresql import UUID
+
+from models import db, MessagesModel
+
+
+def sample_literal(column) -> str:
+    '''
+        This function returns a SQL literal of the column type used in the explained queries.
+            :param column: sqlalchemy.Column
+                The column compared to the literal.
+    '''
+    if isinstance(column.type, UUID):
+        return "'00000000-0000-0000-0000-000000000000'"
+    elif isinstance(column.type, BigInteger):
+        return "0"
+    return "'0'"
+
+
+def access_path_queries() -> dict:
+    '''
+        This function returns the queries of the access paths the warehouse is expected to serve with indexes.
+            :return: dict
+                The queries keyed by the name of the access path.
+    '''
+    queries = {
+        f"{table} by service_name" : f"SELECT * FROM {table} WHERE service_name = 'intent-service'"
+        for table in ["latency", "traffic", "errors", "saturation"]
+    }
+    queries.update({
+        f"{table} by service_name and ingested_at" : f"SELECT * FROM {table} WHERE service_name = 'intent-service' "
+                                                     f"AND ingested_at >= now() - interval '1 hour'"
+        for table in ["latency", "traffic", "errors", "saturation"]
+    })
+    queries["user by telegram_id"] = 'SELECT id FROM "user" WHERE telegram_id = 1'
+
+    # Every key column of the Messages table is used to join the dimensions and the metrics.
+    for column in MessagesModel.__table__.columns:
+        if column.name.endswith("_id"):
+            queries[f"messages by {column.name}"] = f"SELECT * FROM messages WHERE {column.name} = {sample_literal(column)}"
+    return queries
+
+
+def explain_access_paths() -> dict:
+    '''
+        This function runs EXPLAIN on every access path with sequential scans disabled,
+        so a Seq Scan in the plan means that no index can serve the access path, whatever the table size.
+            :return: dict
+                The flag showing if an index is used and the plan, keyed by the name of the access path.
+    '''
+    results = dict()
+    with db.engine.connect() as connection:
+        transaction = connection.begin()
+        connection.execute(text("SET LOCAL enable_seqscan = off"))
+        for name, query in access_path_queries().items():
+            plan = "\n".join(row[0] for row in connection.execute(text(f"EXPLAIN {query}")))
+            results[name] = ("Seq Scan" not in plan, plan)
+        transaction.rollback()
+    return results
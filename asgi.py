@@ -0,0 +1,305 @@
+# Importing the external libraries.
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from werkzeug.datastructures import Headers
+import asyncpg
+import uvicorn
+import json
+
+# Importing all needed modules.
+from schemas import MetricsSchema, UserSchema, MessageSchema
+from cerber import SecurityManager
+from config import ConfigManager
+from ingestion import metrics_to_records, message_links, message_fields, service_metrics_row, MESSAGE_FIELDS
+from models import LONG_METRIC_LINKS, PARTITIONED_METRICS
+from dimensions import DateDimension
+from caches import LRUCache
+
+# Creation of the Validation Schemas.
+metrics_schema = MetricsSchema()
+user_schema = UserSchema()
+message_schema = MessageSchema()
+
+# Creation of the config manager.
+config = ConfigManager("config.ini")
+
+# Creation of the Security Manager.
+security_manager = SecurityManager(config.security.secret_key, config.security.hmac_mode)
+
+# Creation of the Date Dimension, its horizon is populated on startup.
+date_dimension = DateDimension(
+    bucket_seconds=config.date_dimension.bucket_seconds,
+    history_days=config.date_dimension.history_days,
+    premake_days=config.date_dimension.premake_days,
+    key_cache_size=config.date_dimension.key_cache_size
+)
+
+# Creation of the cache of the user ids.
+user_id_cache = LRUCache(config.caches.user_id_cache_size)
+
+# The pool of the connections to the database, created on startup.
+pool = None
+
+
+class BufferedRequest:
+    def __init__(self, headers, body : bytes) -> None:
+        '''
+            The constructor of the Buffered Request, exposing a read ASGI request like a flask one to the Security Manager.
+                :param headers: starlette.datastructures.Headers
+                    The headers of the request.
+                :param body: bytes
+                    The raw body of the request.
+        '''
+        # The ASGI header names are lower case, the Security Manager looks for the 'Token' one.
+        self.headers = Headers([(name.title(), value) for name, value in headers.items()])
+        self.body = body
+        self.json = json.loads(body) if body else None
+
+    def get_data(self, cache : bool = True) -> bytes:
+        '''
+            This function returns the raw body of the request.
+        '''
+        return self.body
+
+
+async def read_request(request):
+    '''
+        This function reads the body of a request and checks its access token.
+            :param request: starlette.requests.Request
+                The ASGI request.
+            :return: tuple
+                The buffered request and None, or None and the error response.
+    '''
+    try:
+        buffered = BufferedRequest(request.headers, await request.body())
+    except ValueError:
+        return None, JSONResponse({"message" : "The request body isn't a valid JSON!", "code" : 400}, 400)
+
+    # Checking the access token.
+    check_response = security_manager.check_request(buffered)
+    if check_response != "OK":
+        return None, JSONResponse(check_response, check_response["code"])
+    return buffered, None
+
+
+def database_error(e : Exception) -> JSONResponse:
+    '''
+        This function returns the response of a failed database statement.
+            :param e: Exception
+                The exception raised by asyncpg.
+    '''
+    return JSONResponse({
+        "name" : e.__class__.__name__,
+        "cause" : e.__repr__()
+    }, 500)
+
+
+def metrics_statement(result : dict) -> tuple:
+    '''
+        This function builds the single statement inserting the metrics records and upserting the message links.
+        The inserts are chained as data-modifying CTEs, so the request costs one round trip to the database.
+            :param result: dict
+                The metrics report validated by the MetricsSchema.
+            :return: tuple
+                The statement and its arguments.
+    '''
+    records = metrics_to_records(result)
+    links = message_links(result["service_name"], records)
+    arguments = []
+
+    def placeholders(values):
+        arguments.extend(values)
+        return ", ".join(f"${index}" for index in range(len(arguments) - len(values) + 1, len(arguments) + 1))
+
+    if PARTITIONED_METRICS:
+        # The ids are only unique in a partition, so the records are only inserted if their ids are new keys.
+        key_values = ", ".join(f"({placeholders([record['id']])})" for record in records.values())
+        ctes = [f"report_keys AS (INSERT INTO metric_report_keys (id) VALUES {key_values} "
+                f"ON CONFLICT (id) DO NOTHING RETURNING id)"]
+        for table_name, record in records.items():
+            values = placeholders(list(record.values()))
+            ctes.append(f"{table_name}_insert AS (INSERT INTO {table_name} ({', '.join(record)}) SELECT {values} "
+                        f"WHERE {values.split(', ')[0]} IN (SELECT id FROM report_keys))")
+    else:
+        ctes = [
+            f"{table_name}_insert AS (INSERT INTO {table_name} ({', '.join(record)}) "
+            f"VALUES ({placeholders(list(record.values()))}) ON CONFLICT DO NOTHING)"
+            for table_name, record in records.items()
+        ]
+    if LONG_METRIC_LINKS:
+        # The links are a new row of the Message Service Metrics table, the Messages row is only created if missing.
+        row = service_metrics_row(result, records)
+        ctes.append(f"message_insert AS (INSERT INTO messages (id) VALUES ({placeholders([result['correlation_id']])}) "
+                    f"ON CONFLICT (id) DO NOTHING)")
+        statement = f"WITH {', '.join(ctes)} " \
+                    f"INSERT INTO message_service_metrics ({', '.join(row)}) VALUES ({placeholders(list(row.values()))}) " \
+                    f"ON CONFLICT DO NOTHING"
+        return statement, arguments
+
+    if config.staging.enabled:
+        # The links are staged and merged into the Messages table later.
+        statement = f"WITH {', '.join(ctes)} " \
+                    f"INSERT INTO staged_events (kind, correlation_id, payload) " \
+                    f"VALUES ({placeholders(['links', result['correlation_id'], links])})"
+        return statement, arguments
+
+    message_values = placeholders([result["correlation_id"]] + list(links.values()))
+    if links:
+        conflict = "DO UPDATE SET " + ", ".join(f"{column} = excluded.{column}" for column in links) + \
+                   ", updated_at = now()"
+    else:
+        conflict = "DO NOTHING"
+    statement = f"WITH {', '.join(ctes)} " \
+                f"INSERT INTO messages ({', '.join(['id'] + list(links))}) VALUES ({message_values}) " \
+                f"ON CONFLICT (id) {conflict}"
+    return statement, arguments
+
+
+async def metrics(request):
+    buffered, error = await read_request(request)
+    if error is not None:
+        return error
+
+    # Validating the request body schema.
+    result, status_code = metrics_schema.validate_json(buffered.json)
+    if status_code != 200:
+        return JSONResponse(result, status_code)
+
+    # Writing the metrics records and the message links.
+    statement, arguments = metrics_statement(result)
+    try:
+        await pool.execute(statement, *arguments)
+    except Exception as e:
+        return database_error(e)
+    return JSONResponse({"message" : "Data saved!"}, 200)
+
+
+async def user(request):
+    buffered, error = await read_request(request)
+    if error is not None:
+        return error
+
+    # Validating the request body schema.
+    result, status_code = user_schema.validate_json(buffered.json)
+    if status_code != 200:
+        return JSONResponse(result, status_code)
+
+    # Writing the user record.
+    try:
+        await pool.execute(
+            'INSERT INTO "user" (id, telegram_id, chat_id, first_name, last_name, telegram_username, app_id) '
+            'VALUES ($1, $2, $3, $4, $5, $6, $7)',
+            result["user_id"], result["telegram_user_id"], result["chat_id"], result["first_name"],
+            result["last_name"], result["telegram_username"], result["app_id"]
+        )
+    except Exception as e:
+        return database_error(e)
+
+    # Caching the id of the new user.
+    user_id_cache.put(result["telegram_user_id"], result["user_id"])
+    return JSONResponse({"message" : "Data saved!"}, 200)
+
+
+async def message(request):
+    buffered, error = await read_request(request)
+    if error is not None:
+        return error
+
+    # Validating the request body schema.
+    result, status_code = message_schema.validate_json(buffered.json)
+    if status_code != 200:
+        return JSONResponse(result, status_code)
+
+    try:
+        # Getting the id of the user sending the message.
+        user_id = user_id_cache.get(result["telegram_user_id"])
+        if user_id is None:
+            user_id = await pool.fetchval('SELECT id FROM "user" WHERE telegram_id = $1', result["telegram_user_id"])
+            if user_id is None:
+                return JSONResponse({"message" : "User not found!", "code" : 404}, 404)
+            user_id_cache.put(result["telegram_user_id"], user_id)
+
+        # Upserting or staging the message, inserting the Date record in the same statement if it's outside of the populated range.
+        key = date_dimension.key(result["time"])
+        if config.staging.enabled:
+            arguments = [result["correlation_id"], message_fields(result, date_dimension.date_id(key), user_id)]
+            statement = "INSERT INTO staged_events (kind, correlation_id, payload) VALUES ('message', $1, $2)"
+        else:
+            arguments = [result["correlation_id"], user_id, date_dimension.date_id(key)] + \
+                        [result[field] for field in MESSAGE_FIELDS]
+            columns = ["id", "user_id", "date_id"] + MESSAGE_FIELDS
+            values = ", ".join(f"${index}" for index in range(1, len(columns) + 1))
+            assignments = ", ".join(f"{column} = excluded.{column}" for column in columns[1:])
+            statement = f"INSERT INTO messages ({', '.join(columns)}) VALUES ({values}) " \
+                        f"ON CONFLICT (id) DO UPDATE SET {assignments}, updated_at = now()"
+        if not date_dimension.range_start <= key < date_dimension.range_end:
+            record = date_dimension.records([key])[0]
+            columns = list(record)
+            values = ", ".join(f"${index}" for index in range(len(arguments) + 1, len(arguments) + len(columns) + 1))
+            arguments += [record[column] for column in columns]
+            statement = f"WITH date_insert AS (INSERT INTO date ({', '.join(columns)}) VALUES ({values}) " \
+                        f"ON CONFLICT (id) DO NOTHING) {statement}"
+        await pool.execute(statement, *arguments)
+    except Exception as e:
+        return database_error(e)
+    return JSONResponse({"message" : "Data saved!"}, 200)
+
+
+async def init_connection(connection) -> None:
+    '''
+        This function sets up a new connection of the pool.
+            :param connection: asyncpg.Connection
+                The new connection.
+    '''
+    # The JSON columns are exchanged as python objects, like with sqlalchemy.
+    await connection.set_type_codec("json", encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
+
+
+async def startup() -> None:
+    '''
+        This function creates the pool of the connections to the database.
+    '''
+    global pool
+    pool = await asyncpg.create_pool(
+        user=config.database.username,
+        password=config.database.password,
+        host=config.database.host,
+        port=config.database.port,
+        database=config.database.db_name,
+        min_size=config.asgi.pool_min_size,
+        max_size=config.asgi.pool_max_size,
+        init=init_connection
+    )
+
+    # Populating the horizon of the Date table, the messages outside of it insert their Date record.
+    start, end = date_dimension.horizon()
+    await pool.execute(date_dimension.range_statement(start, end))
+    date_dimension.set_range(start, end)
+
+
+async def shutdown() -> None:
+    '''
+        This function closes the pool of the connections to the database.
+    '''
+    await pool.close()
+
+
+# Setting up the ASGI application.
+app = Starlette(
+    routes=[
+        Route("/metrics", metrics, methods=["POST"]),
+        Route("/user", user, methods=["POST"]),
+        Route("/message", message, methods=["POST"])
+    ],
+    on_startup=[startup],
+    on_shutdown=[shutdown]
+)
+
+# Running the ASGI server.
+if __name__ == "__main__":
+    uvicorn.run(
+        app,
+        port=config.general.port,
+        host="0.0.0.0"
+    )
@@ -0,0 +1,448 @@
+# Importing all needed libraries.
+import argparse
+import threading
+import json
+import time
+import timeit
+import uuid
+
+import requests
+
+from sqlalchemy import create_engine, text
+
+# Importing all needed modules.
+from cerber import SecurityManager
+from schemas import MetricsSchema, MessageSchema, UserSchema
+
+
+def sample_message(entities : int = 50) -> dict:
+    '''
+        This function creates a /message request body with large NER and business logic fields.
+            :param entities: int, default = 50
+                The number of entities in every NER list.
+            :return: dict
+                The request body.
+    '''
+    labels = ["PERSON", "NORP", "FAC", "ORG", "GPE", "LOC", "PRODUCT", "EVENT", "WORD_OF_ART",
+              "LAW", "LANGUAGE", "DATE", "TIME", "PERCENT", "MONEY", "QUANTITY", "ORDINAL", "CARDINAL"]
+    return {
+        "time" : 1688428800.5,
+        "correlation_id" : "6f1c2f0e-3b5e-4a43-9f3c-0c7a1d1b2e3f",
+        "text" : "What should I eat after my workout today? " * 20,
+        "intent" : "nutrition",
+        "sentiment" : 0.75,
+        "ner" : {label : [f"{label.lower()}-{index}" for index in range(entities)] for label in labels},
+        "response" : "A meal with proteins and carbohydrates is a good choice. " * 20,
+        "is_seq2seq" : False,
+        "business_logic_response" : {"meals" : [{"name" : f"meal-{index}", "calories" : index * 10} for index in range(200)]},
+        "is_intent_cached" : False,
+        "is_sentiment_cached" : True,
+        "is_ner_cached" : False,
+        "is_sequence_cached" : False,
+        "telegram_user_id" : 123456789
+    }
+
+
+def sample_metrics() -> dict:
+    '''
+        This function creates a /metrics request body.
+            :return: dict
+                The request body.
+    '''
+    return {
+        "correlation_id" : "6f1c2f0e-3b5e-4a43-9f3c-0c7a1d1b2e3f",
+        "service_name" : "intent-service",
+        "latency" : {
+            "lock_time" : 0.001,
+            "queue_waiting_time" : 0.02,
+            "actual_processing" : 0.15,
+            "task_service_time" : 0.17,
+            "database_response_time" : 0.005
+        },
+        "saturation" : {
+            "cpu_utilization" : 35.5,
+            "ram_utilization" : 60.1,
+            "waiting_queue_length" : 3,
+            "thread_capacity" : 0.5
+        },
+        "errors" : {
+            "request_status" : 200,
+            "request_reason" : "OK",
+            "db_error" : None
+        },
+        "traffic" : {
+            "write_query" : 2,
+            "read_query" : 5
+        }
+    }
+
+
+def sample_user() -> dict:
+    '''
+        This function creates a /user request body.
+            :return: dict
+                The request body.
+    '''
+    return {
+        "user_id" : "0b6c9b8e-4f4e-4d4a-8b4e-2d8f2c1a9e7d",
+        "telegram_user_id" : 123456789,
+        "chat_id" : 987654321,
+        "first_name" : "Jane",
+        "last_name" : "Doe",
+        "telegram_username" : "jane_doe",
+        "app_id" : 42
+    }
+
+
+def report(name : str, timer : timeit.Timer, number : int) -> float:
+    '''
+        This function runs the timer and prints the time per call.
+            :param name: str
+                The name of the benchmarked function.
+            :param timer: timeit.Timer
+                The timer of the function.
+            :param number: int
+                The number of calls per measurement.
+            :return: float
+                The best time per call in microseconds.
+    '''
+    best = min(timer.repeat(repeat=5, number=number)) / number * 1e6
+    print(f"{name:<40} {best:>10.1f} us")
+    return best
+
+
+def benchmark_hmac(number : int) -> None:
+    '''
+        This function compares the json.dumps and the raw body HMAC verification of a /message request.
+            :param number: int
+                The number of calls per measurement.
+    '''
+    security_manager = SecurityManager("data-warehouse-key")
+    body = sample_message()
+    raw_body = json.dumps(body).encode()
+    json_token = security_manager._SecurityManager__encode_hmac(body)
+    raw_token = security_manager.encode_raw_hmac(raw_body)
+    print(f"Request body size: {len(raw_body)} bytes")
+
+    # The json mode parses the body and serializes it again for the HMAC.
+    def json_mode():
+        assert security_manager.verify(json_token, json.loads(raw_body))
+
+    # The raw mode computes the HMAC over the body bytes and parses them once.
+    def raw_mode():
+        assert security_manager.verify_raw(raw_token, raw_body)
+        json.loads(raw_body)
+
+    json_time = report("hmac_mode=json", timeit.Timer(json_mode), number)
+    raw_time = report("hmac_mode=raw", timeit.Timer(raw_mode), number)
+    print(f"Speedup: {json_time / raw_time:.2f}x")
+
+
+def benchmark_schemas(number : int) -> None:
+    '''
+        This function compares the marshmallow and the compiled validation of the request schemas.
+            :param number: int
+                The number of calls per measurement.
+    '''
+    for schema, body in ((MetricsSchema(), sample_metrics()),
+                         (MessageSchema(), sample_message(entities=5)),
+                         (UserSchema(), sample_user())):
+        name = type(schema).__name__
+        assert schema.validate_json(body) == (schema.load(body), 200)
+        marshmallow_time = report(f"{name}.load", timeit.Timer(lambda: schema.load(body)), number)
+        compiled_time = report(f"{name}.validate_json", timeit.Timer(lambda: schema.validate_json(body)), number)
+        print(f"Speedup: {marshmallow_time / compiled_time:.2f}x")
+
+
+# The services reporting metrics and the prefixes of their columns in the Messages table.
+STORAGE_SERVICES = {"intent-service" : "intent", "named-entity-recognition-service" : "ner",
+                    "sentiment-service" : "sentiment", "sequence2sequence-service" : "seq"}
+STORAGE_METRICS = {
+    "latency" : "lock_time_per_process float, queue_waiting_time float, actual_processing_time float, "
+                "task_service_time float, database_response_time float",
+    "traffic" : "write_query integer, read_query integer",
+    "errors" : "status_code integer, db_error text, reason text",
+    "saturation" : "cpu_utilization float, ram_utilization float, waiting_queue_length integer, thread_capacity float"
+}
+STORAGE_VALUES = {
+    "latency" : "random(), random(), random(), random(), random()",
+    "traffic" : "(random() * 10)::integer, (random() * 10)::integer",
+    "errors" : "200, NULL, 'OK'",
+    "saturation" : "random() * 100, random() * 100, (random() * 10)::integer, random()"
+}
+
+
+def create_storage_schema(connection, schema : str, compact : bool, messages : int) -> None:
+    '''
+        This function creates the warehouse tables in a schema and fills them with synthetic data.
+            :param connection: sqlalchemy.engine.Connection
+                The connection to the database.
+            :param schema: str
+                The name of the schema.
+            :param compact: bool
+                If True the metrics keys are UUIDs and the date keys are BIGINTs, else all the keys are text.
+            :param messages: int
+                The number of synthetic messages.
+    '''
+    metric_key = "uuid" if compact else "varchar(64)"
+    date_key = "bigint" if compact else "varchar(64)"
+    key_cast = "" if compact else "::text"
+    connection.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+    connection.execute(text(f"CREATE SCHEMA {schema}"))
+
+    # Creating the date dimension with one row per minute.
+    connection.execute(text(f'''
+        CREATE TABLE {schema}.date AS
+        SELECT (extract(epoch FROM minute)::bigint){key_cast}::{date_key} AS id, minute::date AS date,
+               extract(month FROM minute)::integer AS month, trim(to_char(minute, 'Month')) AS month_str,
+               extract(year FROM minute)::integer AS year, extract(hour FROM minute)::integer AS hour,
+               extract(minute FROM minute)::integer AS minute, 0 AS seconds,
+               extract(isodow FROM minute)::integer AS day_of_week, extract(isodow FROM minute) IN (6, 7) AS is_weekend,
+               false AS is_holiday
+        FROM generate_series('2023-01-01'::timestamp, '2023-12-31 23:59'::timestamp, interval '1 minute') AS minute
+    '''))
+    connection.execute(text(f"ALTER TABLE {schema}.date ADD PRIMARY KEY (id)"))
+
+    # Creating the metrics tables with one row per message and service.
+    for table, columns in STORAGE_METRICS.items():
+        connection.execute(text(f"CREATE TABLE {schema}.{table} (id {metric_key} PRIMARY KEY, {columns}, service_name varchar(64))"))
+        connection.execute(text(f'''
+            INSERT INTO {schema}.{table}
+            SELECT md5(message || ':' || service || ':' || '{table}')::uuid{key_cast}, {STORAGE_VALUES[table]}, service
+            FROM generate_series(1, {messages}) AS message,
+                 unnest(ARRAY[{", ".join(f"'{service}'" for service in STORAGE_SERVICES)}]) AS service
+        '''))
+        connection.execute(text(f"CREATE INDEX ON {schema}.{table} (service_name)"))
+
+    # Creating the messages fact table pointing to the metrics rows.
+    metric_columns = [f"{prefix}_{table}_id" for prefix in STORAGE_SERVICES.values() for table in STORAGE_METRICS]
+    metric_values = [
+        f"md5(message || ':' || '{service}' || ':' || '{table}')::uuid{key_cast}"
+        for service in STORAGE_SERVICES for table in STORAGE_METRICS
+    ]
+    connection.execute(text(f'''
+        CREATE TABLE {schema}.messages (
+            id varchar(64) PRIMARY KEY, text text, date_id {date_key}, user_id varchar(64),
+            {", ".join(f"{column} {metric_key}" for column in metric_columns)}
+        )
+    '''))
+    connection.execute(text(f'''
+        INSERT INTO {schema}.messages
+        SELECT md5(message::text)::uuid::text, 'What should I eat today?',
+               (1672531200 + (message % 525600) * 60){key_cast}, md5((message % 1000)::text)::uuid::text,
+               {", ".join(metric_values)}
+        FROM generate_series(1, {messages}) AS message
+    '''))
+    for column in ["date_id", "user_id"] + metric_columns:
+        connection.execute(text(f"CREATE INDEX ON {schema}.messages ({column})"))
+    connection.execute(text("VACUUM ANALYZE"))
+
+
+def benchmark_storage(database_uri : str, messages : int) -> None:
+    '''
+        This function compares the table and index sizes of the text and the compact keys on a synthetic dataset.
+            :param database_uri: str
+                The sqlalchemy uri of a scratch Postgres database.
+            :param messages: int
+                The number of synthetic messages.
+    '''
+    engine = create_engine(database_uri, isolation_level="AUTOCOMMIT")
+    sizes = dict()
+    with engine.connect() as connection:
+        for schema, compact in (("keys_text", False), ("keys_compact", True)):
+            create_storage_schema(connection, schema, compact, messages)
+            for table in ["date", "messages"] + list(STORAGE_METRICS):
+                sizes[(schema, table)] = tuple(connection.execute(text(
+                    f"SELECT pg_relation_size('{schema}.{table}'), pg_indexes_size('{schema}.{table}')"
+                )).one())
+
+    print(f"{'table':<12} {'text table':>12} {'text index':>12} {'uuid table':>12} {'uuid index':>12}")
+    for table in ["date", "messages"] + list(STORAGE_METRICS):
+        text_sizes = sizes[("keys_text", table)]
+        compact_sizes = sizes[("keys_compact", table)]
+        print(f"{table:<12} " + " ".join(f"{size / 2**20:>10.1f}MB" for size in text_sizes + compact_sizes))
+
+
+# The analytical queries compared on the 18-way join and on the flattened table, '{source}' standing for the rows.
+FLAT_QUERIES = {
+    "p95 intent latency by hour" : "SELECT hour, percentile_cont(0.95) WITHIN GROUP (ORDER BY intent_actual_processing_time) "
+                                   "FROM {source} GROUP BY hour",
+    "failed requests by month and app" : "SELECT month, app_id, count(*) FILTER (WHERE intent_status_code <> 200 OR "
+                                         "ner_status_code <> 200 OR sentiment_status_code <> 200 OR seq_status_code <> 200) "
+                                         "FROM {source} GROUP BY month, app_id",
+    "weekend saturation" : "SELECT avg(intent_cpu_utilization), avg(seq_ram_utilization), max(ner_waiting_queue_length) "
+                           "FROM {source} WHERE is_weekend",
+    "one message" : "SELECT * FROM {source} WHERE id = md5('42')::uuid::text"
+}
+
+
+def flat_join(schema : str) -> str:
+    '''
+        This function returns the query joining the messages to the date, the user and the metrics of every service.
+            :param schema: str
+                The name of the schema created by create_storage_schema.
+    '''
+    columns = ["m.id", "d.date", "d.year", "d.month", "d.day_of_week", "d.hour", "d.is_weekend", "d.is_holiday", "u.app_id"]
+    joins = [f"JOIN {schema}.date AS d ON d.id = m.date_id", f'JOIN {schema}."user" AS u ON u.id = m.user_id']
+    for prefix in STORAGE_SERVICES.values():
+        for table, definition in STORAGE_METRICS.items():
+            alias = f"{prefix}_{table}"
+            joins.append(f"LEFT JOIN {schema}.{table} AS {alias} ON {alias}.id = m.{alias}_id")
+            for column_definition in definition.split(", "):
+                column = column_definition.split()[0]
+                columns.append(f"{alias}.{column} AS {prefix}_{column}")
+    return f"SELECT {', '.join(columns)} FROM {schema}.messages AS m {' '.join(joins)}"
+
+
+def benchmark_flat(database_uri : str, messages : int, repeat : int = 5) -> None:
+    '''
+        This function compares analytical queries on the 18-way join and on the flattened table of a synthetic dataset.
+            :param database_uri: str
+                The sqlalchemy uri of a scratch Postgres database.
+            :param messages: int
+                The number of synthetic messages.
+            :param repeat: int, default = 5
+                The number of runs of every query, the best one is kept.
+    '''
+    schema = "flat_bench"
+    engine = create_engine(database_uri, isolation_level="AUTOCOMMIT")
+    with engine.connect() as connection:
+        create_storage_schema(connection, schema, True, messages)
+
+        # Creating the users of the messages and the flattened table.
+        connection.execute(text(
+            f'CREATE TABLE {schema}."user" AS SELECT md5(user_index::text)::uuid::text AS id, '
+            f'user_index AS telegram_id, user_index % 10 AS app_id FROM generate_series(0, 999) AS user_index'
+        ))
+        connection.execute(text(f'ALTER TABLE {schema}."user" ADD PRIMARY KEY (id)'))
+        start = time.perf_counter()
+        connection.execute(text(f"CREATE TABLE {schema}.message_metrics_flat AS {flat_join(schema)}"))
+        connection.execute(text(f"ALTER TABLE {schema}.message_metrics_flat ADD PRIMARY KEY (id)"))
+        print(f"Flattened table built in {time.perf_counter() - start:.1f} s")
+        connection.execute(text("VACUUM ANALYZE"))
+
+        sources = {"join" : f"({flat_join(schema)}) AS rows", "flat" : f"{schema}.message_metrics_flat"}
+        print(f"{'query':<36} {'join':>12} {'flat':>12} {'speedup':>9}")
+        for name, query in FLAT_QUERIES.items():
+            times = dict()
+            for source_name, source in sources.items():
+                statement = text(query.format(source=source))
+                runs = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    connection.execute(statement).fetchall()
+                    runs.append(time.perf_counter() - start)
+                times[source_name] = min(runs)
+            print(f"{name:<36} {times['join'] * 1000:>10.1f}ms {times['flat'] * 1000:>10.1f}ms "
+                  f"{times['join'] / times['flat']:>8.1f}x")
+
+
+def signed_post(session : requests.Session, security_manager : SecurityManager, url : str, body : dict) -> int:
+    '''
+        This function sends a request signed like the chatbot services do.
+            :param session: requests.Session
+                The session of the client.
+            :param security_manager: SecurityManager
+                The Security Manager with the key of the warehouse.
+            :param url: str
+                The URL of the endpoint.
+            :param body: dict
+                The request body.
+            :return: int
+                The status code of the response.
+    '''
+    # The HMAC of the serialized body matches both the json and the raw modes.
+    raw_body = json.dumps(body).encode()
+    response = session.post(url, data=raw_body, headers={
+        "Token" : security_manager.encode_raw_hmac(raw_body),
+        "Content-Type" : "application/json"
+    })
+    return response.status_code
+
+
+def benchmark_load(url : str, endpoint : str, key : str, concurrency : int, duration : float) -> None:
+    '''
+        This function measures the sustained requests per second and the latency of a running warehouse.
+            :param url: str
+                The base URL of the warehouse.
+            :param endpoint: str
+                The endpoint loaded, 'metrics' or 'message'.
+            :param key: str
+                The secret key of the warehouse.
+            :param concurrency: int
+                The number of concurrent clients.
+            :param duration: float
+                The length of the measurement in seconds.
+    '''
+    security_manager = SecurityManager(key)
+
+    # The messages need an existing user.
+    user = sample_user()
+    if endpoint == "message":
+        user.update({
+            "user_id" : str(uuid.uuid4()),
+            "telegram_user_id" : uuid.uuid4().int % 2**31,
+            "chat_id" : uuid.uuid4().int % 2**31,
+            "telegram_username" : uuid.uuid4().hex,
+            "app_id" : uuid.uuid4().int % 2**31
+        })
+        assert signed_post(requests.Session(), security_manager, f"{url}/user", user) == 200
+
+    latencies = []
+    failures = []
+    deadline = time.monotonic() + duration
+
+    def client():
+        session = requests.Session()
+        client_latencies = []
+        client_failures = 0
+        while time.monotonic() < deadline:
+            if endpoint == "metrics":
+                body = sample_metrics()
+            else:
+                body = sample_message(entities=5)
+                body["telegram_user_id"] = user["telegram_user_id"]
+                body["time"] = time.time()
+            body["correlation_id"] = str(uuid.uuid4())
+            start = time.perf_counter()
+            status_code = signed_post(session, security_manager, f"{url}/{endpoint}", body)
+            client_latencies.append(time.perf_counter() - start)
+            client_failures += status_code != 200
+        latencies.extend(client_latencies)
+        failures.append(client_failures)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    print(f"{len(latencies)} requests, {sum(failures)} failed, {len(latencies) / duration:.1f} requests/s")
+    for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+        print(f"{name} {latencies[int(q * (len(latencies) - 1))] * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Microbenchmarks of the data warehouse request handling.")
+    parser.add_argument("benchmark", choices=["hmac", "schemas", "storage", "load", "flat"])
+    parser.add_argument("--number", type=int, default=1000, help="The number of calls per measurement.")
+    parser.add_argument("--database-uri", help="The sqlalchemy uri of a scratch Postgres database.")
+    parser.add_argument("--messages", type=int, default=1000000, help="The number of synthetic messages.")
+    parser.add_argument("--url", default="http://localhost:7777", help="The base URL of a running warehouse.")
+    parser.add_argument("--endpoint", choices=["metrics", "message"], default="metrics", help="The endpoint loaded.")
+    parser.add_argument("--key", default="data-warehouse-key", help="The secret key of the warehouse.")
+    parser.add_argument("--concurrency", type=int, default=32, help="The number of concurrent clients.")
+    parser.add_argument("--duration", type=float, default=60, help="The length of the load test in seconds.")
+    args = parser.parse_args()
+
+    if args.benchmark == "hmac":
+        benchmark_hmac(args.number)
+    elif args.benchmark == "schemas":
+        benchmark_schemas(args.number)
+    elif args.benchmark == "storage":
+        benchmark_storage(args.database_uri, args.messages)
+    elif args.benchmark == "load":
+        benchmark_load(args.url, args.endpoint, args.key, args.concurrency, args.duration)
+    elif args.benchmark == "flat":
+        benchmark_flat(args.database_uri, args.messages)
@@ -0,0 +1,239 @@
+# Importing all needed libraries.
+import threading
+import queue
+import time
+import logging
+
+from instrumentation import instrumentation
+from models import db
+
+
+# The logger of the module.
+logger = logging.getLogger(__name__)
+
+
+class PendingWrite:
+    def __init__(self, write, args : tuple, on_commit = None) -> None:
+        '''
+            The constructor of a write waiting in the Write-Behind Buffer.
+                :param write: callable
+                    The function adding the records to the database session.
+                :param args: tuple
+                    The arguments of the write function.
+                :param on_commit: callable, default = None
+                    The function called once the write is committed.
+        '''
+        self.write = write
+        self.args = args
+        self.on_commit = on_commit
+        self.done = threading.Event()
+        self.error = None
+
+
+class WriteBehindBuffer:
+    def __init__(self, app, max_queue_size : int = 10000, flush_size : int = 500,
+                 flush_interval_ms : int = 50, mode : str = "enqueue") -> None:
+        '''
+            The constructor of the Write-Behind Buffer.
+                :param app: Flask
+                    The flask application, used for the database session of the flusher.
+                :param max_queue_size: int, default = 10000
+                    The maximal number of writes waiting in the queue.
+                :param flush_size: int, default = 500
+                    The maximal number of writes committed in one transaction.
+                :param flush_interval_ms: int, default = 50
+                    The maximal time in milliseconds a write waits before being committed.
+                :param mode: str, default = 'enqueue'
+                    'enqueue' acknowledges the writes once queued,
+                    'commit' acknowledges them after their group is committed.
+        '''
+        if mode not in ("enqueue", "commit"):
+            raise ValueError(f"Unknown write-behind mode: {mode}")
+        self.app = app
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.mode = mode
+        self.queue = queue.Queue(maxsize=max_queue_size)
+
+        # The statistics of the buffer.
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.failed_writes = 0
+        self.written = 0
+        self.last_flush_size = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self) -> None:
+        '''
+            This function starts the flusher thread.
+        '''
+        self.thread.start()
+
+    def submit(self, write, *args, on_commit = None):
+        '''
+            This function queues a write for the flusher.
+                :param write: callable
+                    The function adding the records to the database session.
+                :param args: tuple
+                    The arguments of the write function.
+                :param on_commit: callable, default = None
+                    The function called by the flusher once the write is committed, not called if it fails.
+                :return: dict or None
+                    The error body if the write was rejected or failed, else None.
+        '''
+        if self.stop_event.is_set():
+            return {
+                "name" : "BufferStopped",
+                "cause" : "The write-behind buffer is stopped!"
+            }
+        pending = PendingWrite(write, args, on_commit)
+        try:
+            self.queue.put(pending, timeout=self.flush_interval)
+        except queue.Full:
+            return {
+                "name" : "QueueFull",
+                "cause" : "The write-behind queue is full!"
+            }
+
+        # In the commit mode the request waits for its group to be committed.
+        if self.mode == "commit":
+            pending.done.wait()
+            return pending.error
+        return None
+
+    def drain(self) -> list:
+        '''
+            This function takes the next group of writes from the queue.
+                :return: list
+                    The writes to commit together.
+                :raises queue.Empty:
+                    If no write was queued during the flush interval.
+        '''
+        group = [self.queue.get(timeout=self.flush_interval)]
+        deadline = time.monotonic() + self.flush_interval
+        while len(group) < self.flush_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                group.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return group
+
+    def flush(self, group : list) -> None:
+        '''
+            This function commits a group of writes in one transaction.
+                :param group: list
+                    The writes to commit.
+        '''
+        start = time.monotonic()
+        error = None
+        with self.app.app_context():
+            for pending in group:
+                # Every write runs in its own savepoint so a bad record doesn't reject the whole group.
+                try:
+                    with db.session.begin_nested():
+                        pending.write(*pending.args)
+                except Exception as e:
+                    pending.error = {
+                        "name" : e.__class__.__name__,
+                        "cause" : e.__cause__.__repr__()
+                    }
+
+            # Trying to commit the group.
+            commit_start = time.perf_counter()
+            try:
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.exception(f"Write-behind flush of {len(group)} writes failed")
+                error = {
+                    "name" : e.__class__.__name__,
+                    "cause" : e.__cause__.__repr__()
+                }
+            finally:
+                instrumentation.observe_commit(time.perf_counter() - commit_start, error is not None)
+                db.session.remove()
+
+        # Updating the statistics of the buffer.
+        latency = time.monotonic() - start
+        self.flushes += 1
+        self.last_flush_size = len(group)
+        self.last_flush_latency = latency
+        self.max_flush_latency = max(self.max_flush_latency, latency)
+        if error:
+            self.failed_flushes += 1
+            self.failed_writes += len(group)
+        else:
+            self.written += sum(1 for pending in group if pending.error is None)
+            # Running the callbacks of the committed writes, such as filling the caches.
+            for pending in group:
+                if pending.error is None and pending.on_commit is not None:
+                    try:
+                        pending.on_commit()
+                    except Exception:
+                        logger.exception("Write-behind commit callback failed")
+
+        # Waking up the requests waiting for the group.
+        for pending in group:
+            if error and pending.error is None:
+                pending.error = error
+            pending.done.set()
+
+    def run(self) -> None:
+        '''
+            This function is the loop of the flusher thread, it ends once stopped and the queue is empty.
+        '''
+        while True:
+            try:
+                group = self.drain()
+            except queue.Empty:
+                if self.stop_event.is_set():
+                    break
+                continue
+            self.flush(group)
+
+    def stop(self, timeout : float = 30) -> int:
+        '''
+            This function stops the intake of the buffer and waits for the queued writes to be committed.
+                :param timeout: float, default = 30
+                    The maximal number of seconds waited for the flusher.
+                :return: int
+                    The number of writes left in the queue, lost with the process.
+        '''
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join(timeout)
+
+        # The writes queued while the flusher was exiting are committed here.
+        if not self.thread.is_alive():
+            while not self.queue.empty():
+                self.flush(self.drain())
+        left = self.queue.qsize()
+        if left:
+            logger.warning(f"Write-behind buffer stopped with {left} writes not committed")
+        return left
+
+    def stats(self) -> dict:
+        '''
+            This function returns the statistics of the buffer.
+        '''
+        return {
+            "mode" : self.mode,
+            "queue_depth" : self.queue.qsize(),
+            "max_queue_size" : self.queue.maxsize,
+            "flush_size" : self.flush_size,
+            "flush_interval_ms" : self.flush_interval * 1000,
+            "flushes" : self.flushes,
+            "failed_flushes" : self.failed_flushes,
+            "failed_writes" : self.failed_writes,
+            "written" : self.written,
+            "last_flush_size" : self.last_flush_size,
+            "last_flush_latency_ms" : self.last_flush_latency * 1000,
+            "max_flush_latency_ms" : self.max_flush_latency * 1000
+        }
@@ -0,0 +1,106 @@
+# Importing all needed libraries.
+from collections import OrderedDict
+import threading
+
+from models import UserModel
+
+
+class LRUCache:
+    def __init__(self, capacity : int) -> None:
+        '''
+            The constructor of the LRU Cache.
+                :param capacity: int
+                    The maximal number of entries kept in the cache.
+        '''
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        '''
+            This function returns the cached value of the key or None if it's missing.
+                :param key: hashable
+                    The key of the entry.
+        '''
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value) -> None:
+        '''
+            This function caches the value of the key, evicting the least recently used entry if needed.
+                :param key: hashable
+                    The key of the entry.
+                :param value: object
+                    The value of the entry.
+        '''
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class UserIdCache(LRUCache):
+    def warm(self) -> None:
+        '''
+            This function fills the cache from the User table.
+        '''
+        users = UserModel.query.with_entities(UserModel.telegram_id, UserModel.id).limit(self.capacity).all()
+        for telegram_id, user_id in users:
+            self.put(telegram_id, user_id)
+
+    def resolve(self, telegram_id : int):
+        '''
+            This function returns the id of the user with the telegram id, looking up the database on a miss.
+                :param telegram_id: int
+                    The telegram id of the user.
+                :return: str or None
+                    The id of the user or None if the user is unknown.
+        '''
+        user_id = self.get(telegram_id)
+        if user_id is None:
+            user = UserModel.query.filter_by(telegram_id=telegram_id).first()
+            if user is None:
+                return None
+            user_id = user.id
+            self.put(telegram_id, user_id)
+        return user_id
+
+
+class RecentKeySet:
+    def __init__(self, capacity : int) -> None:
+        '''
+            The constructor of the Recent Key Set, remembering at least the last capacity / 2 keys added.
+            The keys are kept in two generations, the older one is dropped when the newer one is full.
+            Unlike a Bloom filter it has no false positives, so a new key is never taken for a seen one.
+                :param capacity: int
+                    The maximal number of keys kept.
+        '''
+        self.generation_size = max(capacity // 2, 1)
+        self.current = set()
+        self.previous = set()
+        self.lock = threading.Lock()
+
+    def __contains__(self, key) -> bool:
+        return key in self.current or key in self.previous
+
+    def add(self, key) -> None:
+        '''
+            This function remembers the key, rotating the generations if the current one is full.
+                :param key: hashable
+                    The key.
+        '''
+        with self.lock:
+            if len(self.current) >= self.generation_size:
+                self.previous = self.current
+                self.current = set()
+            self.current.add(key)
+
+    def __len__(self) -> int:
+        return len(self.current) + len(self.previous)
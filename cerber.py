@@ -4,14 +4,25 @@ import hmac
 import hashlib
 
 
+# The supported HMAC modes.
+HMAC_MODES = ("json", "raw", "raw+json")
+
+
 class SecurityManager:
-    def __init__(self, key : str) -> None:
+    def __init__(self, key : str, hmac_mode : str = "json") -> None:
         '''
             This function creates and sets up the Security Manager.
                 :param key: str
                     The secret key of the service used for HMAC.
+                :param hmac_mode: str, default = 'json'
+                    'json' computes the HMAC over the json.dumps form of the parsed body,
+                    'raw' computes it over the raw body bytes,
+                    'raw+json' accepts both, for senders still signing the json.dumps form.
         '''
+        if hmac_mode not in HMAC_MODES:
+            raise ValueError(f"Unknown HMAC mode: {hmac_mode}")
         self.key = str.encode(key)
+        self.hmac_mode = hmac_mode
 
     def __encode_hmac(self, request_body) -> str:
         '''
@@ -26,6 +37,44 @@ class SecurityManager:
 
         return json_hmac
 
+    def encode_raw_hmac(self, raw_body : bytes) -> str:
+        '''
+            This function calculates the HMAC of the raw request body and returns it.
+                :param raw_body: bytes
+                    The raw body of the request.
+                :return: str
+                    The HMAC of the request body.
+        '''
+        return hmac.new(self.key, raw_body, hashlib.sha256).hexdigest()
+
+    def verify_raw(self, token : str, raw_body : bytes) -> bool:
+        '''
+            This function authenticates the raw request body.
+                :param token: str
+                    The token sent with the request from the headers.
+                :param raw_body: bytes
+                    The raw body of the request.
+        '''
+        return hmac.compare_digest(str.encode(token), str.encode(self.encode_raw_hmac(raw_body)))
+
+    def raw_hmac(self):
+        '''
+            This function returns a new HMAC of a raw body, updated with the chunks of a streamed body as they are read.
+                :return: hmac.HMAC
+                    The running HMAC.
+        '''
+        return hmac.new(self.key, digestmod=hashlib.sha256)
+
+    def verify_raw_hmac(self, token : str, digest) -> bool:
+        '''
+            This function authenticates a streamed body with its running HMAC, once the body is read.
+                :param token: str
+                    The token sent with the request from the headers.
+                :param digest: hmac.HMAC
+                    The running HMAC of the body.
+        '''
+        return hmac.compare_digest(str.encode(token), str.encode(digest.hexdigest()))
+
     def verify(self, token : str, request_body : dict) -> bool:
         '''
             This function authenticates the request body.
@@ -38,10 +87,7 @@ class SecurityManager:
         request_hmac = self.__encode_hmac(request_body)
 
         # Verifying the request HMAC.
-        if token == request_hmac:
-            return True
-        else:
-            return False
+        return hmac.compare_digest(str.encode(token), str.encode(request_hmac))
 
     def check_access_token(self, header_dict : dict):
         '''
@@ -57,6 +103,22 @@ class SecurityManager:
         else:
             return "OK"
 
+    def verify_request(self, token : str, request) -> bool:
+        '''
+            This function authenticates the request body according to the HMAC mode.
+            In the raw modes the body bytes are cached by flask, so request.json parses them only once.
+                :param token: str
+                    The token sent with the request from the headers.
+                :param request: Request
+                    The flask request.
+        '''
+        if self.hmac_mode == "json":
+            return self.verify(token, request.json)
+        elif self.verify_raw(token, request.get_data(cache=True)):
+            return True
+        else:
+            return self.hmac_mode == "raw+json" and self.verify(token, request.json)
+
     def check_request(self, request):
         '''
             This function implements the HMAC authentication of the request.
@@ -66,7 +128,7 @@ class SecurityManager:
 
         if check_response != "OK":
             return check_response
-        elif not self.verify(request.headers["token"], request.json):
+        elif not self.verify_request(request.headers["token"], request):
             # If the request didn't passed the HMAC authentication a 401 status error code is returned.
             return {
                 "message" : "401 Unauthorized",
@@ -0,0 +1,223 @@
+# Importing all needed libraries.
+import threading
+import time
+import logging
+
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+
+from models import db, DateModel, COMPACT_KEYS
+from caches import LRUCache
+from utils import unix_to_date_columns, HOLIDAY_DAYS_LIST
+
+# The logger of the module.
+logger = logging.getLogger(__name__)
+
+
+# The number of seconds in a day.
+DAY_SECONDS = 86400
+
+
+class DateDimension:
+    def __init__(self, bucket_seconds : int = 60, history_days : int = 1, premake_days : int = 7,
+                 key_cache_size : int = 100000) -> None:
+        '''
+            The constructor of the Date Dimension.
+            Every row of the Date table is a time bucket keyed by the UNIX time of its start,
+            so all the messages sent in the same bucket share one Date record.
+            Only a short horizon around the current day is pre-populated, and moved forward by the leader worker.
+                :param bucket_seconds: int, default = 60
+                    The length of a time bucket in seconds.
+                :param history_days: int, default = 1
+                    The number of days before the current one pre-populated in the Date table.
+                :param premake_days: int, default = 7
+                    The number of days after the current one pre-populated in the Date table.
+                :param key_cache_size: int, default = 100000
+                    The maximal number of keys outside of the populated range remembered as existing.
+        '''
+        self.bucket_seconds = bucket_seconds
+        self.history_days = history_days
+        self.premake_days = premake_days
+
+        # The range of the buckets known to exist, checked arithmetically, and the cache of the other existing keys.
+        self.range_start = 0
+        self.range_end = 0
+        self.keys = LRUCache(key_cache_size)
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+
+    def key(self, unix : float) -> int:
+        '''
+            This function returns the key of the time bucket of a UNIX timestamp.
+                :param unix: float
+                    The UNIX timestamp.
+                :return: int
+                    The UNIX time of the start of the bucket.
+        '''
+        return int(unix // self.bucket_seconds) * self.bucket_seconds
+
+    def date_id(self, key : int):
+        '''
+            This function converts the key of a time bucket into the id of its Date record.
+                :param key: int
+                    The key of the time bucket.
+                :return: int or str
+                    The key itself for the BIGINT keys, else its text.
+        '''
+        return key if COMPACT_KEYS else str(key)
+
+    def records(self, keys : list) -> list:
+        '''
+            This function computes the Date rows of the time buckets.
+                :param keys: list
+                    The keys of the time buckets.
+                :return: list
+                    The Date rows.
+        '''
+        columns = {name : column.tolist() for name, column in unix_to_date_columns(keys).items()}
+        columns["id"] = [self.date_id(key) for key in keys]
+        return [dict(zip(columns, row)) for row in zip(*columns.values())]
+
+    def insert_buckets(self, keys : list) -> None:
+        '''
+            This function inserts the Date rows of the time buckets, skipping the existing ones.
+            The rows are committed on their own connection, so they exist even if the caller rolls back.
+                :param keys: list
+                    The keys of the time buckets.
+        '''
+        statement = insert(DateModel.__table__).values(self.records(keys))
+        with db.engine.begin() as connection:
+            connection.execute(statement.on_conflict_do_nothing(index_elements=["id"]))
+
+    def horizon(self, now : float = None) -> tuple:
+        '''
+            This function returns the range of the buckets pre-populated around the current day.
+                :param now: float, default = None
+                    The current UNIX time, the current time if None.
+                :return: tuple
+                    The start and the exclusive end of the range, both at midnight UTC.
+        '''
+        today = int((time.time() if now is None else now) // DAY_SECONDS) * DAY_SECONDS
+        return today - self.history_days * DAY_SECONDS, today + (self.premake_days + 1) * DAY_SECONDS
+
+    def range_statement(self, start : int, end : int) -> str:
+        '''
+            This function returns the statement inserting the missing Date rows of a range of buckets.
+            The rows are generated by Postgres, with the same columns as the records computed in Python.
+            The statement has no parameters, so it's run as is by SQLAlchemy and asyncpg.
+                :param start: int
+                    The key of the first bucket.
+                :param end: int
+                    The exclusive end of the range.
+        '''
+        # The holidays of the range, as days since the UNIX epoch.
+        holidays = [day for day in HOLIDAY_DAYS_LIST if start // DAY_SECONDS <= day <= end // DAY_SECONDS]
+        id_expression = "key" if COMPACT_KEYS else "CAST(key AS varchar)"
+        return f'''
+            INSERT INTO date (id, date, month, month_str, year, hour, minute, seconds, day_of_week, is_weekend, is_holiday)
+            SELECT {id_expression},
+                   CAST(moment AS date),
+                   extract(month FROM moment),
+                   to_char(moment, 'FMMonth'),
+                   extract(year FROM moment),
+                   extract(hour FROM moment),
+                   extract(minute FROM moment),
+                   floor(extract(second FROM moment)),
+                   extract(isodow FROM moment),
+                   extract(isodow FROM moment) >= 6,
+                   CAST(key / {DAY_SECONDS} AS integer) = ANY(CAST(ARRAY[{", ".join(map(str, holidays))}] AS integer[]))
+            FROM generate_series(CAST({start} AS bigint), CAST({end - 1} AS bigint), CAST({self.bucket_seconds} AS bigint)) AS key,
+                 LATERAL (SELECT to_timestamp(key) AT TIME ZONE 'UTC' AS moment) AS bucket
+            ON CONFLICT (id) DO NOTHING
+        '''
+
+    def set_range(self, start : int, end : int) -> None:
+        '''
+            This function records a populated range of buckets, merged with the known one when they overlap.
+                :param start: int
+                    The key of the first bucket.
+                :param end: int
+                    The exclusive end of the range.
+        '''
+        with self.lock:
+            if self.range_start <= end and start <= self.range_end:
+                self.range_start, self.range_end = min(self.range_start, start), max(self.range_end, end)
+            else:
+                self.range_start, self.range_end = start, end
+
+    def populate(self, now : float = None) -> None:
+        '''
+            This function pre-populates the Date table for the horizon around the current day.
+            Nothing is inserted if the first and the last bucket of the horizon already exist.
+                :param now: float, default = None
+                    The current UNIX time, the current time if None.
+        '''
+        start, end = self.horizon(now)
+        last_key = self.key(end - 1)
+        existing = DateModel.query.filter(DateModel.id.in_([self.date_id(start), self.date_id(last_key)])).count()
+        if existing < 2:
+            with db.engine.begin() as connection:
+                connection.execute(text(self.range_statement(start, end)))
+        self.set_range(start, end)
+
+    def run(self, app, check_interval : float) -> None:
+        '''
+            This function is the loop of the thread moving the horizon forward.
+                :param app: Flask
+                    The flask application, used for the database connection.
+                :param check_interval: float
+                    The number of seconds between two checks of the horizon.
+        '''
+        while not self.stop_event.wait(check_interval):
+            with app.app_context():
+                try:
+                    self.populate()
+                except Exception:
+                    logger.exception("Date dimension population failed")
+
+    def start(self, app, check_interval : float = 3600) -> None:
+        '''
+            This function starts the thread moving the horizon forward.
+                :param app: Flask
+                    The flask application, used for the database connection.
+                :param check_interval: float, default = 3600
+                    The number of seconds between two checks of the horizon.
+        '''
+        threading.Thread(target=self.run, args=(app, check_interval), daemon=True).start()
+
+    def stop(self) -> None:
+        '''
+            This function stops the thread moving the horizon forward.
+        '''
+        self.stop_event.set()
+
+    def lookup(self, unix : float) -> str:
+        '''
+            This function returns the id of the Date record of a UNIX timestamp,
+            inserting the record only if it is outside of the populated range and not seen recently.
+                :param unix: float
+                    The UNIX timestamp.
+                :return: int or str
+                    The id of the Date record.
+        '''
+        return self.lookup_many([unix])[0]
+
+    def lookup_many(self, unix_list : list) -> list:
+        '''
+            This function returns the ids of the Date records of UNIX timestamps,
+            inserting the records outside of the populated range and not seen recently in one statement.
+                :param unix_list: list
+                    The UNIX timestamps.
+                :return: list
+                    The ids of the Date records.
+        '''
+        keys = [self.key(unix) for unix in unix_list]
+        missing = sorted({
+            key for key in keys
+            if not self.range_start <= key < self.range_end and self.keys.get(key) is None
+        })
+        if missing:
+            self.insert_buckets(missing)
+            for key in missing:
+                self.keys.put(key, True)
+        return [self.date_id(key) for key in keys]
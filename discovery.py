@@ -0,0 +1,224 @@
+# Importing all needed libraries.
+from requests.adapters import HTTPAdapter
+import threading
+import requests
+import random
+import time
+import logging
+
+from cerber import SecurityManager
+
+
+# The logger of the module.
+logger = logging.getLogger(__name__)
+
+
+class ServiceDiscoveryClient:
+    def __init__(self, host : str, port : int, register_endpoint : str, secret_key : str, name : str,
+                 info : dict, heartbeat_interval : float = 30, timeout : float = 5,
+                 backoff_base : float = 0.5, backoff_max : float = 60, load_provider = None,
+                 min_heartbeat_interval : float = None, max_heartbeat_interval : float = None,
+                 change_threshold : float = 0.5) -> None:
+        '''
+            The constructor of the Service Discovery Client, registering the warehouse and sending its heartbeats
+            from a background thread, so the warehouse serves requests while the service discovery is down.
+                :param host: str
+                    The host of the service discovery.
+                :param port: int
+                    The port of the service discovery.
+                :param register_endpoint: str
+                    The registration endpoint of the service discovery.
+                :param secret_key: str
+                    The key of the service discovery HMAC.
+                :param name: str
+                    The name of the warehouse in the service discovery.
+                :param info: dict
+                    The registration request body.
+                :param heartbeat_interval: float, default = 30
+                    The number of seconds between two heartbeats.
+                :param timeout: float, default = 5
+                    The timeout of a request in seconds.
+                :param backoff_base: float, default = 0.5
+                    The first delay between two failed registrations in seconds.
+                :param backoff_max: float, default = 60
+                    The maximal delay between two failed registrations in seconds.
+                :param load_provider: callable, default = None
+                    The function returning the load signals sent with every heartbeat.
+                :param min_heartbeat_interval: float, default = None
+                    The number of seconds between two heartbeats while the load changes, the heartbeat interval if None.
+                :param max_heartbeat_interval: float, default = None
+                    The number of seconds between two heartbeats while idle, the heartbeat interval if None.
+                :param change_threshold: float, default = 0.5
+                    The relative change of a load signal making the next heartbeat come sooner.
+        '''
+        self.base_url = f"http://{host}:{port}"
+        self.register_endpoint = register_endpoint
+        self.security_manager = SecurityManager(secret_key)
+        self.name = name
+        self.info = info
+        self.heartbeat_interval = heartbeat_interval
+        self.min_heartbeat_interval = min_heartbeat_interval or heartbeat_interval
+        self.max_heartbeat_interval = max_heartbeat_interval or heartbeat_interval
+        self.change_threshold = change_threshold
+        self.load_provider = load_provider
+        self.last_load = None
+        self.timeout = timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        # One kept-alive connection is enough for the registration and the heartbeats.
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        # The statistics of the client.
+        self.registered = False
+        self.registration_attempts = 0
+        self.registration_seconds = None
+        self.heartbeats_sent = 0
+        self.heartbeat_failures = 0
+        self.last_heartbeat_status = None
+        self.next_heartbeat_interval = heartbeat_interval
+
+    def backoff_delay(self, attempt : int) -> float:
+        '''
+            This function returns the jittered exponential delay before the next attempt.
+                :param attempt: int
+                    The number of failed attempts so far.
+        '''
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def post(self, path : str, body : dict) -> int:
+        '''
+            This function sends a signed request to the service discovery.
+                :param path: str
+                    The path of the endpoint.
+                :param body: dict
+                    The request body.
+                :return: int
+                    The status code of the response, None if the service discovery wasn't reached.
+        '''
+        try:
+            response = self.session.post(
+                f"{self.base_url}/{path}",
+                json=body,
+                headers={"Token" : self.security_manager._SecurityManager__encode_hmac(body)},
+                timeout=self.timeout
+            )
+        except requests.RequestException:
+            return None
+        return response.status_code
+
+    def register(self) -> bool:
+        '''
+            This function registers the warehouse, retrying with backoff until it succeeds or the client stops.
+                :return: bool
+                    True if the warehouse is registered.
+        '''
+        start = time.monotonic()
+        attempt = 0
+        while not self.stop_event.is_set():
+            self.registration_attempts += 1
+            if self.post(self.register_endpoint, self.info) == 200:
+                self.registered = True
+                self.registration_seconds = time.monotonic() - start
+                return True
+            self.stop_event.wait(self.backoff_delay(attempt))
+            attempt += 1
+        return False
+
+    def heartbeat_body(self) -> dict:
+        '''
+            This function returns the body of the next heartbeat, with the load signals if there is a load provider.
+        '''
+        if self.load_provider is None:
+            return {"status_code" : 200}
+        try:
+            load = self.load_provider()
+        except Exception:
+            logger.exception("Load signals failed")
+            return {"status_code" : 200}
+
+        self.next_heartbeat_interval = self.adapt_interval(self.last_load, load)
+        self.last_load = load
+        return {"status_code" : 200, "load" : load, "next_heartbeat_seconds" : self.next_heartbeat_interval}
+
+    def adapt_interval(self, previous : dict, load : dict) -> float:
+        '''
+            This function returns the delay before the next heartbeat:
+            short when a load signal changed a lot, long when the warehouse is idle, else the regular one.
+                :param previous: dict
+                    The load signals of the previous heartbeat, None for the first one.
+                :param load: dict
+                    The current load signals.
+        '''
+        if not any(load.values()):
+            return self.max_heartbeat_interval
+        if previous is None:
+            return self.heartbeat_interval
+        for name, value in load.items():
+            previous_value = previous.get(name) or 0
+            value = value or 0
+            if abs(value - previous_value) > self.change_threshold * max(abs(value), abs(previous_value), 1e-9):
+                return self.min_heartbeat_interval
+        return self.heartbeat_interval
+
+    def send_heartbeat(self) -> int:
+        '''
+            This function sends a heartbeat to the service discovery.
+                :return: int
+                    The status code of the response, None if the service discovery wasn't reached.
+        '''
+        status_code = self.post(f"heartbeat/{self.name}", self.heartbeat_body())
+        self.last_heartbeat_status = status_code
+        if status_code == 200:
+            self.heartbeats_sent += 1
+        else:
+            self.heartbeat_failures += 1
+        return status_code
+
+    def run(self) -> None:
+        '''
+            This function is the loop of the client thread.
+        '''
+        if not self.register():
+            return
+        while not self.stop_event.wait(self.next_heartbeat_interval):
+            # A service discovery restarted without the registrations doesn't know the warehouse anymore.
+            if self.send_heartbeat() == 404:
+                self.registered = False
+                if not self.register():
+                    return
+
+    def start(self) -> None:
+        '''
+            This function starts the client thread and returns immediately.
+        '''
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout : float = None) -> None:
+        '''
+            This function stops the client thread and closes its connection.
+                :param timeout: float, default = None
+                    The maximal number of seconds to wait for the thread, the request timeout if None.
+        '''
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(self.timeout if timeout is None else timeout)
+        self.session.close()
+
+    def stats(self) -> dict:
+        '''
+            This function returns the statistics of the client.
+        '''
+        return {
+            "registered" : self.registered,
+            "registration_attempts" : self.registration_attempts,
+            "registration_seconds" : self.registration_seconds,
+            "heartbeats_sent" : self.heartbeats_sent,
+            "heartbeat_failures" : self.heartbeat_failures,
+            "last_heartbeat_status" : self.last_heartbeat_status
+        }
+
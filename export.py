@@ -0,0 +1,275 @@
+# Importing all needed libraries.
+from datetime import datetime, timezone
+import json
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import text, types
+
+from models import db, MessagesModel, DateModel, UserModel, LatencyModel, TrafficModel, ErrorsModel, SaturationModel, \
+    MessageServiceMetricsModel, MessageMetricsFlatTable
+from watermarks import committed_until, EXPORT_APPLICATION_NAME
+
+# The tables which can be exported, with their columns and the column of the time range, None if they have none.
+# The messages_wide view is the fact table with the metrics links of both link modes.
+EXPORT_TABLES = {
+    "messages" : (MessagesModel.__table__, "updated_at"),
+    "messages_wide" : (MessagesModel.__table__, "updated_at"),
+    "date" : (DateModel.__table__, None),
+    "user" : (UserModel.__table__, None),
+    "latency" : (LatencyModel.__table__, "ingested_at"),
+    "traffic" : (TrafficModel.__table__, "ingested_at"),
+    "errors" : (ErrorsModel.__table__, "ingested_at"),
+    "saturation" : (SaturationModel.__table__, "ingested_at"),
+    "message_service_metrics" : (MessageServiceMetricsModel.__table__, "linked_at"),
+    "message_metrics_flat" : (MessageMetricsFlatTable, "refreshed_at")
+}
+
+# The content types of the export formats.
+EXPORT_FORMATS = {
+    "parquet" : "application/vnd.apache.parquet",
+    "arrow" : "application/vnd.apache.arrow.stream"
+}
+
+
+def arrow_type(column_type) -> pa.DataType:
+    '''
+        This function returns the Arrow type of a column, the JSON columns are exported as text.
+            :param column_type: sqlalchemy.types.TypeEngine
+                The type of the column.
+    '''
+    if isinstance(column_type, types.BigInteger):
+        return pa.int64()
+    elif isinstance(column_type, types.Integer):
+        return pa.int32()
+    elif isinstance(column_type, types.Float):
+        return pa.float64()
+    elif isinstance(column_type, types.Boolean):
+        return pa.bool_()
+    elif isinstance(column_type, types.DateTime):
+        return pa.timestamp("us", tz="UTC")
+    elif isinstance(column_type, types.Date):
+        return pa.date32()
+    return pa.string()
+
+
+def parse_time(value : str) -> datetime:
+    '''
+        This function parses a bound of the time range, a unix timestamp or an ISO 8601 date and time in UTC.
+            :param value: str
+                The bound given by the user.
+    '''
+    try:
+        return datetime.fromtimestamp(float(value), tz=timezone.utc)
+    except ValueError:
+        moment = datetime.fromisoformat(value)
+        return moment if moment.tzinfo is not None else moment.replace(tzinfo=timezone.utc)
+
+
+class ChunkSink:
+    def __init__(self) -> None:
+        '''
+            The constructor of the Chunk Sink, the output file of the writers streamed to the client.
+            The written bytes are kept until they are taken by the stream.
+        '''
+        self.buffer = bytearray()
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.buffer += data
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def take(self) -> bytes:
+        '''
+            This function returns the bytes written since the last call.
+        '''
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+class TableExport:
+    def __init__(self, table_name : str, columns : list = None, since : str = None, until : str = None,
+                 incremental : str = None, export_format : str = "parquet", batch_size : int = 10000,
+                 lag_seconds : float = 30) -> None:
+        '''
+            The constructor of the export of a table, checking the options before anything is read.
+                :param table_name: str
+                    The name of the exported table or view.
+                :param columns: list, default = None
+                    The names of the exported columns, all of them if None.
+                :param since: str, default = None
+                    The exclusive start of the time range, a unix timestamp or an ISO 8601 date and time.
+                :param until: str, default = None
+                    The inclusive end of the time range.
+                :param incremental: str, default = None
+                    The name of an incremental export, the rows changed since its last export are exported.
+                :param export_format: str, default = 'parquet'
+                    The file format, 'parquet' or 'arrow'.
+                :param batch_size: int, default = 10000
+                    The number of rows fetched and written at once.
+                :param lag_seconds: float, default = 30
+                    The minimal age of the newest rows of an incremental export, they are also older than the start of the open transactions.
+                :raises ValueError:
+                    If an option is invalid.
+        '''
+        if table_name not in EXPORT_TABLES:
+            raise ValueError(f"The table must be one of {', '.join(EXPORT_TABLES)}!")
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"The format must be one of {', '.join(EXPORT_FORMATS)}!")
+        if batch_size <= 0:
+            raise ValueError("The batch size must be positive!")
+        table, self.time_column = EXPORT_TABLES[table_name]
+        if self.time_column is None and (since or until or incremental):
+            raise ValueError(f"The {table_name} table has no time column!")
+        if incremental is not None and (since or len(incremental) > 128):
+            raise ValueError("An incremental export has a name of at most 128 characters and no start!")
+
+        # Pruning the columns.
+        self.columns = [column for column in table.columns if columns is None or column.name in columns]
+        unknown = set(columns or []) - {column.name for column in self.columns}
+        if unknown or not self.columns:
+            raise ValueError(f"Unknown columns: {', '.join(sorted(unknown))}!")
+
+        self.table_name = table_name
+        self.since = parse_time(since) if since else None
+        self.until = parse_time(until) if until else None
+        self.incremental = incremental
+        self.export_format = export_format
+        self.batch_size = batch_size
+        self.lag_seconds = lag_seconds
+        self.schema = pa.schema([(column.name, arrow_type(column.type)) for column in self.columns])
+        self.rows = 0
+
+    def time_range(self, connection) -> None:
+        '''
+            This function sets the time range of an incremental export, from its last export to now minus the lag.
+                :param connection: sqlalchemy.engine.Connection
+                    The connection to the database.
+        '''
+        self.since = connection.execute(text(
+            "SELECT high_water_mark FROM export_state WHERE name = :name"
+        ), {"name" : self.incremental}).scalar()
+        if self.until is None:
+            self.until = committed_until(connection, self.lag_seconds)
+
+    def query(self) -> tuple:
+        '''
+            This function builds the query of the exported rows.
+                :return: tuple
+                    The statement and its parameters.
+        '''
+        conditions = []
+        if self.since is not None:
+            conditions.append(f"{self.time_column} > :since")
+        if self.until is not None:
+            conditions.append(f"{self.time_column} <= :until")
+        statement = f"SELECT {', '.join(column.name for column in self.columns)} FROM \"{self.table_name}\""
+        if conditions:
+            statement += f" WHERE {' AND '.join(conditions)}"
+        return statement, {"since" : self.since, "until" : self.until}
+
+    def record_batches(self):
+        '''
+            This function reads the rows through a server-side cursor and yields them as Arrow record batches,
+            so only one batch is in memory at a time.
+        '''
+        json_columns = [index for index, column in enumerate(self.columns) if isinstance(column.type, types.JSON)]
+        with db.engine.connect() as connection:
+            # Naming the read transaction, so the high-water marks of the other jobs don't wait for it to end.
+            connection.execute(
+                text("SELECT set_config('application_name', :name, true)"), {"name" : EXPORT_APPLICATION_NAME}
+            )
+            if self.incremental is not None:
+                self.time_range(connection)
+            statement, parameters = self.query()
+            result = connection.execution_options(stream_results=True, max_row_buffer=self.batch_size) \
+                               .execute(text(statement), parameters)
+            for rows in result.partitions(self.batch_size):
+                values = list(zip(*rows))
+                for index in json_columns:
+                    values[index] = [None if value is None else json.dumps(value) for value in values[index]]
+                self.rows += len(rows)
+                yield pa.RecordBatch.from_arrays(
+                    [pa.array(column_values, type=field.type) for column_values, field in zip(values, self.schema)],
+                    schema=self.schema
+                )
+
+    def open_writer(self, sink):
+        '''
+            This function opens the writer of the export format.
+                :param sink: str or file-like object
+                    The path or the file the export is written to.
+        '''
+        if self.export_format == "parquet":
+            return pq.ParquetWriter(sink, self.schema, compression="zstd")
+        return pa.ipc.new_stream(sink, self.schema)
+
+    def write_batch(self, writer, batch : pa.RecordBatch) -> None:
+        '''
+            This function writes a record batch, as one row group of a Parquet file.
+                :param writer: pyarrow.parquet.ParquetWriter or pyarrow.ipc.RecordBatchStreamWriter
+                    The writer of the export.
+                :param batch: pyarrow.RecordBatch
+                    The record batch.
+        '''
+        if self.export_format == "parquet":
+            writer.write_table(pa.Table.from_batches([batch]))
+        else:
+            writer.write_batch(batch)
+
+    def save_high_water_mark(self) -> None:
+        '''
+            This function saves the end of the time range of a completed incremental export.
+        '''
+        if self.incremental is None or self.until is None:
+            return
+        with db.engine.begin() as connection:
+            connection.execute(text(
+                "INSERT INTO export_state (name, table_name, high_water_mark, rows, exported_at) "
+                "VALUES (:name, :table_name, :until, :rows, now()) "
+                "ON CONFLICT (name) DO UPDATE SET table_name = excluded.table_name, "
+                "high_water_mark = excluded.high_water_mark, rows = excluded.rows, exported_at = excluded.exported_at"
+            ), {"name" : self.incremental, "table_name" : self.table_name, "until" : self.until, "rows" : self.rows})
+
+    def write(self, path : str) -> int:
+        '''
+            This function writes the export to a file.
+                :param path: str
+                    The path of the file.
+                :return: int
+                    The number of exported rows.
+        '''
+        writer = self.open_writer(path)
+        try:
+            for batch in self.record_batches():
+                self.write_batch(writer, batch)
+        finally:
+            writer.close()
+        self.save_high_water_mark()
+        return self.rows
+
+    def stream(self):
+        '''
+            This function yields the bytes of the export as they are written, batch by batch.
+            The high-water mark of an incremental export is only saved once the last byte is produced.
+        '''
+        sink = ChunkSink()
+        writer = self.open_writer(sink)
+        for batch in self.record_batches():
+            self.write_batch(writer, batch)
+            yield sink.take()
+        writer.close()
+        yield sink.take()
+        self.save_high_water_mark()
@@ -0,0 +1,200 @@
+# Importing all needed libraries.
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import logging
+
+from sqlalchemy import text
+
+from models import db, FLAT_MESSAGE_COLUMNS, FLAT_METRIC_TABLES, FLAT_METRIC_PREFIXES, flat_metric_columns
+from watermarks import committed_until
+
+# The logger of the module.
+logger = logging.getLogger(__name__)
+
+
+# The names of the source tables in the query of the Message Metrics Flat rows.
+SOURCE_ALIASES = {"messages" : "messages", "date" : "date", "user" : '"user"'}
+
+
+def flat_query() -> tuple:
+    '''
+        This function builds the query upserting the Message Metrics Flat rows of the messages matching a condition.
+        The metrics links are read from the messages_wide view, so both the wide and the long links are inlined.
+            :return: tuple
+                The list of the columns and the statement, with a '{condition}' placeholder on the messages.
+    '''
+    columns = ["id"]
+    expressions = ["messages.id"]
+    for source, names in FLAT_MESSAGE_COLUMNS.items():
+        for name in names:
+            columns.append(name)
+            expressions.append(f"{SOURCE_ALIASES[source]}.{name}")
+
+    # Joining every metrics table once per service prefix.
+    joins = ['LEFT JOIN date ON date.id = messages.date_id', 'LEFT JOIN "user" ON "user".id = messages.user_id']
+    for prefix in FLAT_METRIC_PREFIXES:
+        for table_name, table in FLAT_METRIC_TABLES.items():
+            alias = f"{prefix}_{table_name}"
+            joins.append(f"LEFT JOIN {table_name} AS {alias} ON {alias}.id = messages.{alias}_id")
+            for column in flat_metric_columns(table):
+                columns.append(f"{prefix}_{column.name}")
+                expressions.append(f"{alias}.{column.name}")
+    columns.append("refreshed_at")
+    expressions.append("now()")
+
+    replaces = ", ".join(f"{column} = excluded.{column}" for column in columns if column != "id")
+    statement = f"INSERT INTO message_metrics_flat ({', '.join(columns)}) " \
+                f"SELECT {', '.join(expressions)} FROM messages_wide AS messages {' '.join(joins)} " \
+                f"WHERE {{condition}} ON CONFLICT (id) DO UPDATE SET {replaces}"
+    return columns, statement
+
+
+# The columns of the Message Metrics Flat table and the statement upserting its rows.
+FLAT_COLUMNS, FLAT_STATEMENT = flat_query()
+
+# The condition selecting the messages changed in a time range, in the Messages table or by a long metrics link.
+CHANGED_CONDITION = '''messages.id IN (
+    SELECT id FROM messages WHERE updated_at > :lower AND updated_at <= :upper
+    UNION
+    SELECT correlation_id FROM message_service_metrics WHERE linked_at > :lower AND linked_at <= :upper
+)'''
+
+
+class FlatMetricsManager:
+    def __init__(self, lag_seconds : float = 30) -> None:
+        '''
+            The constructor of the Flat Metrics Manager, maintaining the Message Metrics Flat table.
+                :param lag_seconds: float, default = 30
+                    The minimal age of the newest changes refreshed, they are also older than the start of the open transactions.
+        '''
+        self.lag_seconds = lag_seconds
+        self.stop_event = threading.Event()
+
+    def refresh(self) -> tuple:
+        '''
+            This function upserts the rows of the messages changed since the high-water mark.
+                :return: tuple
+                    The previous and the new high-water marks.
+        '''
+        with db.engine.begin() as connection:
+            # Only one process refreshes or rebuilds the table at a time.
+            connection.execute(text("SELECT pg_advisory_xact_lock(hashtext('message_metrics_flat'))"))
+
+            # Getting the range of the changes not refreshed yet.
+            lower = connection.execute(text(
+                "SELECT high_water_mark FROM rollup_state WHERE name = 'message_metrics_flat'"
+            )).scalar()
+            if lower is None:
+                lower = connection.execute(text("SELECT CAST('epoch' AS timestamptz)")).scalar()
+            upper = committed_until(connection, self.lag_seconds)
+            if upper <= lower:
+                return lower, lower
+
+            # Upserting the changed messages and moving the high-water mark in the same transaction.
+            connection.execute(
+                text(FLAT_STATEMENT.format(condition=CHANGED_CONDITION)), {"lower" : lower, "upper" : upper}
+            )
+            self.set_high_water_mark(connection, upper)
+        return lower, upper
+
+    def set_high_water_mark(self, connection, upper) -> None:
+        '''
+            This function saves the moment of the newest change in the Message Metrics Flat table.
+                :param connection: sqlalchemy.engine.Connection
+                    The connection to the database.
+                :param upper: datetime
+                    The new high-water mark.
+        '''
+        connection.execute(text(
+            "INSERT INTO rollup_state (name, high_water_mark) VALUES ('message_metrics_flat', :upper) "
+            "ON CONFLICT (name) DO UPDATE SET high_water_mark = excluded.high_water_mark"
+        ), {"upper" : upper})
+
+    def rebuild_chunk(self, engine, lower_id : str, upper_id : str) -> int:
+        '''
+            This function inserts the rows of a range of message ids in its own transaction.
+                :param engine: sqlalchemy.engine.Engine
+                    The engine of the database.
+                :param lower_id: str
+                    The exclusive lower bound of the message ids, None for no bound.
+                :param upper_id: str
+                    The inclusive upper bound of the message ids, None for no bound.
+                :return: int
+                    The number of rows inserted.
+        '''
+        conditions = []
+        if lower_id is not None:
+            conditions.append("messages.id > :lower_id")
+        if upper_id is not None:
+            conditions.append("messages.id <= :upper_id")
+        with engine.begin() as connection:
+            return connection.execute(
+                text(FLAT_STATEMENT.format(condition=" AND ".join(conditions) or "true")),
+                {"lower_id" : lower_id, "upper_id" : upper_id}
+            ).rowcount
+
+    def rebuild(self, workers : int = 4, chunks : int = 16) -> int:
+        '''
+            This function rebuilds the Message Metrics Flat table from scratch, in chunks of message ids inserted in parallel.
+            The changes made during the rebuild are upserted again by the next refresh.
+                :param workers: int, default = 4
+                    The number of chunks inserted at the same time, each one on its own connection.
+                :param chunks: int, default = 16
+                    The number of ranges of message ids.
+                :return: int
+                    The number of rows inserted.
+        '''
+        engine = db.engine
+        with engine.connect() as lock_connection:
+            lock_connection.execute(text("SELECT pg_advisory_lock(hashtext('message_metrics_flat'))"))
+            try:
+                with engine.begin() as connection:
+                    upper = committed_until(connection, self.lag_seconds)
+                    connection.execute(text("TRUNCATE message_metrics_flat"))
+
+                    # Splitting the message ids into ranges of about the same size.
+                    bounds = connection.execute(text(
+                        "SELECT percentile_disc(CAST(:fractions AS float8[])) WITHIN GROUP (ORDER BY id) FROM messages"
+                    ), {"fractions" : [index / chunks for index in range(1, chunks)]}).scalar() or []
+                bounds = sorted(set(bounds))
+                ranges = list(zip([None] + bounds, bounds + [None]))
+
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    rows = sum(executor.map(lambda bounds: self.rebuild_chunk(engine, *bounds), ranges))
+
+                with engine.begin() as connection:
+                    self.set_high_water_mark(connection, upper)
+            finally:
+                lock_connection.execute(text("SELECT pg_advisory_unlock(hashtext('message_metrics_flat'))"))
+        return rows
+
+    def run(self, app, check_interval : float) -> None:
+        '''
+            This function is the loop of the refresh thread.
+                :param app: Flask
+                    The flask application, used for the database connection.
+                :param check_interval: float
+                    The number of seconds between two refreshes.
+        '''
+        while not self.stop_event.wait(check_interval):
+            with app.app_context():
+                try:
+                    self.refresh()
+                except Exception:
+                    logger.exception("Flat metrics refresh failed")
+
+    def start(self, app, check_interval : float = 60) -> None:
+        '''
+            This function starts the refresh thread.
+                :param app: Flask
+                    The flask application, used for the database connection.
+                :param check_interval: float, default = 60
+                    The number of seconds between two refreshes.
+        '''
+        threading.Thread(target=self.run, args=(app, check_interval), daemon=True).start()
+
+    def stop(self) -> None:
+        '''
+            This function stops the refresh thread.
+        '''
+        self.stop_event.set()
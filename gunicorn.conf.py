@@ -0,0 +1,62 @@
+# Importing all needed modules.
+import logging
+
+from config import ConfigManager
+
+# Creation of the config manager, not named config as gunicorn reads the module names matching its settings.
+warehouse_config = ConfigManager("config.ini")
+
+# Setting up the server, every worker creates its own Flask application after the fork.
+bind = f"0.0.0.0:{warehouse_config.general.port}"
+workers = warehouse_config.serving.workers
+wsgi_app = "main:create_app()"
+preload_app = False
+
+# Sending the logs of the warehouse modules to the standard error, the workers inherit the handler of the master.
+logging.basicConfig(level=logging.INFO, format="[%(asctime)s] [%(process)d] [%(levelname)s] %(name)s: %(message)s")
+
+
+def on_starting(server):
+    '''
+        This hook does the one-time setup of the database in the master, before the workers are forked.
+            :param server: gunicorn.arbiter.Arbiter
+                The master of the workers.
+    '''
+    from main import create_app, setup_database
+    from models import db
+    from instrumentation import clear_snapshots
+
+    app = create_app()
+    setup_database(app)
+
+    # Deleting the metrics of the workers of the previous run.
+    if warehouse_config.prometheus.shared_dir:
+        clear_snapshots(warehouse_config.prometheus.shared_dir)
+
+    # Closing the connections of the master, so no worker inherits a connection opened before the fork.
+    with app.app_context():
+        db.engine.dispose()
+
+
+def post_worker_init(worker):
+    '''
+        This hook starts the background work of a worker once its application is loaded.
+            :param worker: gunicorn.workers.base.Worker
+                The worker.
+    '''
+    from main import start_worker
+
+    start_worker(worker.wsgi)
+
+
+def worker_exit(server, worker):
+    '''
+        This hook stops the background work of a worker before it exits.
+            :param server: gunicorn.arbiter.Arbiter
+                The master of the workers.
+            :param worker: gunicorn.workers.base.Worker
+                The worker.
+    '''
+    from main import stop_worker
+
+    stop_worker(worker.wsgi)
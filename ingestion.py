@@ -0,0 +1,414 @@
+# Importing all needed modules.
+import uuid
+import time
+
+from sqlalchemy.dialects.postgresql import insert
+
+from instrumentation import instrumentation
+from models import db, MessagesModel, LatencyModel, TrafficModel, ErrorsModel, SaturationModel, UserModel, StagedEventModel, \
+    MessageServiceMetricsModel, MetricReportKeyModel, LONG_METRIC_LINKS, PARTITIONED_METRICS
+
+# The prefixes of the metrics columns in the Messages table for every service.
+SERVICE_PREFIXES = {
+    "intent-service" : "intent",
+    "named-entity-recognition-service" : "ner",
+    "sentiment-service" : "sentiment",
+    "sequence2sequence-service" : "seq",
+    "business-logic-service" : "bl"
+}
+
+# The fields of the Messages table set by the /message requests.
+MESSAGE_FIELDS = [
+    "text", "intent", "sentiment", "ner", "response", "is_seq2seq", "business_logic_response",
+    "is_intent_cached", "is_sentiment_cached", "is_ner_cached", "is_sequence_cached"
+]
+
+# The namespace of the metrics ids, derived from the correlation id, the service name and the table name.
+METRICS_NAMESPACE = uuid.UUID("c84c49d9-ff12-42a0-b74f-d99a07f1646f")
+
+# The metrics tables together with the name of the report section they are filled from.
+METRIC_TABLES = {
+    "latency" : LatencyModel.__table__,
+    "traffic" : TrafficModel.__table__,
+    "errors" : ErrorsModel.__table__,
+    "saturation" : SaturationModel.__table__
+}
+
+
+def metric_id(correlation_id : str, service_name : str, table_name : str) -> str:
+    '''
+        This function returns the id of a metrics record, the same for every retry of a report.
+            :param correlation_id: str
+                The correlation id of the message.
+            :param service_name: str
+                The name of the service which sent the metrics.
+            :param table_name: str
+                The name of the metrics table.
+    '''
+    return str(uuid.uuid5(METRICS_NAMESPACE, f"{correlation_id}/{service_name}/{table_name}"))
+
+
+def report_key(result : dict) -> tuple:
+    '''
+        This function returns the key identifying a metrics report and its retries.
+            :param result: dict
+                The metrics report validated by the MetricsSchema.
+    '''
+    return (result["correlation_id"], result["service_name"])
+
+
+def metrics_to_records(result : dict) -> dict:
+    '''
+        This function converts a validated metrics report into the rows of the metrics tables.
+            :param result: dict
+                The metrics report validated by the MetricsSchema.
+            :return: dict
+                The rows for every metrics table present in the report, keyed by the table name.
+    '''
+    service_name = result["service_name"]
+    correlation_id = result["correlation_id"]
+    records = dict()
+
+    # Creating the Latency metrics record.
+    if "latency" in result:
+        records["latency"] = {
+            "id" : metric_id(correlation_id, service_name, "latency"),
+            "lock_time_per_process" : result["latency"]["lock_time"],
+            "queue_waiting_time" : result["latency"]["queue_waiting_time"],
+            "actual_processing_time" : result["latency"]["actual_processing"],
+            "task_service_time" : result["latency"]["task_service_time"],
+            "database_response_time" : result["latency"]["database_response_time"],
+            "service_name" : service_name
+        }
+
+    # Creating the Traffic metrics record.
+    if "traffic" in result:
+        records["traffic"] = {
+            "id" : metric_id(correlation_id, service_name, "traffic"),
+            "write_query" : result["traffic"]["write_query"],
+            "read_query" : result["traffic"]["read_query"],
+            "service_name" : service_name
+        }
+
+    # Creating the Errors metrics record.
+    records["errors"] = {
+        "id" : metric_id(correlation_id, service_name, "errors"),
+        "status_code" : result["errors"]["request_status"],
+        "db_error" : result["errors"]["db_error"],
+        "reason" : result["errors"]["request_reason"],
+        "service_name" : service_name
+    }
+
+    # Creating the Saturation metrics record.
+    if "saturation" in result:
+        records["saturation"] = {
+            "id" : metric_id(correlation_id, service_name, "saturation"),
+            "cpu_utilization" : result["saturation"]["cpu_utilization"],
+            "ram_utilization" : result["saturation"]["ram_utilization"],
+            "waiting_queue_length" : result["saturation"]["waiting_queue_length"],
+            "thread_capacity" : result["saturation"]["thread_capacity"],
+            "service_name" : service_name
+        }
+    return records
+
+
+def message_links(service_name : str, records : dict) -> dict:
+    '''
+        This function returns the Messages columns pointing to the metrics records of a service.
+            :param service_name: str
+                The name of the service which sent the metrics.
+            :param records: dict
+                The metrics records returned by metrics_to_records.
+            :return: dict
+                The Messages column names and the ids they should be set to.
+    '''
+    prefix = SERVICE_PREFIXES.get(service_name)
+    if prefix is None:
+        return dict()
+    return {
+        f"{prefix}_{table_name}_id" : record["id"]
+        for table_name, record in records.items()
+    }
+
+
+def service_metrics_row(result : dict, records : dict) -> dict:
+    '''
+        This function returns the row of the Message Service Metrics table linking a message to the metrics of a service.
+            :param result: dict
+                The metrics report validated by the MetricsSchema.
+            :param records: dict
+                The metrics records returned by metrics_to_records.
+    '''
+    row = {"correlation_id" : result["correlation_id"], "service" : result["service_name"]}
+    for table_name in METRIC_TABLES:
+        row[f"{table_name}_id"] = records[table_name]["id"] if table_name in records else None
+    return row
+
+
+def messages_wide_view() -> str:
+    '''
+        This function returns the statement creating the messages_wide view.
+        The view has the columns of the Messages table, the metrics links being read from the
+        Message Service Metrics table, or from the Messages row for the messages linked in the wide mode.
+    '''
+    links = {
+        f"{prefix}_{table_name}_id" : (service_name, f"{table_name}_id")
+        for service_name, prefix in SERVICE_PREFIXES.items()
+        for table_name in METRIC_TABLES
+    }
+    columns = []
+    pivots = []
+    for column in MessagesModel.__table__.columns:
+        if column.name in links:
+            service_name, link = links[column.name]
+            pivots.append(f"(array_agg({link}) FILTER (WHERE service = '{service_name}'))[1] AS {column.name}")
+            columns.append(f"coalesce(links.{column.name}, messages.{column.name}) AS {column.name}")
+        else:
+            columns.append(f"messages.{column.name}")
+    return f"CREATE OR REPLACE VIEW messages_wide AS SELECT {', '.join(columns)} FROM messages " \
+           f"LEFT JOIN LATERAL (SELECT {', '.join(pivots)} FROM message_service_metrics " \
+           f"WHERE message_service_metrics.correlation_id = messages.id) AS links ON true"
+
+
+def insert_metric_records(records_list : list) -> int:
+    '''
+        This function inserts the metrics records into the tables with a multi-row INSERT per table.
+        The records of a retried report have the same ids, so they are skipped.
+            :param records_list: list
+                The list of metrics records returned by metrics_to_records.
+            :return: int
+                The number of reports with inserted records, the retries aren't counted.
+    '''
+    new_ids = None
+    if PARTITIONED_METRICS and records_list:
+        # The ids are only unique in a partition, so the new ones are found by the Metric Report Keys table first.
+        new_ids = set(db.session.execute(insert(MetricReportKeyModel.__table__).values([
+            {"id" : record["id"]} for records in records_list for record in records.values()
+        ]).on_conflict_do_nothing().returning(MetricReportKeyModel.id)).scalars())
+
+    inserted = set()
+    for table_name, table in METRIC_TABLES.items():
+        rows = [records[table_name] for records in records_list if table_name in records]
+        if new_ids is not None:
+            rows = list({row["id"] : row for row in rows if row["id"] in new_ids}.values())
+        if rows:
+            inserted.update(db.session.execute(
+                insert(table).values(rows).on_conflict_do_nothing().returning(table.c.id)
+            ).scalars())
+
+    # Counting every new report once, even if it's repeated in the list.
+    saved = 0
+    for records in records_list:
+        ids = {record["id"] for record in records.values()}
+        if ids & inserted:
+            saved += 1
+            inserted -= ids
+    return saved
+
+
+def link_messages(links_by_message : dict) -> None:
+    '''
+        This function upserts the Messages records pointing them to the metrics records.
+        Only the columns of the reporting services are set, so concurrent reports don't overwrite each other.
+            :param links_by_message: dict
+                The Messages columns to set, keyed by the correlation id of the message.
+    '''
+    # Grouping the messages by the columns to set, as a multi-row INSERT needs the same columns in every row.
+    groups = dict()
+    for correlation_id, links in links_by_message.items():
+        groups.setdefault(tuple(sorted(links)), []).append({"id" : correlation_id, **links})
+
+    for columns, rows in groups.items():
+        # Inserting the missing messages and updating the existing ones in one statement.
+        statement = insert(MessagesModel.__table__).values(rows)
+        if columns:
+            statement = statement.on_conflict_do_update(
+                index_elements=["id"],
+                set_={**{column : statement.excluded[column] for column in columns}, "updated_at" : db.func.now()}
+            )
+        else:
+            statement = statement.on_conflict_do_nothing(index_elements=["id"])
+        db.session.execute(statement)
+
+
+def insert_service_metrics(results : list, records_list : list) -> None:
+    '''
+        This function inserts the rows of the Message Service Metrics table and the missing Messages records.
+        Neither statement rewrites an existing row, so the reports of the services only add tuples.
+            :param results: list
+                The list of metrics reports validated by the MetricsSchema.
+            :param records_list: list
+                The metrics records of every report returned by metrics_to_records.
+    '''
+    if not results:
+        return
+    db.session.execute(insert(MessagesModel.__table__).values([
+        {"id" : correlation_id} for correlation_id in dict.fromkeys(result["correlation_id"] for result in results)
+    ]).on_conflict_do_nothing(index_elements=["id"]))
+    db.session.execute(insert(MessageServiceMetricsModel.__table__).values([
+        service_metrics_row(result, records) for result, records in zip(results, records_list)
+    ]).on_conflict_do_nothing())
+
+
+def metrics_records_and_links(results : list) -> tuple:
+    '''
+        This function converts the validated metrics reports into the metrics records and the message links.
+            :param results: list
+                The list of metrics reports validated by the MetricsSchema.
+            :return: tuple
+                The list of metrics records and the Messages columns to set, keyed by the correlation id.
+    '''
+    records_list = []
+    links_by_message = dict()
+    for result in results:
+        records = metrics_to_records(result)
+        records_list.append(records)
+        links_by_message.setdefault(result["correlation_id"], dict()).update(
+            message_links(result["service_name"], records)
+        )
+    return records_list, links_by_message
+
+
+def save_metrics(results : list) -> int:
+    '''
+        This function adds the validated metrics reports to the current database session.
+            :param results: list
+                The list of metrics reports validated by the MetricsSchema.
+            :return: int
+                The number of reports saved, the retries aren't counted.
+    '''
+    records_list, links_by_message = metrics_records_and_links(results)
+    saved = insert_metric_records(records_list)
+    if LONG_METRIC_LINKS:
+        insert_service_metrics(results, records_list)
+    else:
+        link_messages(links_by_message)
+    return saved
+
+
+def stage_events(kind : str, payloads : dict) -> None:
+    '''
+        This function appends events to the staging table, they are merged into the Messages table later.
+            :param kind: str
+                The kind of the events, 'message' or 'links'.
+            :param payloads: dict
+                The Messages columns to set, keyed by the correlation id of the message.
+    '''
+    if payloads:
+        db.session.execute(insert(StagedEventModel.__table__).values([
+            {"kind" : kind, "correlation_id" : correlation_id, "payload" : payload}
+            for correlation_id, payload in payloads.items()
+        ]))
+
+
+def stage_metrics(results : list) -> int:
+    '''
+        This function adds the metrics records to the current database session and stages the message links,
+        so the links aren't lost if the message arrives later. The long links are inserted directly.
+            :param results: list
+                The list of metrics reports validated by the MetricsSchema.
+            :return: int
+                The number of reports saved, the retries aren't counted.
+    '''
+    records_list, links_by_message = metrics_records_and_links(results)
+    saved = insert_metric_records(records_list)
+    if LONG_METRIC_LINKS:
+        # The links are only inserted, so there is nothing to merge.
+        insert_service_metrics(results, records_list)
+    else:
+        stage_events("links", links_by_message)
+    return saved
+
+
+def message_fields(result : dict, date_id : str, user_id : str) -> dict:
+    '''
+        This function returns the Messages columns set by a message.
+            :param result: dict
+                The message validated by the MessageSchema.
+            :param date_id: str
+                The id of the Date record of the message time.
+            :param user_id: str
+                The id of the user sending the message.
+    '''
+    fields = {field : result[field] for field in MESSAGE_FIELDS}
+    fields["date_id"] = date_id
+    fields["user_id"] = user_id
+    return fields
+
+
+def stage_message(result : dict, date_id : str, user_id : str) -> bool:
+    '''
+        This function stages the message fields, whether the metrics of the message arrived or not.
+            :param result: dict
+                The message validated by the MessageSchema.
+            :param date_id: str
+                The id of the Date record of the message time.
+            :param user_id: str
+                The id of the user sending the message.
+            :return: bool
+                True, the staged message is always saved.
+    '''
+    stage_events("message", {result["correlation_id"] : message_fields(result, date_id, user_id)})
+    return True
+
+
+def save_user(result : dict) -> None:
+    '''
+        This function adds the validated user to the current database session.
+            :param result: dict
+                The user validated by the UserSchema.
+    '''
+    # Creating a new user record.
+    new_user = UserModel(
+        result["user_id"],
+        result["telegram_user_id"],
+        result["chat_id"],
+        result["first_name"],
+        result["last_name"],
+        result["telegram_username"],
+        result["app_id"]
+    )
+    # Inserting the user record into the User table.
+    db.session.add(new_user)
+
+
+def save_message(result : dict, date_id : str, user_id : str) -> bool:
+    '''
+        This function upserts the Messages record with the message fields, whether the metrics of the message arrived or not.
+        Only the message columns are set, so the links of the metrics reports are kept.
+            :param result: dict
+                The message validated by the MessageSchema.
+            :param date_id: str
+                The id of the Date record of the message time.
+            :param user_id: str
+                The id of the user sending the message.
+            :return: bool
+                True, the message is always saved.
+    '''
+    fields = message_fields(result, date_id, user_id)
+    statement = insert(MessagesModel.__table__).values(id=result["correlation_id"], **fields)
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=["id"],
+        set_={**{column : statement.excluded[column] for column in fields}, "updated_at" : db.func.now()}
+    ))
+    return True
+
+
+def commit_session():
+    '''
+        This function commits the current database session.
+            :return: dict or None
+                The error body if the commit failed, else None.
+    '''
+    start = time.perf_counter()
+    try:
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        instrumentation.observe_commit(time.perf_counter() - start, True)
+        return {
+            "name" : e.__class__.__name__,
+            "cause" : e.__cause__.__repr__()
+        }
+    instrumentation.observe_commit(time.perf_counter() - start, False)
+    return None
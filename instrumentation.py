@@ -0,0 +1,465 @@
+# Importing all needed libraries.
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+import threading
+import fcntl
+import json
+import time
+import os
+import logging
+
+# The logger of the module.
+logger = logging.getLogger(__name__)
+
+# The upper bounds of the duration histograms buckets, in seconds.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# The counters of the failures, keyed by the status code of the response.
+FAILURE_COUNTERS = {
+    401 : "warehouse_hmac_failures_total",
+    400 : "warehouse_validation_failures_total",
+    500 : "warehouse_db_errors_total"
+}
+
+# The worker label of the metrics of the exited workers, merged into one snapshot.
+EXITED_WORKER = "exited"
+
+# The type and the description of every exported metric.
+METRIC_DESCRIPTIONS = {
+    "warehouse_requests_total" : ("counter", "The number of requests by endpoint and status code."),
+    "warehouse_request_duration_seconds" : ("histogram", "The duration of the requests by endpoint."),
+    "warehouse_hmac_failures_total" : ("counter", "The number of requests rejected by the HMAC authentication."),
+    "warehouse_validation_failures_total" : ("counter", "The number of requests rejected by the schema validation."),
+    "warehouse_db_errors_total" : ("counter", "The number of requests failed because of the database."),
+    "warehouse_exceptions_total" : ("counter", "The number of requests failed with an unhandled exception."),
+    "warehouse_in_flight_requests" : ("gauge", "The number of requests being handled."),
+    "warehouse_commit_duration_seconds" : ("histogram", "The duration of the database commits."),
+    "warehouse_commit_failures_total" : ("counter", "The number of failed database commits.")
+}
+
+
+class ThreadMetrics:
+    def __init__(self, thread) -> None:
+        '''
+            The constructor of the metrics of a thread, only updated by their own thread.
+                :param thread: threading.Thread
+                    The thread updating the metrics, None for the metrics of the finished threads.
+        '''
+        self.thread = thread
+        self.counters = dict()
+        self.histograms = dict()
+
+
+class Instrumentation:
+    def __init__(self, buckets : tuple = DEFAULT_BUCKETS) -> None:
+        '''
+            The constructor of the Instrumentation, collecting the counters and the histograms of the warehouse.
+            Every thread updates its own metrics without locks, they are summed up only when exported.
+                :param buckets: tuple, default = DEFAULT_BUCKETS
+                    The upper bounds of the histograms buckets, in seconds.
+        '''
+        self.buckets = sorted(buckets)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.threads = []
+        self.retired = ThreadMetrics(None)
+        self.shared_dir = None
+        self.worker_id = None
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def thread_metrics(self) -> ThreadMetrics:
+        '''
+            This function returns the metrics of the current thread, registering them on the first call.
+        '''
+        metrics = getattr(self.local, "metrics", None)
+        if metrics is None:
+            metrics = ThreadMetrics(threading.current_thread())
+            self.local.metrics = metrics
+            with self.lock:
+                self.threads.append(metrics)
+        return metrics
+
+    def increment(self, key : tuple, amount : int = 1) -> None:
+        '''
+            This function increments a counter of the current thread.
+                :param key: tuple
+                    The name of the counter and its labels.
+                :param amount: int, default = 1
+                    The increment.
+        '''
+        counters = self.thread_metrics().counters
+        counters[key] = counters.get(key, 0) + amount
+
+    def observe(self, key : tuple, value : float) -> None:
+        '''
+            This function adds a value to a histogram of the current thread.
+                :param key: tuple
+                    The name of the histogram and its labels.
+                :param value: float
+                    The value observed.
+        '''
+        histograms = self.thread_metrics().histograms
+        histogram = histograms.get(key)
+        if histogram is None:
+            # The counts of every bucket, of the values over the last bound and the sum of the values.
+            histogram = histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        histogram[bisect_left(self.buckets, value)] += 1
+        histogram[-1] += value
+
+    def observe_commit(self, seconds : float, failed : bool) -> None:
+        '''
+            This function records a database commit.
+                :param seconds: float
+                    The duration of the commit.
+                :param failed: bool
+                    True if the commit failed.
+        '''
+        self.observe(("warehouse_commit_duration_seconds", ()), seconds)
+        if failed:
+            self.increment(("warehouse_commit_failures_total", ()))
+
+    def instrument(self, endpoint : str):
+        '''
+            This function returns the decorator counting the requests of a flask view and timing them.
+                :param endpoint: str
+                    The name of the endpoint in the labels.
+        '''
+        labels = (("endpoint", endpoint),)
+        in_flight_key = ("warehouse_in_flight_requests", labels)
+        duration_key = ("warehouse_request_duration_seconds", labels)
+        exception_key = ("warehouse_exceptions_total", labels)
+        # The keys of the counters by status code, created once per status code.
+        status_keys = dict()
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                self.increment(in_flight_key)
+                start = time.perf_counter()
+                try:
+                    response = view(*args, **kwargs)
+                except Exception:
+                    self.increment(exception_key)
+                    response = (None, 500)
+                    raise
+                finally:
+                    self.increment(in_flight_key, -1)
+                    self.observe(duration_key, time.perf_counter() - start)
+                    status = response[1] if isinstance(response, tuple) and len(response) > 1 else 200
+                    keys = status_keys.get(status)
+                    if keys is None:
+                        keys = status_keys[status] = (
+                            ("warehouse_requests_total", labels + (("status", str(status)),)),
+                            (FAILURE_COUNTERS[status], labels) if status in FAILURE_COUNTERS else None
+                        )
+                    self.increment(keys[0])
+                    if keys[1] is not None:
+                        self.increment(keys[1])
+                return response
+            return wrapper
+        return decorator
+
+    def collect(self) -> tuple:
+        '''
+            This function sums up the metrics of all the threads.
+                :return: tuple
+                    The counters and the histograms, keyed by their name and labels.
+        '''
+        counters = dict()
+        histograms = dict()
+        with self.lock:
+            # The metrics of the finished threads are moved to the retired ones.
+            alive = []
+            for metrics in self.threads:
+                if metrics.thread.is_alive():
+                    alive.append(metrics)
+                else:
+                    self.merge(self.retired, metrics.counters.copy(), metrics.histograms.copy())
+            self.threads = alive
+
+            for metrics in [self.retired] + alive:
+                for key, value in metrics.counters.copy().items():
+                    counters[key] = counters.get(key, 0) + value
+                for key, histogram in metrics.histograms.copy().items():
+                    total = histograms.setdefault(key, [0] * len(histogram))
+                    for index, value in enumerate(list(histogram)):
+                        total[index] += value
+        return counters, histograms
+
+    def merge(self, target : ThreadMetrics, counters : dict, histograms : dict) -> None:
+        '''
+            This function adds the metrics of a thread to other metrics.
+                :param target: ThreadMetrics
+                    The metrics updated.
+                :param counters: dict
+                    The counters added.
+                :param histograms: dict
+                    The histograms added.
+        '''
+        for key, value in counters.items():
+            target.counters[key] = target.counters.get(key, 0) + value
+        for key, histogram in histograms.items():
+            total = target.histograms.setdefault(key, [0] * len(histogram))
+            for index, value in enumerate(histogram):
+                total[index] += value
+
+    @contextmanager
+    def snapshots_lock(self, exclusive : bool):
+        '''
+            This function returns the context manager locking the snapshots of the shared directory,
+            so no reader sees an exited worker both in its own snapshot and in the merged one.
+                :param exclusive: bool
+                    True to change the set of snapshots, False to read them.
+        '''
+        with open(os.path.join(self.shared_dir, "snapshots.lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def write_snapshot(self, worker : str = None, counters : dict = None, histograms : dict = None) -> None:
+        '''
+            This function writes the metrics of the process to its file in the shared directory.
+            The file is replaced at once, so a reader never sees a partial snapshot.
+                :param worker: str, default = None
+                    The worker label of the snapshot, the one of the process if None.
+                :param counters: dict, default = None
+                    The counters written, the ones of the process if None.
+                :param histograms: dict, default = None
+                    The histograms written, the ones of the process if None.
+        '''
+        if worker is None:
+            worker = self.worker_id
+            counters, histograms = self.collect()
+        path = os.path.join(self.shared_dir, f"{worker}.json")
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "w") as snapshot_file:
+            json.dump({
+                "counters" : [[name, labels, value] for (name, labels), value in counters.items()],
+                "histograms" : [[name, labels, histogram] for (name, labels), histogram in histograms.items()]
+            }, snapshot_file)
+        os.replace(temporary_path, path)
+
+    def read_snapshots(self) -> list:
+        '''
+            This function reads the snapshots of the shared directory, the unreadable ones are skipped.
+                :return: list
+                    The tuples of the worker id, its counters and its histograms.
+        '''
+        workers = []
+        for file_name in sorted(os.listdir(self.shared_dir)):
+            if not file_name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.shared_dir, file_name)) as snapshot_file:
+                    snapshot = json.load(snapshot_file)
+            except (OSError, ValueError):
+                continue
+            workers.append((
+                file_name[:-len(".json")],
+                {(name, tuple(map(tuple, labels))) : value for name, labels, value in snapshot["counters"]},
+                {(name, tuple(map(tuple, labels))) : histogram for name, labels, histogram in snapshot["histograms"]}
+            ))
+        return workers
+
+    def worker_metrics(self) -> list:
+        '''
+            This function returns the metrics of every worker, read from the shared directory.
+            Without a shared directory only the metrics of the current process are returned.
+                :return: list
+                    The tuples of the worker id, its counters and its histograms.
+        '''
+        if self.shared_dir is None:
+            return [(str(os.getpid()), *self.collect())]
+
+        # The snapshot of the current process is refreshed, the other ones are at most one interval old.
+        self.write_snapshot()
+        with self.snapshots_lock(exclusive=False):
+            return self.read_snapshots()
+
+    def retire_snapshot(self) -> None:
+        '''
+            This function adds the last metrics of the process to the snapshot of the exited workers and deletes its own,
+            so the number of worker labels doesn't grow with the restarts and no counter goes backwards.
+            The gauges are left out, as an exited worker has nothing in flight.
+        '''
+        counters, histograms = self.collect()
+        with self.snapshots_lock(exclusive=True):
+            exited = ThreadMetrics(None)
+            for worker, worker_counters, worker_histograms in self.read_snapshots():
+                if worker == EXITED_WORKER:
+                    self.merge(exited, worker_counters, worker_histograms)
+            self.merge(exited, {
+                key : value for key, value in counters.items() if METRIC_DESCRIPTIONS[key[0]][0] != "gauge"
+            }, histograms)
+            self.write_snapshot(EXITED_WORKER, exited.counters, exited.histograms)
+            try:
+                os.remove(os.path.join(self.shared_dir, f"{self.worker_id}.json"))
+            except FileNotFoundError:
+                pass
+
+    def run(self, check_interval : float) -> None:
+        '''
+            This function is the loop of the snapshot thread.
+                :param check_interval: float
+                    The number of seconds between two snapshots.
+        '''
+        while not self.stop_event.wait(check_interval):
+            try:
+                self.write_snapshot()
+            except OSError:
+                logger.exception("Metrics snapshot failed")
+
+    def start(self, shared_dir : str, check_interval : float = 5) -> None:
+        '''
+            This function starts writing the snapshots of the process to the directory shared by the workers.
+                :param shared_dir: str
+                    The directory of the snapshots, one file per process.
+                :param check_interval: float, default = 5
+                    The number of seconds between two snapshots.
+        '''
+        os.makedirs(shared_dir, exist_ok=True)
+        self.shared_dir = shared_dir
+        # The start time tells apart the processes reusing the pid of a worker killed before merging its snapshot.
+        self.worker_id = f"{os.getpid()}-{int(time.time() * 1000)}"
+        self.write_snapshot()
+        self.thread = threading.Thread(target=self.run, args=(check_interval,), daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout : float = 5) -> None:
+        '''
+            This function stops the snapshot thread and merges the last metrics of the process into the exited workers.
+                :param timeout: float, default = 5
+                    The maximal number of seconds waited for the snapshot thread.
+        '''
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        if self.shared_dir is not None:
+            self.retire_snapshot()
+
+    def render(self) -> str:
+        '''
+            This function returns the metrics of every worker in the Prometheus text format, labelled by worker.
+        '''
+        workers = self.worker_metrics()
+        lines = []
+        for name, (metric_type, description) in METRIC_DESCRIPTIONS.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for worker, counters, histograms in workers:
+                worker_label = (("worker", worker),)
+                if metric_type != "histogram":
+                    for (key_name, labels), value in sorted(counters.items()):
+                        if key_name == name:
+                            lines.append(f"{name}{format_labels(worker_label + labels)} {value}")
+                else:
+                    for (key_name, labels), histogram in sorted(histograms.items()):
+                        if key_name != name:
+                            continue
+                        labels = worker_label + labels
+                        cumulative = 0
+                        for bound, count in zip(self.buckets + ["+Inf"], histogram[:-1]):
+                            cumulative += count
+                            lines.append(f"{name}_bucket{format_labels(labels + (('le', str(bound)),))} {cumulative}")
+                        lines.append(f"{name}_sum{format_labels(labels)} {histogram[-1]}")
+                        lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+class LoadSignals:
+    def __init__(self, instrumentation : Instrumentation, pool_utilization = None, queue_depth = None) -> None:
+        '''
+            The constructor of the Load Signals, the live load of the workers reported to the service discovery.
+                :param instrumentation: Instrumentation
+                    The instrumentation of the request handlers.
+                :param pool_utilization: callable, default = None
+                    The function returning the fraction of the database connections in use.
+                :param queue_depth: callable, default = None
+                    The function returning the number of writes waiting in the Write-Behind Buffer.
+        '''
+        self.instrumentation = instrumentation
+        self.pool_utilization = pool_utilization
+        self.queue_depth = queue_depth
+        self.previous = (time.monotonic(), 0, [0] * (len(instrumentation.buckets) + 1))
+
+    def totals(self) -> tuple:
+        '''
+            This function sums up the requests of all the endpoints of all the workers.
+            The snapshots of the shared directory are summed up, without it only the current process is counted.
+                :return: tuple
+                    The number of handled requests, the number of requests in flight and the duration bucket counts.
+        '''
+        requests = 0
+        in_flight = 0
+        durations = [0] * (len(self.instrumentation.buckets) + 1)
+        for _, counters, histograms in self.instrumentation.worker_metrics():
+            for (name, _), value in counters.items():
+                if name == "warehouse_requests_total":
+                    requests += value
+                elif name == "warehouse_in_flight_requests":
+                    in_flight += value
+            for (name, _), histogram in histograms.items():
+                if name == "warehouse_request_duration_seconds":
+                    for index, count in enumerate(histogram[:-1]):
+                        durations[index] += count
+        return requests, in_flight, durations
+
+    def __call__(self) -> dict:
+        '''
+            This function returns the load signals since the previous call.
+        '''
+        now = time.monotonic()
+        requests, in_flight, durations = self.totals()
+        previous_time, previous_requests, previous_durations = self.previous
+        self.previous = (now, requests, durations)
+
+        # The p95 latency is the upper bound of the bucket holding the 95th percentile of the recent requests.
+        # A snapshot unreadable during the previous call can make a bucket go backwards, it counts as empty.
+        recent = [max(count - previous, 0) for count, previous in zip(durations, previous_durations)]
+        p95 = None
+        seen = 0
+        for bound, count in zip(self.instrumentation.buckets + [self.instrumentation.buckets[-1]], recent):
+            seen += count
+            if seen and seen >= 0.95 * sum(recent):
+                p95 = bound * 1000
+                break
+
+        return {
+            "in_flight_requests" : in_flight,
+            "ingest_rate" : max(requests - previous_requests, 0) / max(now - previous_time, 1e-9),
+            "p95_latency_ms" : p95,
+            "db_pool_utilization" : self.pool_utilization() if self.pool_utilization is not None else None,
+            "write_behind_queue_depth" : self.queue_depth() if self.queue_depth is not None else None
+        }
+
+
+def clear_snapshots(shared_dir : str) -> None:
+    '''
+        This function deletes the snapshots of the workers of a previous run.
+            :param shared_dir: str
+                The directory of the snapshots.
+    '''
+    if not os.path.isdir(shared_dir):
+        return
+    for file_name in os.listdir(shared_dir):
+        if file_name.endswith((".json", ".tmp")):
+            os.remove(os.path.join(shared_dir, file_name))
+
+
+def format_labels(labels : tuple) -> str:
+    '''
+        This function returns the labels of a metric in the Prometheus text format.
+            :param labels: tuple
+                The (name, value) pairs of the labels.
+    '''
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+# The instrumentation of the warehouse, shared by the views and the database writes.
+instrumentation = Instrumentation()
@@ -0,0 +1,80 @@
+# Importing all needed libraries.
+import threading
+import fcntl
+import os
+
+
+class LeaderElection:
+    def __init__(self, lock_path : str, retry_interval : float = 10) -> None:
+        '''
+            The constructor of the Leader Election between the workers of one host.
+            The leader is the worker holding an exclusive lock on the lock file, the lock is released
+            by the operating system when the leader dies, so one of the other workers takes over.
+                :param lock_path: str
+                    The path to the lock file shared by the workers.
+                :param retry_interval: float, default = 10
+                    The number of seconds between two attempts of a follower to become the leader.
+        '''
+        self.lock_path = lock_path
+        self.retry_interval = retry_interval
+        self.lock_file = None
+        self.stop_event = threading.Event()
+
+    @property
+    def is_leader(self) -> bool:
+        '''
+            This function checks if the current worker holds the lock.
+        '''
+        return self.lock_file is not None
+
+    def try_acquire(self) -> bool:
+        '''
+            This function tries to take the lock without waiting.
+                :return: bool
+                    True if the current worker is the leader.
+        '''
+        if self.lock_file is not None:
+            return True
+        lock_file = open(self.lock_path, "a+")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+
+        # Writing the pid of the leader for the operators.
+        lock_file.truncate(0)
+        lock_file.write(f"{os.getpid()}\n")
+        lock_file.flush()
+        self.lock_file = lock_file
+        return True
+
+    def run(self, on_elected) -> None:
+        '''
+            This function is the loop of the election thread.
+                :param on_elected: callable
+                    The function starting the leader jobs, called once when the worker becomes the leader.
+        '''
+        while not self.stop_event.is_set():
+            if self.try_acquire():
+                on_elected()
+                return
+            self.stop_event.wait(self.retry_interval)
+
+    def start(self, on_elected) -> None:
+        '''
+            This function starts the election thread.
+                :param on_elected: callable
+                    The function starting the leader jobs.
+        '''
+        threading.Thread(target=self.run, args=(on_elected,), daemon=True).start()
+
+    def stop(self) -> None:
+        '''
+            This function stops the election thread and releases the lock.
+        '''
+        self.stop_event.set()
+        if self.lock_file is not None:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+            self.lock_file.close()
+            self.lock_file = None
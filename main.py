@@ -1,19 +1,41 @@
 # Importing the external libraries.
-from flask import Flask, request, jsonify
+from flask import Flask, Blueprint, Response, request, jsonify, stream_with_context
 #from flask_sqlalchemy import SQLAlchemy
 from flask_script import Manager
 from flask_migrate import Migrate
-import threading
+from sqlalchemy import text, inspect
+from sqlalchemy.schema import CreateColumn, CreateIndex
 import requests
+import json
+import click
 import time
-import uuid
+import logging
 
 # Importing all needed modules.
-from models import db, MessagesModel, DateModel, LatencyModel, TrafficModel, ErrorsModel, SaturationModel, UserModel
+from models import db
 from schemas import MetricsSchema, UserSchema, MessageSchema
 from cerber import SecurityManager
 from config import ConfigManager
-from utils import unix_to_date_dict
+from ingestion import save_metrics, save_user, save_message, commit_session, report_key, stage_metrics, stage_message, \
+    messages_wide_view
+from ndjson import ndjson_lines, spool_body
+from buffer import WriteBehindBuffer
+from dimensions import DateDimension
+from caches import UserIdCache, RecentKeySet
+from access_paths import explain_access_paths
+from partitions import PartitionManager
+from rollups import RollupManager
+from staging import StagingMerger
+from flat_metrics import FlatMetricsManager
+from export import TableExport, EXPORT_FORMATS
+from sketches import SketchStore, SketchFolder
+from instrumentation import instrumentation, LoadSignals, clear_snapshots
+from profiler import Profiler
+from leader import LeaderElection
+from discovery import ServiceDiscoveryClient
+
+# The logger of the module.
+logger = logging.getLogger(__name__)
 
 # Creation of the Validation Schemas.
 metrics_schema = MetricsSchema()
@@ -24,304 +46,870 @@ message_schema = MessageSchema()
 config = ConfigManager("config.ini")
 
 # Creation of the Security Manager.
-security_manager = SecurityManager(config.security.secret_key)
+security_manager = SecurityManager(config.security.secret_key, config.security.hmac_mode)
 
 # Setting up the sqlalchemy database uri.
 sqlalchemy_database_uri = f"postgresql://{config.database.username}:{config.database.password}@{config.database.host}:{config.database.port}/{config.database.db_name}"
 
-# Setting up the Flask dependencies.
-app = Flask(__name__)
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config["SQLALCHEMY_DATABASE_URI"] = sqlalchemy_database_uri
-app.secret_key = config.security.secret_key
+# Setting up the Flask dependencies, the application itself is created by create_app.
+warehouse = Blueprint("warehouse", __name__, cli_group=None)
+migrate = Migrate()
+
+# Creation of the Service Discovery Client, started by the leader worker.
+service_discovery = ServiceDiscoveryClient(
+    config.service_discovery.host,
+    config.service_discovery.port,
+    config.service_discovery.register_endpoint,
+    config.service_discovery.secret_key,
+    config.general.name,
+    config.generate_info_for_service_discovery(),
+    heartbeat_interval=config.lifecycle.heartbeat_interval_seconds,
+    timeout=config.lifecycle.request_timeout_seconds,
+    backoff_base=config.lifecycle.backoff_base_seconds,
+    backoff_max=config.lifecycle.backoff_max_seconds,
+    min_heartbeat_interval=config.lifecycle.min_heartbeat_interval_seconds,
+    max_heartbeat_interval=config.lifecycle.max_heartbeat_interval_seconds,
+    change_threshold=config.lifecycle.load_change_threshold
+)
+
+# The durations of the startup phases of the process, in seconds.
+startup_times = dict()
+
+# Creation of the Date Dimension.
+date_dimension = DateDimension(
+    bucket_seconds=config.date_dimension.bucket_seconds,
+    history_days=config.date_dimension.history_days,
+    premake_days=config.date_dimension.premake_days,
+    key_cache_size=config.date_dimension.key_cache_size
+)
+
+# Creation of the cache of the user ids.
+user_id_cache = UserIdCache(config.caches.user_id_cache_size)
+
+# Creation of the set of the recently saved metrics reports, skipping the retries before the database.
+recent_reports = RecentKeySet(config.caches.recent_reports_size)
+
+# Creation of the Partition Manager of the metrics tables.
+partition_manager = None
+if config.partitioning.enabled:
+    partition_manager = PartitionManager(
+        interval=config.partitioning.interval,
+        premake=config.partitioning.premake,
+        retention_days=config.partitioning.retention_days
+    )
 
-#db = SQLAlchemy(app)
-migrate = Migrate(app, db)
+# Creation of the Rollup Manager of the metrics tables.
+rollup_manager = None
+if config.rollups.enabled:
+    rollup_manager = RollupManager(
+        lag_seconds=config.rollups.lag_seconds,
+        latency_buckets=[float(bound) for bound in str(config.rollups.latency_buckets).split(",")]
+    )
 
-# Creating the security manager for the service discovery.
-service_discovery_security_manager = SecurityManager(config.service_discovery.secret_key)
+# Creation of the Sketch Store of the latencies and of the Sketch Folder of its hour and day levels.
+sketch_store, sketch_folder = None, None
+if config.sketches.enabled:
+    sketch_store = SketchStore(
+        bucket_seconds=config.sketches.bucket_seconds,
+        relative_accuracy=config.sketches.relative_accuracy,
+        local_retention_seconds=config.sketches.local_retention_seconds,
+        retention_days=config.sketches.retention_days,
+        checkpoint_interval_seconds=config.sketches.checkpoint_interval_seconds
+    )
+    sketch_folder = SketchFolder(
+        relative_accuracy=config.sketches.relative_accuracy,
+        lag_seconds=config.sketches.fold_lag_seconds
+    )
 
-# Computing the HMAC for Service Discovery registration.
-SERVICE_DISCOVERY_HMAC = service_discovery_security_manager._SecurityManager__encode_hmac(
-    config.generate_info_for_service_discovery()
+# Creation of the Staging Merger, the metrics and the messages are appended to the staging table when it's enabled.
+staging_merger = None
+write_metrics, write_message = save_metrics, save_message
+if config.staging.enabled:
+    staging_merger = StagingMerger(batch_size=config.staging.batch_size)
+    write_metrics, write_message = stage_metrics, stage_message
+
+# Creation of the Flat Metrics Manager of the analysis table.
+flat_metrics_manager = None
+if config.flat_metrics.enabled:
+    flat_metrics_manager = FlatMetricsManager(lag_seconds=config.flat_metrics.lag_seconds)
+
+# Creation of the Profiler of the request phases.
+profiler = Profiler(
+    sample_rate=config.profiler.sample_rate if config.profiler.enabled else 0.0,
+    slowest=config.profiler.slowest,
+    profile_dir=config.profiler.profile_dir if config.profiler.enabled else None
 )
 
-def send_heartbeats():
+# Creation of the Leader Election of the workers running the periodic jobs.
+leader_election = LeaderElection(config.serving.leader_lock_file, config.serving.leader_retry_seconds)
+
+# The Write-Behind Buffer of the worker, created by start_worker.
+write_behind = None
+
+def create_app():
     '''
-        This function sends heartbeat requests to the service discovery.
+        This function creates the Flask application.
+        Nothing is done with the database here, so the function is safe to call before and after forking.
+            :return: Flask
+                The Flask application.
     '''
-    # Getting the Service discovery hmac for message.
-    service_discovery_hmac = service_discovery_security_manager._SecurityManager__encode_hmac({"status_code" : 200})
-    while True:
-        # Senting the request.
-        response = requests.post(
-            f"http://{config.service_discovery.host}:{config.service_discovery.port}/heartbeat/{config.general.name}",
-            json = {"status_code" : 200},
-            headers = {"Token" : service_discovery_hmac}
-        )
-        # Making a pause of 30 seconds before sending the next request.
-        status_code = response.status_code
-        time.sleep(30)
-
-
-# Registering to the Service discovery.
-while True:
-    # Sending the request to the service discovery.
-    resp = requests.post(
-        f"http://{config.service_discovery.host}:{config.service_discovery.port}/{config.service_discovery.register_endpoint}",
-        json = config.generate_info_for_service_discovery(),
-        headers={"Token" : SERVICE_DISCOVERY_HMAC}
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config["SQLALCHEMY_DATABASE_URI"] = sqlalchemy_database_uri
+    app.secret_key = config.security.secret_key
+
+    db.init_app(app)
+    migrate.init_app(app, db)
+    app.register_blueprint(warehouse)
+    return app
+
+def add_missing_columns():
+    '''
+        This function adds the columns and the indexes of the models missing from the tables created by an older version,
+        as db.create_all() only creates the missing tables. The added columns are nullable or have a server default,
+        the primary key is rebuilt when one of its columns is added.
+    '''
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        added = [column for column in table.columns if column.name not in existing]
+        for column in added:
+            db.session.execute(text(
+                f'ALTER TABLE "{table.name}" ADD COLUMN IF NOT EXISTS {CreateColumn(column).compile(dialect=db.engine.dialect)}'
+            ))
+        if any(column.primary_key for column in added):
+            constraint = inspector.get_pk_constraint(table.name)["name"]
+            db.session.execute(text(
+                f'ALTER TABLE "{table.name}" DROP CONSTRAINT "{constraint}", '
+                f'ADD CONSTRAINT "{table.primary_key.name or constraint}" '
+                f'PRIMARY KEY ({", ".join(column.name for column in table.primary_key.columns)})'
+            ))
+        for index in table.indexes:
+            db.session.execute(CreateIndex(index, if_not_exists=True))
+
+def setup_database(app):
+    '''
+        This function does the one-time setup of the database, before the workers are started.
+            :param app: Flask
+                The Flask application.
+    '''
+    start = time.monotonic()
+    with app.app_context():
+        # Creation of the tables in the database.
+        db.create_all()
+        add_missing_columns()
+        db.session.execute(text(messages_wide_view()))
+        db.session.commit()
+
+        # Creating the partitions of the metrics tables.
+        if partition_manager is not None:
+            partition_manager.maintain()
+
+        # Pre-populating the Date table.
+        date_dimension.populate()
+    startup_times["setup_database"] = time.monotonic() - start
+
+def database_pool_utilization(app):
+    '''
+        This function returns the fraction of the database connections of the worker in use.
+            :param app: Flask
+                The Flask application.
+            :return: float or None
+                The number of checked out connections divided by the pool size, None without a sized pool.
+    '''
+    with app.app_context():
+        pool = db.engine.pool
+    size = pool.size() if hasattr(pool, "size") else 0
+    return pool.checkedout() / size if size else None
+
+def start_leader(app):
+    '''
+        This function starts the jobs run by only one worker, once it becomes the leader.
+            :param app: Flask
+                The Flask application.
+    '''
+    # Starting the maintenance of the partitions of the metrics tables.
+    if partition_manager is not None:
+        partition_manager.start(app, config.partitioning.check_interval_seconds)
+
+    # Starting the rollups of the metrics tables.
+    if rollup_manager is not None:
+        rollup_manager.start(app, config.rollups.interval_seconds)
+
+    # Starting the merge of the staged events into the Messages table.
+    if staging_merger is not None:
+        staging_merger.start(app, config.staging.interval_seconds)
+
+    # Starting the refresh of the Message Metrics Flat table.
+    if flat_metrics_manager is not None:
+        flat_metrics_manager.start(app, config.flat_metrics.interval_seconds)
+
+    # Starting the folds of the latency sketches into hours and days.
+    if sketch_folder is not None:
+        sketch_folder.start(app, config.sketches.fold_interval_seconds)
+
+    # Registering to the Service discovery and sending the heartbeats with the load of the worker in the background.
+    service_discovery.load_provider = LoadSignals(
+        instrumentation,
+        pool_utilization=lambda: database_pool_utilization(app),
+        queue_depth=lambda: write_behind.queue.qsize() if write_behind is not None else None
     )
-    # If the request is succesfull then sending of heartbeat requests is starting.
-    if resp.status_code == 200:
-        threading.Thread(target=send_heartbeats).start()
-        break
+    service_discovery.start()
 
+def start_worker(app):
+    '''
+        This function starts the background work of a worker, after it's forked.
+            :param app: Flask
+                The Flask application.
+    '''
+    global write_behind
+    start = time.monotonic()
+    with app.app_context():
+        # Checking the Date table, it's already populated by setup_database.
+        date_dimension.populate()
+
+        # Warming up the cache of the user ids.
+        user_id_cache.warm()
+
+    # Moving the populated horizon of the Date table forward, every worker learns the range populated by the others.
+    date_dimension.start(app, config.date_dimension.check_interval_seconds)
+
+    # Starting the checkpoints of the latency sketches of the worker.
+    if sketch_store is not None:
+        sketch_store.start(app, config.sketches.checkpoint_interval_seconds)
+
+    # Sharing the metrics of the worker with the other ones, so /prometheus exports all of them.
+    if config.prometheus.shared_dir:
+        instrumentation.start(config.prometheus.shared_dir, config.prometheus.snapshot_interval_seconds)
+
+    # Creation of the Write-Behind Buffer.
+    if config.write_behind.enabled:
+        write_behind = WriteBehindBuffer(
+            app,
+            max_queue_size=config.write_behind.max_queue_size,
+            flush_size=config.write_behind.flush_size,
+            flush_interval_ms=config.write_behind.flush_interval_ms,
+            mode=config.write_behind.mode
+        )
+        write_behind.start()
 
-# Creation of the tables in the database.
-with app.app_context():
-    db.init_app(app)
-    db.create_all()
-    db.session.commit()
+    # Competing for the jobs run by only one worker.
+    leader_election.start(lambda: start_leader(app))
+    startup_times["start_worker"] = time.monotonic() - start
+    logger.info(f"Worker ready to serve in {startup_times['start_worker']:.3f} s")
 
-@app.route("/metrics", methods = ["POST"])
+def stop_worker(app):
+    '''
+        This function stops the background work of a worker before it exits.
+            :param app: Flask
+                The Flask application.
+    '''
+    # Stopping the leader jobs and releasing the leadership.
+    if leader_election.is_leader:
+        service_discovery.stop()
+        for manager in (partition_manager, rollup_manager, staging_merger, flat_metrics_manager, sketch_folder):
+            if manager is not None:
+                manager.stop()
+    leader_election.stop()
+
+    # Writing the last metrics of the worker.
+    instrumentation.stop()
+    date_dimension.stop()
+
+    # Committing the writes queued in the Write-Behind Buffer.
+    if write_behind is not None:
+        write_behind.stop(config.write_behind.stop_timeout_seconds)
+
+    # Writing the last sketches of the worker.
+    if sketch_store is not None:
+        sketch_store.stop()
+        with app.app_context():
+            try:
+                sketch_store.checkpoint()
+            except Exception:
+                logger.exception("Sketch checkpoint failed")
+
+def write_records(write, *args, on_commit = None):
+    '''
+        This function writes records to the database, directly or through the Write-Behind Buffer.
+            :param write: callable
+                The function adding the records to the database session.
+            :param args: tuple
+                The arguments of the write function.
+            :param on_commit: callable, default = None
+                The function called once the records are committed, by the flusher of the Write-Behind Buffer
+                when the writes are acknowledged once queued.
+            :return: dict or None
+                The error body if the write failed, else None.
+    '''
+    if write_behind is not None:
+        with profiler.span("write_behind_submit"):
+            return write_behind.submit(write, *args, on_commit=on_commit)
+    with profiler.span("write"):
+        write(*args)
+    with profiler.span("commit"):
+        error = commit_session()
+    if error is None and on_commit is not None:
+        on_commit()
+    return error
+
+def remember_reports(results : list) -> None:
+    '''
+        This function remembers committed metrics reports, so their retries aren't written again,
+        and adds their latencies to the sketches.
+            :param results: list
+                The committed metrics reports.
+    '''
+    for result in results:
+        recent_reports.add(report_key(result))
+    if sketch_store is not None:
+        with profiler.span("sketches"):
+            sketch_store.add_reports(results)
+
+def write_stream_batch(batch : dict, saved : dict) -> tuple:
+    '''
+        This function writes a batch of events of an NDJSON stream to the database and commits it.
+        The users are written first, as the messages of the batch may refer to them.
+            :param batch: dict
+                The validated events, keyed by the event type.
+            :param saved: dict
+                The number of events of the stream saved, keyed by the event type, increased once the batch is committed.
+            :return: tuple
+                The number of metrics reports already saved, and the error body if the commit failed, else None.
+    '''
+    with profiler.span("write_batch"):
+        for result in batch["user"]:
+            save_user(result)
+        db.session.flush()
+        metrics = write_metrics(batch["metrics"]) if batch["metrics"] else 0
+        # The Date rows of the messages outside of the populated range are inserted at once.
+        date_ids = date_dimension.lookup_many([result["time"] for result, _ in batch["message"]])
+        messages = sum(
+            int(write_message(result, date_id, user_id)) for (result, user_id), date_id in zip(batch["message"], date_ids)
+        )
+        db.session.flush()
+    with profiler.span("commit"):
+        error = commit_session()
+    if error:
+        return 0, error
+
+    # Counting the committed events, remembering the reports and caching the ids of the new users.
+    # The latencies aren't added to the sketches, as they are bucketed by the ingest time and not by the report time.
+    saved["metrics"] += metrics
+    saved["message"] += messages
+    saved["user"] += len(batch["user"])
+    for result in batch["metrics"]:
+        recent_reports.add(report_key(result))
+    for result in batch["user"]:
+        user_id_cache.put(result["telegram_user_id"], result["user_id"])
+    return len(batch["metrics"]) - metrics, None
+
+@warehouse.cli.command("explain-access-paths")
+def explain_access_paths_command():
+    '''
+        This command checks that every access path of the warehouse is served by an index.
+    '''
+    failed = False
+    for name, (uses_index, plan) in explain_access_paths().items():
+        print(f"{'OK' if uses_index else 'SEQ SCAN':<10} {name}")
+        if not uses_index:
+            print(plan)
+            failed = True
+    if failed:
+        raise SystemExit(1)
+
+@warehouse.cli.command("roll-up")
+def roll_up_command():
+    '''
+        This command rolls up the metrics ingested since the last rollup.
+    '''
+    lower, upper = (rollup_manager or RollupManager()).roll_up()
+    print(f"Rolled up the metrics ingested from {lower} to {upper}")
+
+@warehouse.cli.command("merge-staged")
+def merge_staged_command():
+    '''
+        This command merges all the staged events into the Messages table.
+    '''
+    merged = (staging_merger or StagingMerger()).merge()
+    print(f"Merged the staged events of {merged} messages")
+
+@warehouse.cli.command("rebuild-flat-metrics")
+@click.option("--workers", type=int, default=config.flat_metrics.rebuild_workers, help="The number of chunks inserted in parallel.")
+@click.option("--chunks", type=int, default=config.flat_metrics.rebuild_chunks, help="The number of ranges of message ids.")
+def rebuild_flat_metrics_command(workers, chunks):
+    '''
+        This command rebuilds the Message Metrics Flat table from scratch.
+    '''
+    start = time.monotonic()
+    rows = (flat_metrics_manager or FlatMetricsManager()).rebuild(workers=workers, chunks=chunks)
+    print(f"Rebuilt {rows} rows in {time.monotonic() - start:.1f} s")
+
+@warehouse.cli.command("profile-report")
+@click.option("--url", default=None, help="The URL of the debug endpoint of the running warehouse.")
+@click.option("--spans/--no-spans", default=True, help="Show the phases of every request.")
+def profile_report_command(url, spans):
+    '''
+        This command prints the slowest sampled requests of a running warehouse.
+    '''
+    # The request has no body, so the token is the HMAC of an empty body.
+    if security_manager.hmac_mode == "raw":
+        token = security_manager.encode_raw_hmac(b"")
+    else:
+        token = security_manager._SecurityManager__encode_hmac(None)
+    response = requests.get(
+        url or f"http://{config.general.host}:{config.general.port}/debug/profile",
+        headers={"Token" : token},
+        timeout=10
+    )
+    if response.status_code != 200:
+        print(f"{response.status_code} {response.text}")
+        raise SystemExit(1)
+
+    report = response.json()
+    print(f"Sample rate {report['sample_rate']}, {report['sampled']} requests sampled")
+    for trace in report["slowest"]:
+        print(f"{trace['duration_ms']:10.3f} ms  {trace['endpoint']}  {trace['profile'] or ''}")
+        if spans:
+            for span in trace["spans"]:
+                print(f"{'':14}{'  ' * span['depth']}{span['name']:<24} {span['duration_ms']:10.3f} ms  x{span['count']}")
+
+@warehouse.cli.command("export")
+@click.argument("table")
+@click.option("--output", required=True, help="The path of the exported file.")
+@click.option("--format", "export_format", type=click.Choice(list(EXPORT_FORMATS)), default="parquet", help="The file format.")
+@click.option("--columns", default=None, help="The comma separated names of the exported columns, all of them by default.")
+@click.option("--since", default=None, help="The exclusive start of the time range, a unix timestamp or an ISO 8601 date.")
+@click.option("--until", default=None, help="The inclusive end of the time range.")
+@click.option("--incremental", default=None, help="The name of an incremental export, exporting the rows changed since its last run.")
+@click.option("--batch-size", type=int, default=config.export.batch_size, help="The number of rows read and written at once.")
+def export_command(table, output, export_format, columns, since, until, incremental, batch_size):
+    '''
+        This command exports a table to a Parquet or an Arrow IPC file, reading it batch by batch.
+    '''
+    try:
+        export = TableExport(
+            table, columns=columns.split(",") if columns else None, since=since, until=until, incremental=incremental,
+            export_format=export_format, batch_size=batch_size, lag_seconds=config.export.lag_seconds
+        )
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    start = time.monotonic()
+    rows = export.write(output)
+    print(f"Exported {rows} rows of {table} to {output} in {time.monotonic() - start:.1f} s")
+
+@warehouse.route("/metrics", methods = ["POST"])
+@instrumentation.instrument("metrics")
+@profiler.profile("metrics")
 def metrics():
     # Checking the access token.
-    check_response = security_manager.check_request(request)
+    with profiler.span("hmac"):
+        check_response = security_manager.check_request(request)
     if check_response != "OK":
         return check_response, check_response["code"]
     else:
         status_code = 200
         # Validating the request body schema.
-        result, status_code = metrics_schema.validate_json(request.json)
+        with profiler.span("validation"):
+            result, status_code = metrics_schema.validate_json(request.json)
         if status_code != 200:
             return result, status_code
+        elif report_key(result) in recent_reports:
+            # The report is a retry of a saved one.
+            return {
+                "message" : "Data saved!",
+            }, 200
         else:
-            # Extracting the correlation id and the service name.
-            correlation_id = result["correlation_id"]
-            service_name = result["service_name"]
-
-            # Extracting from the database the message with the correlation id.
-            message = MessagesModel.query.filter_by(id=correlation_id).first()
-
-            # Creating the Latency metrics record.
-            latency_index = uuid.uuid4()
-            latency_record = LatencyModel(
-                latency_index,
-                result["latency"]["lock_time"],
-                result["latency"]["queue_waiting_time"],
-                result["latency"]["actual_processing"],
-                result["latency"]["task_service_time"],
-                result["latency"]["database_response_time"],
-                service_name
-            )
-
-            # Creating the Traffic metrics record.
-            traffic_index = uuid.uuid4()
-            traffic_record = TrafficModel(
-                traffic_index,
-                result["traffic"]["write_query"],
-                result["traffic"]["read_query"],
-                service_name
-            )
-
-            # Creating the Errors metrics record.
-            errors_index = uuid.uuid4()
-            errors_record = ErrorsModel(
-                errors_index,
-                result["errors"]["request_status"],
-                result["errors"]["db_error"],
-                result["errors"]["request_reason"],
-                service_name
-            )
-
-            # Creating the Saturation metrics record.
-            saturation_index = uuid.uuid4()
-            saturation_record = SaturationModel(
-                saturation_index,
-                result["saturation"]["cpu_utilization"],
-                result["saturation"]["ram_utilization"],
-                result["saturation"]["waiting_queue_length"],
-                result["saturation"]["thread_capacity"],
-                service_name
-            )
-
-            # Inserting the metrics records into the tables.
-            db.session.add(latency_record)
-            db.session.add(errors_record)
-            db.session.add(traffic_record)
-            db.session.add(saturation_record)
-
-            # Trying to commit the records to the database.
-            try:
-                db.session.commit()
-            except Exception as e:
-                error = {
-                    "name" : e.__class__.__name__,
-                    "cause" : e.__cause__.__repr__()
-                }
-                return error, 500
-
-            # Checking if there is a message with the provided correlation id.
-            if not message:
-                # In case the message is missing a new message record is created.
-                message = MessagesModel(correlation_id)
-
-            # Updating the message record with the service metrics indexes.
-            if service_name == "intent-service":
-                message.intent_errors_id = errors_index
-                message.intent_traffic_id = traffic_index
-                message.intent_saturation_id = saturation_index,
-                message.intent_latency_id = latency_index
-            elif service_name == "named-entity-recognition-service":
-                message.ner_errors_id = errors_index
-                message.ner_saturation_id = saturation_index
-                message.ner_traffic_id = traffic_index
-                message.ner_latency_id = latency_index
-            elif service_name == "sentiment-service":
-                message.sentiment_errors_id = errors_index
-                message.sentiment_traffic_id = traffic_index
-                message.sentiment_saturation_id = saturation_index
-                message.sentiment_latency_id = latency_index
-            elif service_name == "sequence2sequence-service":
-                message.seq_errors_id = errors_index
-                message.seq_traffic_id = traffic_index
-                message.seq_saturation_id = saturation_index
-                message.seq_latency_id = latency_index
-            # Adding the message to the Messages table.
-            db.session.add(message)
-
-            # Trying to commit the changes.
-            try:
-                db.session.commit()
-            except Exception as e:
-                error = {
-                    "name" : e.__class__.__name__,
-                    "cause" : e.__cause__.__repr__()
-                    }
+            # Writing the metrics records and the message links, the report is remembered once committed.
+            error = write_records(write_metrics, [result], on_commit=lambda: remember_reports([result]))
+            if error:
                 return error, 500
             # Returning the successful message.
             return {
                 "message" : "Data saved!",
             }, 200
 
-@app.route("/user", methods=["POST"])
-def user():
+@warehouse.route("/metrics/batch", methods = ["POST"])
+@instrumentation.instrument("metrics_batch")
+@profiler.profile("metrics_batch")
+def metrics_batch():
+    # Checking the access token.
+    with profiler.span("hmac"):
+        check_response = security_manager.check_request(request)
+    if check_response != "OK":
+        return check_response, check_response["code"]
+    elif not isinstance(request.json, list):
+        return {
+            "message" : "The request body must be a list of metrics reports!",
+            "code" : 400
+        }, 400
+    else:
+        # Validating every metrics report separately.
+        results = []
+        errors = dict()
+        keys = set()
+        duplicates = 0
+        with profiler.span("validation"):
+            for index, report in enumerate(request.json):
+                result, status_code = metrics_schema.validate_json(report)
+                if status_code != 200:
+                    errors[index] = result
+                elif report_key(result) in recent_reports or report_key(result) in keys:
+                    # The report is a retry of a saved one or repeated in the batch.
+                    duplicates += 1
+                else:
+                    keys.add(report_key(result))
+                    results.append(result)
+
+        # If every report is a retry nothing is written.
+        if not results and duplicates:
+            return {
+                "message" : "Data saved!",
+                "saved" : 0,
+                "duplicates" : duplicates,
+                "errors" : errors
+            }, 200
+
+        # If no report passed the validation nothing is written.
+        if not results:
+            return {
+                "message" : "No valid metrics reports!",
+                "errors" : errors
+            }, 400
+
+        # Writing all the valid reports in one transaction, they are remembered once committed.
+        error = write_records(write_metrics, results, on_commit=lambda: remember_reports(results))
+        if error:
+            return error, 500
+        # Returning the successful message with the errors of the rejected reports.
+        return {
+            "message" : "Data saved!",
+            "saved" : len(results),
+            "duplicates" : duplicates,
+            "errors" : errors
+        }, 200
+
+@warehouse.route("/ingest/stream", methods=["POST"])
+@instrumentation.instrument("ingest_stream")
+@profiler.profile("ingest_stream")
+def ingest_stream():
+    # Checking the presence of the access token.
+    check_response = security_manager.check_access_token(dict(request.headers))
+    if check_response != "OK":
+        return check_response, check_response["code"]
+
+    # Reading the whole body and authenticating it before anything is written, so a tampered stream writes nothing.
+    digest = security_manager.raw_hmac()
+    try:
+        with profiler.span("spool"):
+            body = spool_body(request.stream, digest, config.stream.max_body_bytes,
+                              config.stream.max_memory_bytes, config.stream.block_size)
+    except ValueError as e:
+        return {
+            "message" : str(e),
+            "code" : 413
+        }, 413
+    if not security_manager.verify_raw_hmac(request.headers["Token"], digest):
+        body.close()
+        return {
+            "message" : "401 Unauthorized",
+            "code" : 401
+        }, 401
+
+    saved = {"metrics" : 0, "message" : 0, "user" : 0}
+    errors = dict()
+    error_count = 0
+    duplicates = 0
+    lines = 0
+    batch = {"metrics" : [], "message" : [], "user" : []}
+    batch_keys = set()
+    batch_length = 0
+    stream_users = dict()
+    try:
+        for lines, offset, line in ndjson_lines(body, config.stream.max_line_bytes, config.stream.block_size):
+            if line is not None and not line.strip():
+                continue
+
+            # Parsing and validating the event of the line.
+            with profiler.span("validation"):
+                if line is None:
+                    result, status_code = {"message" : "The line is too long!", "code" : 413}, 413
+                else:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        event = None
+                    if not isinstance(event, dict) or event.get("type") not in batch:
+                        result, status_code = {
+                            "message" : "The line must be a JSON object with a type among metrics, message and user and a body!",
+                            "code" : 400
+                        }, 400
+                    else:
+                        event_type = event["type"]
+                        result, status_code = {"metrics" : metrics_schema, "message" : message_schema,
+                                               "user" : user_schema}[event_type].validate_json(event.get("body"))
+
+            # Resolving the user of a message, the users of the current batch aren't committed yet.
+            if status_code == 200 and event_type == "message":
+                user_id = stream_users.get(result["telegram_user_id"]) or \
+                          user_id_cache.resolve(result["telegram_user_id"])
+                if user_id is None:
+                    result, status_code = {"message" : "User not found!", "code" : 404}, 404
+                else:
+                    result = (result, user_id)
+
+            if status_code != 200:
+                error_count += 1
+                if len(errors) < config.stream.max_errors:
+                    errors[lines] = {"offset" : offset, **result}
+                continue
+            elif event_type == "metrics":
+                # A retried report in the same batch or recently saved is skipped, the older ones are skipped by the database.
+                if report_key(result) in batch_keys or report_key(result) in recent_reports:
+                    duplicates += 1
+                    continue
+                batch_keys.add(report_key(result))
+            elif event_type == "user":
+                # A replayed user already saved is skipped, instead of failing the whole stream.
+                if result["telegram_user_id"] in stream_users or \
+                   user_id_cache.resolve(result["telegram_user_id"]) is not None:
+                    duplicates += 1
+                    continue
+                stream_users[result["telegram_user_id"]] = result["user_id"]
+            batch[event_type].append(result)
+            batch_length += 1
+
+            # Committing the full batch, so a failure only loses the current one.
+            if batch_length >= config.stream.batch_size:
+                batch_duplicates, error = write_stream_batch(batch, saved)
+                if error:
+                    return {**error, "line" : lines, "saved" : saved}, 500
+                duplicates += batch_duplicates
+                batch = {"metrics" : [], "message" : [], "user" : []}
+                batch_keys.clear()
+                batch_length = 0
+        batch_duplicates, error = write_stream_batch(batch, saved)
+        if error:
+            return {**error, "line" : lines, "saved" : saved}, 500
+        duplicates += batch_duplicates
+    except Exception as e:
+        db.session.rollback()
+        return {
+            "name" : e.__class__.__name__,
+            "cause" : e.__repr__(),
+            "line" : lines,
+            "saved" : saved
+        }, 500
+    finally:
+        body.close()
+
+    return {
+        "message" : "Data saved!",
+        "lines" : lines,
+        "saved" : saved,
+        "duplicates" : duplicates,
+        "error_count" : error_count,
+        "errors" : errors
+    }, 200
+
+@warehouse.route("/metrics/summary", methods=["GET"])
+def metrics_summary():
     # Checking the access token.
     check_response = security_manager.check_request(request)
+    if check_response != "OK":
+        return check_response, check_response["code"]
+    elif sketch_store is None:
+        return {
+            "message" : "The latency sketches are disabled!",
+            "code" : 404
+        }, 404
+
+    # Parsing the service name and the time window, like '300', '15m', '1h' or '7d'.
+    service_name = request.args.get("service")
+    window = request.args.get("window", "1h")
+    units = {"s" : 1, "m" : 60, "h" : 3600, "d" : 86400}
+    try:
+        if window[-1] in units:
+            window_seconds = int(window[:-1]) * units[window[-1]]
+        else:
+            window_seconds = int(window)
+    except (ValueError, IndexError):
+        window_seconds = 0
+    if not service_name or not 0 < window_seconds <= config.sketches.max_window_seconds:
+        return {
+            "message" : "The service and a window of at most "
+                        f"{config.sketches.max_window_seconds} seconds must be provided!",
+            "code" : 400
+        }, 400
+
+    return {
+        "service_name" : service_name,
+        "window_seconds" : window_seconds,
+        "latency" : sketch_store.summary(service_name, window_seconds)
+    }, 200
+
+@warehouse.route("/user", methods=["POST"])
+@instrumentation.instrument("user")
+@profiler.profile("user")
+def user():
+    # Checking the access token.
+    with profiler.span("hmac"):
+        check_response = security_manager.check_request(request)
     if check_response != "OK":
         return check_response, check_response["code"]
     else:
         status_code = 200
         # Validating the request body schema.
-        result, status_code = user_schema.validate_json(request.json)
+        with profiler.span("validation"):
+            result, status_code = user_schema.validate_json(request.json)
         if status_code != 200:
             return result, status_code
         else:
-            # Creating a new user record.
-            new_user = UserModel(
-                result["user_id"],
-                result["telegram_user_id"],
-                result["chat_id"],
-                result["first_name"],
-                result["last_name"],
-                result["telegram_username"],
-                result["app_id"]
+            # Writing the user record, its id is cached once committed.
+            error = write_records(
+                save_user, result, on_commit=lambda: user_id_cache.put(result["telegram_user_id"], result["user_id"])
             )
-            # Inserting the user record into the User table.
-            db.session.add(new_user)
-
-            # Trying to commit the changes to the database.
-            try:
-                db.session.commit()
-            except Exception as e:
-                error = {
-                    "name" : e.__class__.__name__,
-                    "cause" : e.__cause__.__repr__()
-                }
+            if error:
                 return error, 500
             # Returning the successful message.
             return {
                 "message" : "Data saved!",
             }, 200
 
-@app.route("/message", methods=["POST"])
+@warehouse.route("/message", methods=["POST"])
+@instrumentation.instrument("message")
+@profiler.profile("message")
 def message():
     # Checking the access token.
-    check_response = security_manager.check_request(request)
+    with profiler.span("hmac"):
+        check_response = security_manager.check_request(request)
     if check_response != "OK":
         return check_response, check_response["code"]
     else:
         status_code = 200
         # Validating the request body schema.
-        result, status_code = message_schema.validate_json(request.json)
+        with profiler.span("validation"):
+            result, status_code = message_schema.validate_json(request.json)
         if status_code != 200:
             return result, status_code
         else:
-            # Creating a new id for the Date table.
-            date_id = uuid.uuid4()
-
-            # Converting the UNIX timestamp into date features.
-            date_dict = unix_to_date_dict(result["time"])
-
-            # Getting the id of the user sanding the message.
-            user_id = UserModel.query.filter_by(telegram_id=result["telegram_user_id"]).first().id
-
-            # Creating a new Date record.
-            new_date_record = DateModel(
-                date_id,
-                date_dict["date"],
-                date_dict["month"],
-                date_dict["month_str"],
-                date_dict["year"],
-                date_dict["hour"],
-                date_dict["minute"],
-                date_dict["seconds"],
-                date_dict["day_of_week"],
-                date_dict["is_weekend"],
-                date_dict["is_holiday"]
-            )
-            # Getting the Message record with the provided correlation id.
-            message = MessagesModel.query.filter_by(id=result["correlation_id"]).first()
-
-            # If there is a message with such a correlation id, then it's record is updated with the values
-            # from the request body.
-            if message:
-                message.text = result["text"]
-                message.intent = result["intent"]
-                message.sentiment = result["sentiment"]
-                message.ner = result["ner"]
-                message.response = result["response"]
-                message.is_seq2seq = result["is_seq2seq"]
-                message.business_logic_response = result["business_logic_response"]
-                message.is_intent_cached = result["is_intent_cached"]
-                message.is_sentiment_cached = result["is_sentiment_cached"]
-                message.is_ner_cached = result["is_ner_cached"]
-                message.is_sequence_cached = result["is_sequence_cached"]
-                message.user_id = user_id
-                message.date_id = date_id
-            # Inserting the date record to the data base.
-            db.session.add(new_date_record)
-
-            # Trying to commit the changes to the data base.
-            try:
-                db.session.commit()
-            except Exception as e:
-                error = {
-                    "name" : e.__class__.__name__,
-                    "cause" : e.__cause__.__repr__()
-                }
+            # Getting the id of the user sending the message.
+            with profiler.span("user_lookup"):
+                user_id = user_id_cache.resolve(result["telegram_user_id"])
+            if user_id is None:
+                return {
+                    "message" : "User not found!",
+                    "code" : 404
+                }, 404
+
+            # Looking up the Date record of the message time.
+            with profiler.span("date_lookup"):
+                date_id = date_dimension.lookup(result["time"])
+
+            # Writing the message fields.
+            error = write_records(write_message, result, date_id, user_id)
+            if error:
                 return error, 500
             # Returning the successful message.
             return {
                 "message" : "Data saved!",
             }, 200
 
-# Running the main flask module.
+@warehouse.route("/write-behind", methods=["GET"])
+def write_behind_stats():
+    # Checking the access token.
+    check_response = security_manager.check_request(request)
+    if check_response != "OK":
+        return check_response, check_response["code"]
+    elif write_behind is None:
+        return {
+            "message" : "The write-behind mode is disabled!",
+            "code" : 404
+        }, 404
+    else:
+        return write_behind.stats(), 200
+
+@warehouse.route("/debug/profile", methods=["GET"])
+def debug_profile():
+    # Checking the access token.
+    check_response = security_manager.check_request(request)
+    if check_response != "OK":
+        return check_response, check_response["code"]
+    elif not config.profiler.enabled:
+        return {
+            "message" : "The profiler is disabled!",
+            "code" : 404
+        }, 404
+    else:
+        return profiler.report(), 200
+
+@warehouse.route("/export/<table>", methods=["GET"])
+def export_table(table):
+    # Checking the access token.
+    check_response = security_manager.check_request(request)
+    if check_response != "OK":
+        return check_response, check_response["code"]
+
+    # Checking the export options, nothing is read before they are valid.
+    try:
+        table_export = TableExport(
+            table,
+            columns=request.args["columns"].split(",") if request.args.get("columns") else None,
+            since=request.args.get("since"),
+            until=request.args.get("until"),
+            incremental=request.args.get("incremental"),
+            export_format=request.args.get("format", "parquet"),
+            batch_size=min(request.args.get("batch_size", config.export.batch_size, type=int), config.export.max_batch_size),
+            lag_seconds=config.export.lag_seconds
+        )
+    except ValueError as e:
+        return {
+            "message" : str(e),
+            "code" : 400
+        }, 400
+
+    # Streaming the file while it's written.
+    extension = "parquet" if table_export.export_format == "parquet" else "arrows"
+    return Response(
+        stream_with_context(table_export.stream()),
+        mimetype=EXPORT_FORMATS[table_export.export_format],
+        headers={"Content-Disposition" : f"attachment; filename={table}.{extension}"}
+    )
+
+@warehouse.route("/lifecycle", methods=["GET"])
+def lifecycle():
+    # Checking the access token.
+    check_response = security_manager.check_request(request)
+    if check_response != "OK":
+        return check_response, check_response["code"]
+    else:
+        return {
+            "startup_seconds" : startup_times,
+            "leader" : leader_election.is_leader,
+            "service_discovery" : service_discovery.stats() if leader_election.is_leader else None
+        }, 200
+
+@warehouse.route("/prometheus", methods=["GET"])
+def prometheus():
+    # Exporting the metrics of the warehouse itself in the Prometheus text format.
+    return instrumentation.render(), 200, {"Content-Type" : "text/plain; version=0.0.4"}
+
+# Running the main flask module in a single process, see gunicorn.conf.py for the multi-worker mode.
 if __name__ == "__main__":
-    app.run(
-        #port=config.general.port,
-        port=config.general.port,
-        #host=config.general.host
-        host="0.0.0.0"
-    )
\ No newline at end of file
+    logging.basicConfig(level=logging.INFO, format="[%(asctime)s] [%(levelname)s] %(name)s: %(message)s")
+    app = create_app()
+    setup_database(app)
+    if config.prometheus.shared_dir:
+        clear_snapshots(config.prometheus.shared_dir)
+    start_worker(app)
+    try:
+        app.run(
+            #port=config.general.port,
+            port=config.general.port,
+            #host=config.general.host
+            host="0.0.0.0"
+        )
+    finally:
+        stop_worker(app)
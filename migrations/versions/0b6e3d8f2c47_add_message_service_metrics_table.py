@@ -0,0 +1,100 @@
+"""Add the long metrics links table and the messages_wide view
+
+Revision ID: 0b6e3d8f2c47
+Revises: f4c8d2e61a95
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+
+# revision identifiers, used by Alembic.
+revision = '0b6e3d8f2c47'
+down_revision = 'f4c8d2e61a95'
+branch_labels = None
+depends_on = None
+
+# The services linking their metrics to the messages and the prefixes of their columns in the messages table.
+SERVICE_PREFIXES = [
+    ('intent-service', 'intent'),
+    ('sentiment-service', 'sentiment'),
+    ('named-entity-recognition-service', 'ner'),
+    ('sequence2sequence-service', 'seq'),
+    ('business-logic-service', 'bl')
+]
+
+METRIC_TABLES = ['latency', 'traffic', 'errors', 'saturation']
+
+# The columns of the messages table at this revision, in their order.
+MESSAGE_COLUMNS = [
+    'id', 'text', 'intent', 'sentiment', 'ner', 'response', 'is_seq2seq', 'business_logic_response',
+    'is_intent_cached', 'is_sentiment_cached', 'is_ner_cached', 'is_sequence_cached', 'date_id', 'user_id'
+] + [f'{prefix}_{table}_id' for _, prefix in SERVICE_PREFIXES for table in METRIC_TABLES]
+
+
+def messages_wide_view(message_columns):
+    '''
+        This function returns the statement creating the messages_wide view over the given messages columns,
+        the metrics links being read from the message_service_metrics table first.
+    '''
+    links = {
+        f'{prefix}_{table}_id' : (service_name, f'{table}_id')
+        for service_name, prefix in SERVICE_PREFIXES
+        for table in METRIC_TABLES
+    }
+    columns = []
+    pivots = []
+    for column in message_columns:
+        if column in links:
+            service_name, link = links[column]
+            pivots.append(f"(array_agg({link}) FILTER (WHERE service = '{service_name}'))[1] AS {column}")
+            columns.append(f'coalesce(links.{column}, messages.{column}) AS {column}')
+        else:
+            columns.append(f'messages.{column}')
+    return f"CREATE OR REPLACE VIEW messages_wide AS SELECT {', '.join(columns)} FROM messages " \
+           f"LEFT JOIN LATERAL (SELECT {', '.join(pivots)} FROM message_service_metrics " \
+           f"WHERE message_service_metrics.correlation_id = messages.id) AS links ON true"
+
+
+def column_type(table, column):
+    '''
+        This function returns the current type of the column in the database.
+    '''
+    for column_info in sa.inspect(op.get_bind()).get_columns(table):
+        if column_info['name'] == column:
+            return column_info['type']
+
+
+def is_partitioned(table):
+    '''
+        This function checks if the table is partitioned in the database.
+    '''
+    return op.get_bind().execute(sa.text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table JOIN pg_class ON partrelid = pg_class.oid "
+        "WHERE relname = :table)"
+    ), {'table' : table}).scalar()
+
+
+def upgrade():
+    # The table may have been created by db.create_all() already.
+    if not sa.inspect(op.get_bind()).has_table('message_service_metrics'):
+        # The links have the key type of the metrics tables, and no foreign keys to the partitioned ones.
+        key_type = column_type('latency', 'id')
+        partitioned = is_partitioned('latency')
+        op.create_table(
+            'message_service_metrics',
+            sa.Column('correlation_id', sa.String(64), primary_key=True),
+            sa.Column('service', sa.String(64), primary_key=True),
+            *[
+                sa.Column(f'{table}_id', key_type, *(() if partitioned else (sa.ForeignKey(f'{table}.id'),)), nullable=True)
+                for table in METRIC_TABLES
+            ]
+        )
+    op.execute(messages_wide_view(MESSAGE_COLUMNS))
+
+
+def downgrade():
+    op.execute("DROP VIEW IF EXISTS messages_wide")
+    op.drop_table('message_service_metrics')
@@ -0,0 +1,40 @@
+"""Add the indexes of the warehouse access paths
+
+Revision ID: 3c1f6a2b9d10
+Revises:
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '3c1f6a2b9d10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# The metrics tables filtered by the service name.
+METRIC_TABLES = ['latency', 'traffic', 'errors', 'saturation']
+
+# The foreign keys of the messages table used in joins.
+MESSAGE_FOREIGN_KEYS = ['date_id', 'user_id'] + [
+    f'{prefix}_{table}_id'
+    for prefix in ['intent', 'sentiment', 'ner', 'seq', 'bl']
+    for table in METRIC_TABLES
+]
+
+
+def upgrade():
+    # The tables may have been created by db.create_all() with the indexes already in place.
+    for table in METRIC_TABLES:
+        op.execute(f'CREATE INDEX IF NOT EXISTS ix_{table}_service_name ON {table} (service_name)')
+    for column in MESSAGE_FOREIGN_KEYS:
+        op.execute(f'CREATE INDEX IF NOT EXISTS ix_messages_{column} ON messages ({column})')
+
+
+def downgrade():
+    for column in MESSAGE_FOREIGN_KEYS:
+        op.execute(f'DROP INDEX IF EXISTS ix_messages_{column}')
+    for table in METRIC_TABLES:
+        op.execute(f'DROP INDEX IF EXISTS ix_{table}_service_name')
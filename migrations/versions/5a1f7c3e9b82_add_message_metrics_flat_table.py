@@ -0,0 +1,126 @@
+"""Add the change moments and the flattened message metrics table
+
+Revision ID: 5a1f7c3e9b82
+Revises: 0b6e3d8f2c47
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a1f7c3e9b82'
+down_revision = '0b6e3d8f2c47'
+branch_labels = None
+depends_on = None
+
+# The services linking their metrics to the messages and the prefixes of their columns in the messages table.
+SERVICE_PREFIXES = [
+    ('intent-service', 'intent'),
+    ('sentiment-service', 'sentiment'),
+    ('named-entity-recognition-service', 'ner'),
+    ('sequence2sequence-service', 'seq'),
+    ('business-logic-service', 'bl')
+]
+
+METRIC_TABLES = ['latency', 'traffic', 'errors', 'saturation']
+
+# The columns of the messages table at this revision, in their order.
+MESSAGE_COLUMNS = [
+    'id', 'text', 'intent', 'sentiment', 'ner', 'response', 'is_seq2seq', 'business_logic_response',
+    'is_intent_cached', 'is_sentiment_cached', 'is_ner_cached', 'is_sequence_cached', 'date_id', 'user_id'
+] + [f'{prefix}_{table}_id' for _, prefix in SERVICE_PREFIXES for table in METRIC_TABLES] + ['updated_at']
+
+# The columns of the message_metrics_flat table copied from the messages, date and user tables.
+FLAT_MESSAGE_COLUMNS = [
+    ('text', sa.Text()), ('intent', sa.String(32)), ('sentiment', sa.Float()), ('response', sa.Text()),
+    ('is_seq2seq', sa.Boolean()), ('is_intent_cached', sa.Boolean()), ('is_sentiment_cached', sa.Boolean()),
+    ('is_ner_cached', sa.Boolean()), ('is_sequence_cached', sa.Boolean()), ('date_id', None),
+    ('user_id', sa.String(64)), ('date', sa.Date()), ('year', sa.Integer()), ('month', sa.Integer()),
+    ('day_of_week', sa.Integer()), ('hour', sa.Integer()), ('minute', sa.Integer()), ('is_weekend', sa.Boolean()),
+    ('is_holiday', sa.Boolean()), ('app_id', sa.Integer()), ('telegram_id', sa.Integer())
+]
+
+# The value columns of the metrics tables inlined once per service prefix.
+FLAT_METRIC_COLUMNS = [
+    ('lock_time_per_process', sa.Float()), ('queue_waiting_time', sa.Float()),
+    ('actual_processing_time', sa.Float()), ('task_service_time', sa.Float()),
+    ('database_response_time', sa.Float()), ('write_query', sa.Integer()), ('read_query', sa.Integer()),
+    ('status_code', sa.Integer()), ('db_error', sa.Text()), ('reason', sa.Text()),
+    ('cpu_utilization', sa.Float()), ('ram_utilization', sa.Float()), ('waiting_queue_length', sa.Integer()),
+    ('thread_capacity', sa.Float())
+]
+
+
+def messages_wide_view(message_columns):
+    '''
+        This function returns the statement creating the messages_wide view over the given messages columns,
+        the metrics links being read from the message_service_metrics table first.
+    '''
+    links = {
+        f'{prefix}_{table}_id' : (service_name, f'{table}_id')
+        for service_name, prefix in SERVICE_PREFIXES
+        for table in METRIC_TABLES
+    }
+    columns = []
+    pivots = []
+    for column in message_columns:
+        if column in links:
+            service_name, link = links[column]
+            pivots.append(f"(array_agg({link}) FILTER (WHERE service = '{service_name}'))[1] AS {column}")
+            columns.append(f'coalesce(links.{column}, messages.{column}) AS {column}')
+        else:
+            columns.append(f'messages.{column}')
+    return f"CREATE OR REPLACE VIEW messages_wide AS SELECT {', '.join(columns)} FROM messages " \
+           f"LEFT JOIN LATERAL (SELECT {', '.join(pivots)} FROM message_service_metrics " \
+           f"WHERE message_service_metrics.correlation_id = messages.id) AS links ON true"
+
+
+def column_type(table, column):
+    '''
+        This function returns the current type of the column in the database.
+    '''
+    for column_info in sa.inspect(op.get_bind()).get_columns(table):
+        if column_info['name'] == column:
+            return column_info['type']
+
+
+def upgrade():
+    # The columns may have been created by db.create_all() already.
+    op.execute("ALTER TABLE messages ADD COLUMN IF NOT EXISTS updated_at timestamptz NOT NULL DEFAULT now()")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_messages_updated_at ON messages (updated_at)")
+    op.execute("ALTER TABLE message_service_metrics ADD COLUMN IF NOT EXISTS linked_at timestamptz NOT NULL DEFAULT now()")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_message_service_metrics_linked_at ON message_service_metrics (linked_at)")
+
+    # The view gets the new column of the messages table.
+    op.execute(messages_wide_view(MESSAGE_COLUMNS))
+
+    # The date keys are strings or time buckets, depending on the key mode of the database.
+    if not sa.inspect(op.get_bind()).has_table('message_metrics_flat'):
+        op.create_table(
+            'message_metrics_flat',
+            sa.Column('id', sa.String(64), primary_key=True),
+            *[
+                sa.Column(name, column_type('messages', 'date_id') if name == 'date_id' else type_)
+                for name, type_ in FLAT_MESSAGE_COLUMNS
+            ],
+            *[
+                sa.Column(f'{prefix}_{name}', type_)
+                for _, prefix in SERVICE_PREFIXES
+                for name, type_ in FLAT_METRIC_COLUMNS
+            ],
+            sa.Column('refreshed_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False)
+        )
+
+
+def downgrade():
+    op.drop_table('message_metrics_flat')
+
+    # The view of the previous revision doesn't read the dropped column.
+    op.execute("DROP VIEW IF EXISTS messages_wide")
+    op.execute(messages_wide_view(MESSAGE_COLUMNS[:-1]))
+    op.execute("DROP INDEX IF EXISTS ix_message_service_metrics_linked_at")
+    op.execute("ALTER TABLE message_service_metrics DROP COLUMN IF EXISTS linked_at")
+    op.execute("DROP INDEX IF EXISTS ix_messages_updated_at")
+    op.execute("ALTER TABLE messages DROP COLUMN IF EXISTS updated_at")
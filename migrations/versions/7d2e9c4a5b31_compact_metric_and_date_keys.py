@@ -0,0 +1,126 @@
+"""Convert the metrics and date keys to the compact native types
+
+Revision ID: 7d2e9c4a5b31
+Revises: 3c1f6a2b9d10
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from alembic import op, context
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '7d2e9c4a5b31'
+down_revision = '3c1f6a2b9d10'
+branch_labels = None
+depends_on = None
+
+METRIC_TABLES = ['latency', 'traffic', 'errors', 'saturation']
+
+# The messages columns referencing the metrics tables.
+MESSAGE_METRIC_KEYS = [
+    (f'{prefix}_{table}_id', table)
+    for prefix in ['intent', 'sentiment', 'ner', 'seq', 'bl']
+    for table in METRIC_TABLES
+]
+
+
+def migration_option(name, default):
+    '''
+        This function returns an option of the migration, given by `flask db upgrade -x name=value`.
+    '''
+    return context.get_x_argument(as_dictionary=True).get(name, default)
+
+
+def column_type(table, column):
+    '''
+        This function returns the current type of the column in the database.
+    '''
+    for column_info in sa.inspect(op.get_bind()).get_columns(table):
+        if column_info['name'] == column:
+            return column_info['type']
+
+
+def drop_key_foreign_keys():
+    '''
+        This function drops the foreign keys of the messages table pointing to the metrics and date tables.
+    '''
+    for foreign_key in sa.inspect(op.get_bind()).get_foreign_keys('messages'):
+        if foreign_key['referred_table'] in METRIC_TABLES + ['date']:
+            op.drop_constraint(foreign_key['name'], 'messages', type_='foreignkey')
+
+
+def create_key_foreign_keys():
+    '''
+        This function creates again the foreign keys of the messages table pointing to the metrics and date tables.
+    '''
+    for column, table in MESSAGE_METRIC_KEYS:
+        op.create_foreign_key(f'messages_{column}_fkey', 'messages', table, [column], ['id'])
+    op.create_foreign_key('messages_date_id_fkey', 'messages', 'date', ['date_id'], ['id'])
+
+
+def upgrade():
+    # The conversion is done only for the compact keys mode, asked with -x compact_keys=1, and only once.
+    if migration_option('compact_keys', '0') != '1' or isinstance(column_type('latency', 'id'), postgresql.UUID):
+        return
+    bucket_seconds = int(migration_option('date_bucket_seconds', '60'))
+    drop_key_foreign_keys()
+
+    # The metrics ids are already UUIDs stored as text.
+    for table in METRIC_TABLES:
+        op.execute(f'ALTER TABLE {table} ALTER COLUMN id TYPE uuid USING id::uuid')
+    for column, table in MESSAGE_METRIC_KEYS:
+        op.execute(f'ALTER TABLE messages ALTER COLUMN {column} TYPE uuid USING {column}::uuid')
+
+    # The date rows created before the date dimension have random ids,
+    # so the messages are moved to the time bucket of their date row.
+    op.execute(f'''
+        CREATE TEMPORARY TABLE date_buckets ON COMMIT DROP AS
+        SELECT d.id AS old_id,
+               (floor(extract(epoch FROM d.date + make_interval(hours => d.hour, mins => d.minute, secs => d.seconds))
+                / {bucket_seconds}) * {bucket_seconds})::bigint AS key,
+               d.is_holiday
+        FROM date AS d
+        WHERE d.id !~ '^-?[0-9]+$'
+    ''')
+    op.execute('''
+        INSERT INTO date (id, date, month, month_str, year, hour, minute, seconds, day_of_week, is_weekend, is_holiday)
+        SELECT DISTINCT ON (key)
+               key::text,
+               (to_timestamp(key) AT TIME ZONE 'UTC')::date,
+               extract(month FROM to_timestamp(key) AT TIME ZONE 'UTC'),
+               trim(to_char(to_timestamp(key) AT TIME ZONE 'UTC', 'Month')),
+               extract(year FROM to_timestamp(key) AT TIME ZONE 'UTC'),
+               extract(hour FROM to_timestamp(key) AT TIME ZONE 'UTC'),
+               extract(minute FROM to_timestamp(key) AT TIME ZONE 'UTC'),
+               floor(extract(second FROM to_timestamp(key) AT TIME ZONE 'UTC')),
+               extract(isodow FROM to_timestamp(key) AT TIME ZONE 'UTC'),
+               extract(isodow FROM to_timestamp(key) AT TIME ZONE 'UTC') IN (6, 7),
+               is_holiday
+        FROM date_buckets
+        ON CONFLICT (id) DO NOTHING
+    ''')
+    op.execute('''
+        UPDATE messages SET date_id = date_buckets.key::text
+        FROM date_buckets
+        WHERE messages.date_id = date_buckets.old_id
+    ''')
+    op.execute('DELETE FROM date WHERE id IN (SELECT old_id FROM date_buckets)')
+    op.execute('ALTER TABLE date ALTER COLUMN id TYPE bigint USING id::bigint')
+    op.execute('ALTER TABLE messages ALTER COLUMN date_id TYPE bigint USING date_id::bigint')
+
+    create_key_foreign_keys()
+
+
+def downgrade():
+    if not isinstance(column_type('latency', 'id'), postgresql.UUID):
+        return
+    drop_key_foreign_keys()
+
+    for table in METRIC_TABLES + ['date']:
+        op.execute(f'ALTER TABLE {table} ALTER COLUMN id TYPE varchar(64) USING id::text')
+    for column, table in MESSAGE_METRIC_KEYS + [('date_id', 'date')]:
+        op.execute(f'ALTER TABLE messages ALTER COLUMN {column} TYPE varchar(64) USING {column}::text')
+
+    create_key_foreign_keys()
@@ -0,0 +1,34 @@
+"""Add the state table of the incremental exports
+
+Revision ID: 8c2d6f4a1e39
+Revises: 5a1f7c3e9b82
+Create Date: 2026-10-18 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c2d6f4a1e39'
+down_revision = '5a1f7c3e9b82'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The table may have been created by db.create_all() already.
+    if sa.inspect(op.get_bind()).has_table('export_state'):
+        return
+    op.create_table(
+        'export_state',
+        sa.Column('name', sa.String(128), primary_key=True),
+        sa.Column('table_name', sa.String(64), nullable=False),
+        sa.Column('high_water_mark', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('rows', sa.BigInteger(), nullable=False),
+        sa.Column('exported_at', sa.DateTime(timezone=True), nullable=False)
+    )
+
+
+def downgrade():
+    op.drop_table('export_state')
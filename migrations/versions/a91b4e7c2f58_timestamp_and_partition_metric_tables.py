@@ -0,0 +1,153 @@
+"""Add the ingest timestamp to the metrics tables and partition them by it
+
+Revision ID: a91b4e7c2f58
+Revises: 7d2e9c4a5b31
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from datetime import datetime, timedelta, timezone
+
+from alembic import op, context
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a91b4e7c2f58'
+down_revision = '7d2e9c4a5b31'
+branch_labels = None
+depends_on = None
+
+PARTITIONED_TABLES = ['latency', 'traffic', 'errors', 'saturation']
+
+# The messages columns referencing the metrics tables.
+MESSAGE_METRIC_KEYS = [
+    (f'{prefix}_{table}_id', table)
+    for prefix in ['intent', 'sentiment', 'ner', 'seq', 'bl']
+    for table in PARTITIONED_TABLES
+]
+
+
+def migration_option(name, default):
+    '''
+        This function returns an option of the migration, given by `flask db upgrade -x name=value`.
+    '''
+    return context.get_x_argument(as_dictionary=True).get(name, default)
+
+
+def period_start(moment, interval):
+    '''
+        This function returns the start of the day or the week containing the moment, in UTC.
+    '''
+    moment = moment.astimezone(timezone.utc)
+    start = datetime(moment.year, moment.month, moment.day, tzinfo=timezone.utc)
+    if interval == 'week':
+        start -= timedelta(days=start.weekday())
+    return start
+
+
+def create_partitions(start, end, interval):
+    '''
+        This function creates the partitions of the metrics tables covering the time range.
+    '''
+    length = timedelta(days=7 if interval == 'week' else 1)
+    start = period_start(start, interval)
+    while start < end:
+        for table in PARTITIONED_TABLES:
+            op.execute(
+                f"CREATE TABLE IF NOT EXISTS {table}_p{start:%Y%m%d} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{(start + length).isoformat()}')"
+            )
+        start += length
+
+
+def is_partitioned(table):
+    '''
+        This function checks if the table is partitioned in the database.
+    '''
+    return op.get_bind().execute(sa.text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table JOIN pg_class ON partrelid = pg_class.oid "
+        "WHERE relname = :table)"
+    ), {'table' : table}).scalar()
+
+
+def create_indexes(table):
+    '''
+        This function creates the service and the (service, time) indexes of a metrics table.
+    '''
+    op.execute(f'CREATE INDEX IF NOT EXISTS ix_{table}_service_name ON {table} (service_name)')
+    op.execute(f'CREATE INDEX IF NOT EXISTS ix_{table}_service_name_ingested_at ON {table} (service_name, ingested_at)')
+
+
+def copy_table(table, partitioned):
+    '''
+        This function moves the rows of a metrics table into a new partitioned or plain table of the same name.
+    '''
+    op.execute(f'ALTER TABLE {table} RENAME TO {table}_old')
+    op.execute(f'ALTER TABLE {table}_old RENAME CONSTRAINT {table}_pkey TO {table}_old_pkey')
+    op.execute(f'ALTER INDEX IF EXISTS ix_{table}_service_name RENAME TO ix_{table}_old_service_name')
+    op.execute(f'ALTER INDEX IF EXISTS ix_{table}_service_name_ingested_at RENAME TO ix_{table}_old_service_name_ingested_at')
+    if partitioned:
+        op.execute(f'CREATE TABLE {table} (LIKE {table}_old INCLUDING DEFAULTS) PARTITION BY RANGE (ingested_at)')
+        op.execute(f'ALTER TABLE {table} ADD PRIMARY KEY (id, ingested_at)')
+    else:
+        op.execute(f'CREATE TABLE {table} (LIKE {table}_old INCLUDING DEFAULTS)')
+        op.execute(f'ALTER TABLE {table} ADD PRIMARY KEY (id)')
+    create_indexes(table)
+
+
+def drop_metric_foreign_keys():
+    '''
+        This function drops the foreign keys of the messages table pointing to the metrics tables.
+    '''
+    for foreign_key in sa.inspect(op.get_bind()).get_foreign_keys('messages'):
+        if foreign_key['referred_table'] in PARTITIONED_TABLES:
+            op.drop_constraint(foreign_key['name'], 'messages', type_='foreignkey')
+
+
+def upgrade():
+    # The rows ingested before this migration get the time of the migration.
+    for table in PARTITIONED_TABLES:
+        op.execute(f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS ingested_at timestamptz NOT NULL DEFAULT now()')
+        create_indexes(table)
+
+    # The tables are partitioned only when asked with -x partitioned=1.
+    if migration_option('partitioned', '0') != '1' or is_partitioned(PARTITIONED_TABLES[0]):
+        return
+    interval = migration_option('partition_interval', 'day')
+    premake = int(migration_option('partition_premake', '7'))
+    if interval not in ('day', 'week'):
+        raise ValueError(f'Unknown partitioning interval: {interval}')
+
+    # A partitioned table can't be referenced by its id alone.
+    drop_metric_foreign_keys()
+    for table in PARTITIONED_TABLES:
+        copy_table(table, partitioned=True)
+
+    # Creating the partitions covering the existing rows and the future ones.
+    bind = op.get_bind()
+    oldest = min(
+        bind.execute(sa.text(f'SELECT coalesce(min(ingested_at), now()) FROM {table}_old')).scalar()
+        for table in PARTITIONED_TABLES
+    )
+    newest = bind.execute(sa.text('SELECT now()')).scalar()
+    create_partitions(
+        oldest, period_start(newest, interval) + timedelta(days=7 if interval == 'week' else 1) * (premake + 1), interval
+    )
+
+    for table in PARTITIONED_TABLES:
+        op.execute(f'INSERT INTO {table} SELECT * FROM {table}_old')
+        op.execute(f'DROP TABLE {table}_old')
+
+
+def downgrade():
+    if is_partitioned(PARTITIONED_TABLES[0]):
+        for table in PARTITIONED_TABLES:
+            copy_table(table, partitioned=False)
+            op.execute(f'INSERT INTO {table} SELECT * FROM {table}_old')
+            op.execute(f'DROP TABLE {table}_old CASCADE')
+        for column, table in MESSAGE_METRIC_KEYS:
+            op.create_foreign_key(f'messages_{column}_fkey', 'messages', table, [column], ['id'])
+
+    for table in PARTITIONED_TABLES:
+        op.execute(f'DROP INDEX IF EXISTS ix_{table}_service_name_ingested_at')
+        op.execute(f'ALTER TABLE {table} DROP COLUMN ingested_at')
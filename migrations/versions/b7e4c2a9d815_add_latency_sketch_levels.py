@@ -0,0 +1,38 @@
+"""Add the hour and day levels of the latency sketches
+
+Revision ID: b7e4c2a9d815
+Revises: d3b9e5a71c04
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e4c2a9d815'
+down_revision = 'd3b9e5a71c04'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The table may have the levels already, when it was created by db.create_all().
+    inspector = sa.inspect(op.get_bind())
+    if 'level' not in {column['name'] for column in inspector.get_columns('latency_sketches')}:
+        op.add_column('latency_sketches', sa.Column('level', sa.String(8), server_default='minute', nullable=False))
+    if 'level' not in inspector.get_pk_constraint('latency_sketches')['constrained_columns']:
+        op.drop_constraint('latency_sketches_pkey', 'latency_sketches', type_='primary')
+        op.create_primary_key(
+            'latency_sketches_pkey', 'latency_sketches', ['level', 'service_name', 'field', 'bucket_start', 'worker_id']
+        )
+    # The folds read the sketches changed since their last run.
+    op.execute('CREATE INDEX IF NOT EXISTS ix_latency_sketches_level_updated_at ON latency_sketches (level, updated_at)')
+
+
+def downgrade():
+    op.drop_index('ix_latency_sketches_level_updated_at', table_name='latency_sketches')
+    op.execute("DELETE FROM latency_sketches WHERE level <> 'minute'")
+    op.drop_constraint('latency_sketches_pkey', 'latency_sketches', type_='primary')
+    op.create_primary_key('latency_sketches_pkey', 'latency_sketches', ['service_name', 'field', 'bucket_start', 'worker_id'])
+    op.drop_column('latency_sketches', 'level')
@@ -0,0 +1,78 @@
+"""Add the per-service rollup tables of the metrics
+
+Revision ID: c5d83f1e6a27
+Revises: a91b4e7c2f58
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5d83f1e6a27'
+down_revision = 'a91b4e7c2f58'
+branch_labels = None
+depends_on = None
+
+
+def rollup_keys():
+    '''
+        This function returns the key columns shared by the rollup tables.
+    '''
+    return [
+        sa.Column('level', sa.String(8), primary_key=True),
+        sa.Column('bucket_start', sa.DateTime(timezone=True), primary_key=True),
+        sa.Column('service_name', sa.String(64), primary_key=True)
+    ]
+
+
+# The rollup tables and their columns besides the shared keys.
+ROLLUP_TABLES = {
+    'latency_rollup' : lambda: [
+        sa.Column('field', sa.String(32), primary_key=True),
+        sa.Column('count', sa.BigInteger(), nullable=False),
+        sa.Column('sum', sa.Float(), nullable=False),
+        sa.Column('min', sa.Float(), nullable=False),
+        sa.Column('max', sa.Float(), nullable=False)
+    ],
+    'latency_histogram_rollup' : lambda: [
+        sa.Column('field', sa.String(32), primary_key=True),
+        sa.Column('histogram_bucket', sa.Integer(), primary_key=True),
+        sa.Column('count', sa.BigInteger(), nullable=False)
+    ],
+    'traffic_rollup' : lambda: [
+        sa.Column('count', sa.BigInteger(), nullable=False),
+        sa.Column('write_query_total', sa.BigInteger(), nullable=False),
+        sa.Column('read_query_total', sa.BigInteger(), nullable=False)
+    ],
+    'errors_rollup' : lambda: [
+        sa.Column('status_code', sa.Integer(), primary_key=True),
+        sa.Column('count', sa.BigInteger(), nullable=False)
+    ],
+    'saturation_rollup' : lambda: [
+        sa.Column('count', sa.BigInteger(), nullable=False),
+        sa.Column('cpu_utilization_sum', sa.Float(), nullable=False),
+        sa.Column('ram_utilization_sum', sa.Float(), nullable=False)
+    ]
+}
+
+
+def upgrade():
+    # The tables may have been created by db.create_all() already.
+    inspector = sa.inspect(op.get_bind())
+    for table, columns in ROLLUP_TABLES.items():
+        if not inspector.has_table(table):
+            op.create_table(table, *rollup_keys(), *columns())
+    if not inspector.has_table('rollup_state'):
+        op.create_table(
+            'rollup_state',
+            sa.Column('name', sa.String(32), primary_key=True),
+            sa.Column('high_water_mark', sa.DateTime(timezone=True), nullable=False)
+        )
+
+
+def downgrade():
+    op.drop_table('rollup_state')
+    for table in reversed(list(ROLLUP_TABLES)):
+        op.drop_table(table)
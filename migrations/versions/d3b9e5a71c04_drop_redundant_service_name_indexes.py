@@ -0,0 +1,28 @@
+"""Drop the service indexes of the metrics tables covered by the (service, time) indexes
+
+Revision ID: d3b9e5a71c04
+Revises: 8c2d6f4a1e39
+Create Date: 2026-10-18 21:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3b9e5a71c04'
+down_revision = '8c2d6f4a1e39'
+branch_labels = None
+depends_on = None
+
+METRIC_TABLES = ['latency', 'traffic', 'errors', 'saturation']
+
+
+def upgrade():
+    # The lookups by service are served by the leading column of ix_<table>_service_name_ingested_at.
+    for table in METRIC_TABLES:
+        op.execute(f'DROP INDEX IF EXISTS ix_{table}_service_name')
+
+
+def downgrade():
+    for table in METRIC_TABLES:
+        op.execute(f'CREATE INDEX IF NOT EXISTS ix_{table}_service_name ON {table} (service_name)')
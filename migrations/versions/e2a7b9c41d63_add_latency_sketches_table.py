@@ -0,0 +1,35 @@
+"""Add the checkpoints table of the latency sketches
+
+Revision ID: e2a7b9c41d63
+Revises: c5d83f1e6a27
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2a7b9c41d63'
+down_revision = 'c5d83f1e6a27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The table may have been created by db.create_all() already.
+    if sa.inspect(op.get_bind()).has_table('latency_sketches'):
+        return
+    op.create_table(
+        'latency_sketches',
+        sa.Column('service_name', sa.String(64), primary_key=True),
+        sa.Column('field', sa.String(32), primary_key=True),
+        sa.Column('bucket_start', sa.DateTime(timezone=True), primary_key=True),
+        sa.Column('worker_id', sa.String(128), primary_key=True),
+        sa.Column('payload', sa.JSON(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False)
+    )
+
+
+def downgrade():
+    op.drop_table('latency_sketches')
@@ -0,0 +1,60 @@
+"""Add the keys table skipping the retried metrics reports of the partitioned tables
+
+Revision ID: e9a3f1c7b240
+Revises: b7e4c2a9d815
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e9a3f1c7b240'
+down_revision = 'b7e4c2a9d815'
+branch_labels = None
+depends_on = None
+
+METRIC_TABLES = ['latency', 'traffic', 'errors', 'saturation']
+
+
+def column_type(table, column):
+    '''
+        This function returns the current type of the column in the database.
+    '''
+    for column_info in sa.inspect(op.get_bind()).get_columns(table):
+        if column_info['name'] == column:
+            return column_info['type']
+
+
+def is_partitioned(table):
+    '''
+        This function checks if the table is partitioned in the database.
+    '''
+    return op.get_bind().execute(sa.text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table JOIN pg_class ON partrelid = pg_class.oid "
+        "WHERE relname = :table)"
+    ), {'table' : table}).scalar()
+
+
+def upgrade():
+    # The table may have been created by db.create_all() already.
+    if not sa.inspect(op.get_bind()).has_table('metric_report_keys'):
+        op.create_table(
+            'metric_report_keys',
+            sa.Column('id', column_type('latency', 'id'), primary_key=True),
+            sa.Column('ingested_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False)
+        )
+        op.create_index('ix_metric_report_keys_ingested_at', 'metric_report_keys', ['ingested_at'])
+
+    # The keys of the records already saved in the partitioned tables, so their retries are skipped too.
+    for table in METRIC_TABLES:
+        if is_partitioned(table):
+            op.execute(
+                f'INSERT INTO metric_report_keys (id, ingested_at) SELECT id, max(ingested_at) FROM {table} '
+                f'GROUP BY id ON CONFLICT (id) DO NOTHING'
+            )
+
+
+def downgrade():
+    op.drop_table('metric_report_keys')
@@ -0,0 +1,34 @@
+"""Add the staging table of the message events
+
+Revision ID: f4c8d2e61a95
+Revises: e2a7b9c41d63
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4c8d2e61a95'
+down_revision = 'e2a7b9c41d63'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The table may have been created by db.create_all() already.
+    if sa.inspect(op.get_bind()).has_table('staged_events'):
+        return
+    op.create_table(
+        'staged_events',
+        sa.Column('id', sa.BigInteger(), primary_key=True, autoincrement=True),
+        sa.Column('kind', sa.String(16), nullable=False),
+        sa.Column('correlation_id', sa.String(64), nullable=False),
+        sa.Column('payload', sa.JSON(), nullable=False),
+        sa.Column('staged_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False)
+    )
+
+
+def downgrade():
+    op.drop_table('staged_events')
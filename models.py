@@ -1,14 +1,57 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects.postgresql import UUID
+
+from config import ConfigManager
 
 db = SQLAlchemy()
 
+config = ConfigManager("config.ini")
+
+# Setting up the key types of the metrics and date tables.
+# In the compact mode the metrics keys are native UUIDs and the date keys are the BIGINT time buckets.
+COMPACT_KEYS = bool(config.database.compact_keys)
+MetricKey = UUID(as_uuid=False) if COMPACT_KEYS else db.String(64)
+DateKey = db.BigInteger if COMPACT_KEYS else db.String(64)
+
+# In the partitioned mode the metrics tables are range partitioned by the ingest time.
+PARTITIONED_METRICS = bool(config.partitioning.enabled)
+
+# In the long mode the links of the messages to the metrics records are rows of the Message Service Metrics table.
+LONG_METRIC_LINKS = config.database.metric_links == "long"
+
+
+def metric_table_args(table_name : str) -> tuple:
+    '''
+        This function returns the table arguments of a metrics table.
+            :param table_name: str
+                The name of the metrics table.
+            :return: tuple
+                The (service, time) index and the partitioning options.
+    '''
+    table_args = (db.Index(f"ix_{table_name}_service_name_ingested_at", "service_name", "ingested_at"),)
+    if PARTITIONED_METRICS:
+        table_args += ({"postgresql_partition_by" : "RANGE (ingested_at)"},)
+    return table_args
+
+
+def metric_foreign_key(table_name : str) -> tuple:
+    '''
+        This function returns the foreign key to a metrics table.
+        A partitioned table can't be referenced by its id alone, so there is none in the partitioned mode.
+            :param table_name: str
+                The name of the metrics table.
+    '''
+    if PARTITIONED_METRICS:
+        return ()
+    return (db.ForeignKey(f"{table_name}.id"),)
+
 # Defining the date table.
 class DateModel(db.Model):
     # Setting up the table name.
     __tablename__ = "date"
 
     # Setting up the column names and data types.
-    id = db.Column(db.String(64), primary_key=True)
+    id = db.Column(DateKey, primary_key=True, autoincrement=False)
     date = db.Column(db.Date, unique=False)
     month = db.Column(db.Integer, unique=False)
     month_str = db.Column(db.String(16), unique=False)
@@ -43,13 +86,16 @@ class LatencyModel(db.Model):
     __tablename__ = "latency"
 
     # Setting up the column names and data types.
-    id = db.Column(db.String(64), primary_key=True)
+    id = db.Column(MetricKey, primary_key=True)
     lock_time_per_process = db.Column(db.Float, unique=False)
     queue_waiting_time = db.Column(db.Float, unique=False)
     actual_processing_time = db.Column(db.Float, unique=False)
     task_service_time = db.Column(db.Float, unique=False)
     database_response_time = db.Column(db.Float, unique=False)
     service_name = db.Column(db.String(64), unique=False)
+    ingested_at = db.Column(db.DateTime(timezone=True), primary_key=PARTITIONED_METRICS,
+                            server_default=db.func.now(), nullable=False)
+    __table_args__ = metric_table_args("latency")
 
     def __init__(self,
                  index,
@@ -78,10 +124,13 @@ class TrafficModel(db.Model):
     __tablename__ = "traffic"
 
     # Setting up the column names and data types.
-    id = db.Column(db.String(64), primary_key=True)
+    id = db.Column(MetricKey, primary_key=True)
     write_query = db.Column(db.Integer, unique=False)
     read_query = db.Column(db.Integer, unique=False)
     service_name = db.Column(db.String(64), unique=False)
+    ingested_at = db.Column(db.DateTime(timezone=True), primary_key=PARTITIONED_METRICS,
+                            server_default=db.func.now(), nullable=False)
+    __table_args__ = metric_table_args("traffic")
 
     def __init__(self, index, write_query, read_query, service_name):
         self.id = index
@@ -99,11 +148,14 @@ class ErrorsModel(db.Model):
     __tablename__ = "errors"
 
     # Setting up the column names and data types.
-    id = db.Column(db.String(64), primary_key=True)
+    id = db.Column(MetricKey, primary_key=True)
     status_code = db.Column(db.Integer, unique=False)
     db_error = db.Column(db.Text, unique=False, nullable=True)
     reason = db.Column(db.Text, unique=False, nullable=True)
     service_name = db.Column(db.String(64), unique=False)
+    ingested_at = db.Column(db.DateTime(timezone=True), primary_key=PARTITIONED_METRICS,
+                            server_default=db.func.now(), nullable=False)
+    __table_args__ = metric_table_args("errors")
 
     def __init__(self, index, status_code, db_error, reason, service_name):
         self.id = index
@@ -122,12 +174,15 @@ class SaturationModel(db.Model):
     __tablename__ = "saturation"
 
     # Setting up the column names and data types.
-    id = db.Column(db.String(64), primary_key=True)
+    id = db.Column(MetricKey, primary_key=True)
     cpu_utilization = db.Column(db.Float, unique=False)
     ram_utilization = db.Column(db.Float, unique=False)
     waiting_queue_length = db.Column(db.Integer, unique=False)
     thread_capacity = db.Column(db.Float, unique=False)
     service_name = db.Column(db.String(64), unique=False)
+    ingested_at = db.Column(db.DateTime(timezone=True), primary_key=PARTITIONED_METRICS,
+                            server_default=db.func.now(), nullable=False)
+    __table_args__ = metric_table_args("saturation")
 
     def __init__(self, index, cpu_utilization, ram_utilization, waiting_queue_length, thread_capacity, service_name):
         self.id = index
@@ -192,34 +247,38 @@ class MessagesModel(db.Model):
     is_sequence_cached = db.Column(db.Boolean, unique=False, nullable=True)
 
     # Ids.
-    date_id = db.Column(db.String(64), db.ForeignKey("date.id"), nullable=True)
-    user_id = db.Column(db.String(64), db.ForeignKey("user.id"), nullable=True)
+    date_id = db.Column(DateKey, db.ForeignKey("date.id"), nullable=True, index=True)
+    user_id = db.Column(db.String(64), db.ForeignKey("user.id"), nullable=True, index=True)
 
     # Metrics ids.
-    intent_latency_id = db.Column(db.String(64), db.ForeignKey("latency.id"), nullable=True)
-    intent_traffic_id = db.Column(db.String(64), db.ForeignKey("traffic.id"), nullable=True)
-    intent_errors_id = db.Column(db.String(64), db.ForeignKey("errors.id"), nullable=True)
-    intent_saturation_id = db.Column(db.String(64), db.ForeignKey("saturation.id"), nullable=True)
-
-    sentiment_latency_id = db.Column(db.String(64), db.ForeignKey("latency.id"), nullable=True)
-    sentiment_traffic_id = db.Column(db.String(64), db.ForeignKey("traffic.id"), nullable=True)
-    sentiment_errors_id = db.Column(db.String(64), db.ForeignKey("errors.id"), nullable=True)
-    sentiment_saturation_id = db.Column(db.String(64), db.ForeignKey("saturation.id"), nullable=True)
-
-    ner_latency_id = db.Column(db.String(64), db.ForeignKey("latency.id"), nullable=True)
-    ner_traffic_id = db.Column(db.String(64), db.ForeignKey("traffic.id"), nullable=True)
-    ner_errors_id = db.Column(db.String(64), db.ForeignKey("errors.id"), nullable=True)
-    ner_saturation_id = db.Column(db.String(64), db.ForeignKey("saturation.id"), nullable=True)
-
-    seq_latency_id = db.Column(db.String(64), db.ForeignKey("latency.id"), nullable=True)
-    seq_traffic_id = db.Column(db.String(64), db.ForeignKey("traffic.id"), nullable=True)
-    seq_errors_id = db.Column(db.String(64), db.ForeignKey("errors.id"), nullable=True)
-    seq_saturation_id = db.Column(db.String(64), db.ForeignKey("saturation.id"), nullable=True)
-
-    bl_latency_id = db.Column(db.String(64), db.ForeignKey("latency.id"), nullable=True)
-    bl_traffic_id = db.Column(db.String(64), db.ForeignKey("traffic.id"), nullable=True)
-    bl_errors_id = db.Column(db.String(64), db.ForeignKey("errors.id"), nullable=True)
-    bl_saturation_id = db.Column(db.String(64), db.ForeignKey("saturation.id"), nullable=True)
+    intent_latency_id = db.Column(MetricKey, *metric_foreign_key("latency"), nullable=True, index=True)
+    intent_traffic_id = db.Column(MetricKey, *metric_foreign_key("traffic"), nullable=True, index=True)
+    intent_errors_id = db.Column(MetricKey, *metric_foreign_key("errors"), nullable=True, index=True)
+    intent_saturation_id = db.Column(MetricKey, *metric_foreign_key("saturation"), nullable=True, index=True)
+
+    sentiment_latency_id = db.Column(MetricKey, *metric_foreign_key("latency"), nullable=True, index=True)
+    sentiment_traffic_id = db.Column(MetricKey, *metric_foreign_key("traffic"), nullable=True, index=True)
+    sentiment_errors_id = db.Column(MetricKey, *metric_foreign_key("errors"), nullable=True, index=True)
+    sentiment_saturation_id = db.Column(MetricKey, *metric_foreign_key("saturation"), nullable=True, index=True)
+
+    ner_latency_id = db.Column(MetricKey, *metric_foreign_key("latency"), nullable=True, index=True)
+    ner_traffic_id = db.Column(MetricKey, *metric_foreign_key("traffic"), nullable=True, index=True)
+    ner_errors_id = db.Column(MetricKey, *metric_foreign_key("errors"), nullable=True, index=True)
+    ner_saturation_id = db.Column(MetricKey, *metric_foreign_key("saturation"), nullable=True, index=True)
+
+    seq_latency_id = db.Column(MetricKey, *metric_foreign_key("latency"), nullable=True, index=True)
+    seq_traffic_id = db.Column(MetricKey, *metric_foreign_key("traffic"), nullable=True, index=True)
+    seq_errors_id = db.Column(MetricKey, *metric_foreign_key("errors"), nullable=True, index=True)
+    seq_saturation_id = db.Column(MetricKey, *metric_foreign_key("saturation"), nullable=True, index=True)
+
+    bl_latency_id = db.Column(MetricKey, *metric_foreign_key("latency"), nullable=True, index=True)
+    bl_traffic_id = db.Column(MetricKey, *metric_foreign_key("traffic"), nullable=True, index=True)
+    bl_errors_id = db.Column(MetricKey, *metric_foreign_key("errors"), nullable=True, index=True)
+    bl_saturation_id = db.Column(MetricKey, *metric_foreign_key("saturation"), nullable=True, index=True)
+
+    # The moment of the last change, read by the refresh of the Message Metrics Flat table.
+    updated_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now(), onupdate=db.func.now(),
+                           nullable=False, index=True)
 
     def __init__(self, index):
         self.id = index
@@ -258,4 +317,243 @@ class MessagesModel(db.Model):
         self.seq_saturation_id = None
 
     def __repr__(self):
-        return f"<Message(text = {self.text}, response = {self.response})>"
\ No newline at end of file
+        return f"<Message(text = {self.text}, response = {self.response})>"
+
+# Defining the Latency Rollup Table.
+class LatencyRollupModel(db.Model):
+    # Setting up the table name.
+    __tablename__ = "latency_rollup"
+
+    # Setting up the column names and data types.
+    level = db.Column(db.String(8), primary_key=True)
+    bucket_start = db.Column(db.DateTime(timezone=True), primary_key=True)
+    service_name = db.Column(db.String(64), primary_key=True)
+    field = db.Column(db.String(32), primary_key=True)
+    count = db.Column(db.BigInteger, nullable=False)
+    sum = db.Column(db.Float, nullable=False)
+    min = db.Column(db.Float, nullable=False)
+    max = db.Column(db.Float, nullable=False)
+
+    def __repr__(self):
+        return f"<LatencyRollup(service name = {self.service_name}, field = {self.field})" \
+               f"[{self.level} = {self.bucket_start}, count = {self.count}]>"
+
+# Defining the Latency Histogram Rollup Table.
+class LatencyHistogramRollupModel(db.Model):
+    # Setting up the table name.
+    __tablename__ = "latency_histogram_rollup"
+
+    # Setting up the column names and data types.
+    level = db.Column(db.String(8), primary_key=True)
+    bucket_start = db.Column(db.DateTime(timezone=True), primary_key=True)
+    service_name = db.Column(db.String(64), primary_key=True)
+    field = db.Column(db.String(32), primary_key=True)
+    histogram_bucket = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.BigInteger, nullable=False)
+
+    def __repr__(self):
+        return f"<LatencyHistogramRollup(service name = {self.service_name}, field = {self.field})" \
+               f"[{self.level} = {self.bucket_start}, bucket = {self.histogram_bucket}, count = {self.count}]>"
+
+# Defining the Traffic Rollup Table.
+class TrafficRollupModel(db.Model):
+    # Setting up the table name.
+    __tablename__ = "traffic_rollup"
+
+    # Setting up the column names and data types.
+    level = db.Column(db.String(8), primary_key=True)
+    bucket_start = db.Column(db.DateTime(timezone=True), primary_key=True)
+    service_name = db.Column(db.String(64), primary_key=True)
+    count = db.Column(db.BigInteger, nullable=False)
+    write_query_total = db.Column(db.BigInteger, nullable=False)
+    read_query_total = db.Column(db.BigInteger, nullable=False)
+
+    def __repr__(self):
+        return f"<TrafficRollup(service name = {self.service_name})[{self.level} = {self.bucket_start}, " \
+               f"write queries = {self.write_query_total}, read queries = {self.read_query_total}]>"
+
+# Defining the Errors Rollup Table.
+class ErrorsRollupModel(db.Model):
+    # Setting up the table name.
+    __tablename__ = "errors_rollup"
+
+    # Setting up the column names and data types.
+    level = db.Column(db.String(8), primary_key=True)
+    bucket_start = db.Column(db.DateTime(timezone=True), primary_key=True)
+    service_name = db.Column(db.String(64), primary_key=True)
+    status_code = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.BigInteger, nullable=False)
+
+    def __repr__(self):
+        return f"<ErrorsRollup(service name = {self.service_name})[{self.level} = {self.bucket_start}, " \
+               f"status code = {self.status_code}, count = {self.count}]>"
+
+# Defining the Saturation Rollup Table.
+class SaturationRollupModel(db.Model):
+    # Setting up the table name.
+    __tablename__ = "saturation_rollup"
+
+    # Setting up the column names and data types.
+    # The averages are the sums divided by the count, so the rollups stay mergeable.
+    level = db.Column(db.String(8), primary_key=True)
+    bucket_start = db.Column(db.DateTime(timezone=True), primary_key=True)
+    service_name = db.Column(db.String(64), primary_key=True)
+    count = db.Column(db.BigInteger, nullable=False)
+    cpu_utilization_sum = db.Column(db.Float, nullable=False)
+    ram_utilization_sum = db.Column(db.Float, nullable=False)
+
+    def __repr__(self):
+        return f"<SaturationRollup(service name = {self.service_name})[{self.level} = {self.bucket_start}, " \
+               f"CPU utilization = {self.cpu_utilization_sum / self.count}, " \
+               f"RAM utilization = {self.ram_utilization_sum / self.count}]>"
+
+# Defining the Rollup State Table.
+class RollupStateModel(db.Model):
+    # Setting up the table name.
+    __tablename__ = "rollup_state"
+
+    # Setting up the column names and data types.
+    name = db.Column(db.String(32), primary_key=True)
+    high_water_mark = db.Column(db.DateTime(timezone=True), nullable=False)
+
+    def __repr__(self):
+        return f"<RollupState(name = {self.name})[high water mark = {self.high_water_mark}]>"
+
+# Defining the Export State Table.
+class ExportStateModel(db.Model):
+    # Setting up the table name.
+    __tablename__ = "export_state"
+
+    # Setting up the column names and data types.
+    # The high-water mark is the end of the time range of the last complete incremental export.
+    name = db.Column(db.String(128), primary_key=True)
+    table_name = db.Column(db.String(64), nullable=False)
+    high_water_mark = db.Column(db.DateTime(timezone=True), nullable=False)
+    rows = db.Column(db.BigInteger, nullable=False)
+    exported_at = db.Column(db.DateTime(timezone=True), nullable=False)
+
+    def __repr__(self):
+        return f"<ExportState(name = {self.name}, table = {self.table_name})[high water mark = {self.high_water_mark}]>"
+
+# Defining the Latency Sketch Table.
+class LatencySketchModel(db.Model):
+    # Setting up the table name.
+    __tablename__ = "latency_sketches"
+    # The minute sketches are checkpointed by every worker, the hour and day ones are folded from them with an empty worker.
+    __table_args__ = (
+        db.PrimaryKeyConstraint("level", "service_name", "field", "bucket_start", "worker_id", name="latency_sketches_pkey"),
+        db.Index("ix_latency_sketches_level_updated_at", "level", "updated_at")
+    )
+
+    # Setting up the column names and data types.
+    service_name = db.Column(db.String(64), primary_key=True)
+    field = db.Column(db.String(32), primary_key=True)
+    bucket_start = db.Column(db.DateTime(timezone=True), primary_key=True)
+    worker_id = db.Column(db.String(128), primary_key=True)
+    payload = db.Column(db.JSON, nullable=False)
+    updated_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now(), nullable=False)
+    level = db.Column(db.String(8), primary_key=True, server_default="minute")
+
+    def __repr__(self):
+        return f"<LatencySketch(service name = {self.service_name}, field = {self.field})" \
+               f"[{self.level} = {self.bucket_start}, worker = {self.worker_id}]>"
+
+# Defining the Message Service Metrics Table.
+class MessageServiceMetricsModel(db.Model):
+    # Setting up the table name.
+    __tablename__ = "message_service_metrics"
+
+    # Setting up the column names and data types.
+    # The rows are only inserted, one per message and reporting service, so the Messages rows aren't rewritten.
+    correlation_id = db.Column(db.String(64), primary_key=True)
+    service = db.Column(db.String(64), primary_key=True)
+    latency_id = db.Column(MetricKey, *metric_foreign_key("latency"), nullable=True)
+    traffic_id = db.Column(MetricKey, *metric_foreign_key("traffic"), nullable=True)
+    errors_id = db.Column(MetricKey, *metric_foreign_key("errors"), nullable=True)
+    saturation_id = db.Column(MetricKey, *metric_foreign_key("saturation"), nullable=True)
+    linked_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now(), nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<MessageServiceMetrics(correlation id = {self.correlation_id}, service = {self.service})>"
+
+# Defining the Metric Report Keys Table.
+class MetricReportKeyModel(db.Model):
+    # Setting up the table name.
+    __tablename__ = "metric_report_keys"
+
+    # Setting up the column names and data types.
+    # The primary keys of the partitioned metrics tables include the ingest time, so a retried report isn't a conflict.
+    # The ids of the records are inserted here first, in the same transaction, and only the new ones are saved.
+    id = db.Column(MetricKey, primary_key=True)
+    ingested_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now(), nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<MetricReportKey(id = {self.id})[ingested at = {self.ingested_at}]>"
+
+# Defining the Staged Events Table.
+class StagedEventModel(db.Model):
+    # Setting up the table name.
+    __tablename__ = "staged_events"
+
+    # Setting up the column names and data types.
+    # The events are appended by the ingestion and merged into the Messages table in the order of their ids.
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    kind = db.Column(db.String(16), nullable=False)
+    correlation_id = db.Column(db.String(64), nullable=False)
+    payload = db.Column(db.JSON, nullable=False)
+    staged_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now(), nullable=False)
+
+    def __repr__(self):
+        return f"<StagedEvent(kind = {self.kind}, correlation id = {self.correlation_id})[staged at = {self.staged_at}]>"
+
+# The columns of the Message Metrics Flat table copied from the Messages, Date and User tables.
+FLAT_MESSAGE_COLUMNS = {
+    "messages" : [
+        "text", "intent", "sentiment", "response", "is_seq2seq", "is_intent_cached", "is_sentiment_cached",
+        "is_ner_cached", "is_sequence_cached", "date_id", "user_id"
+    ],
+    "date" : ["date", "year", "month", "day_of_week", "hour", "minute", "is_weekend", "is_holiday"],
+    "user" : ["app_id", "telegram_id"]
+}
+
+# The metrics tables inlined in the Message Metrics Flat table.
+FLAT_METRIC_TABLES = {
+    "latency" : LatencyModel.__table__,
+    "traffic" : TrafficModel.__table__,
+    "errors" : ErrorsModel.__table__,
+    "saturation" : SaturationModel.__table__
+}
+
+# The prefixes of the services with metrics links in the Messages table.
+FLAT_METRIC_PREFIXES = [
+    column.name[:-len("_latency_id")] for column in MessagesModel.__table__.columns
+    if column.name.endswith("_latency_id")
+]
+
+
+def flat_metric_columns(table) -> list:
+    '''
+        This function returns the value columns of a metrics table inlined in the Message Metrics Flat table.
+            :param table: sqlalchemy.Table
+                The metrics table.
+    '''
+    return [column for column in table.columns if column.name not in ("id", "service_name", "ingested_at")]
+
+
+# Defining the Message Metrics Flat Table, one row per message with the metrics of every service inlined.
+# The columns are generated, so a metrics column or a service prefix added to the Messages table shows up here.
+MessageMetricsFlatTable = db.Table(
+    "message_metrics_flat",
+    db.Column("id", db.String(64), primary_key=True),
+    *[
+        db.Column(name, {"messages" : MessagesModel, "date" : DateModel, "user" : UserModel}[source].__table__.c[name].type)
+        for source, names in FLAT_MESSAGE_COLUMNS.items() for name in names
+    ],
+    *[
+        db.Column(f"{prefix}_{column.name}", column.type)
+        for prefix in FLAT_METRIC_PREFIXES
+        for table in FLAT_METRIC_TABLES.values()
+        for column in flat_metric_columns(table)
+    ],
+    db.Column("refreshed_at", db.DateTime(timezone=True), server_default=db.func.now(), nullable=False)
+)
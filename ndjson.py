@@ -0,0 +1,92 @@
+# Importing all needed libraries.
+import tempfile
+
+
+def spool_body(stream, digest, max_body_bytes : int, max_memory_bytes : int = 16777216, block_size : int = 65536):
+    '''
+        This function copies a request body block by block into a spooled file, kept in memory while it's small
+        and moved to a temporary file on the disk beyond that. Every block read is added to the running HMAC of the body,
+        so the body is authenticated before any of it is used.
+            :param stream: file-like object
+                The body of the request.
+            :param digest: hmac.HMAC
+                The running HMAC of the body.
+            :param max_body_bytes: int
+                The maximal size of the body.
+            :param max_memory_bytes: int, default = 16777216
+                The size above which the body is written to the disk.
+            :param block_size: int, default = 65536
+                The number of bytes read at once.
+            :return: tempfile.SpooledTemporaryFile
+                The body, read from its start.
+            :raises ValueError:
+                If the body is longer than max_body_bytes.
+    '''
+    spool = tempfile.SpooledTemporaryFile(max_size=max_memory_bytes)
+    size = 0
+    try:
+        while True:
+            block = stream.read(block_size)
+            if not block:
+                break
+            size += len(block)
+            if size > max_body_bytes:
+                raise ValueError(f"The body is longer than {max_body_bytes} bytes!")
+            digest.update(block)
+            spool.write(block)
+    except Exception:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+
+def ndjson_lines(stream, max_line_bytes : int = 1048576, block_size : int = 65536):
+    '''
+        This function reads a newline-delimited stream block by block and yields its lines,
+        so only one block and the current line are in memory whatever the size of the body.
+            :param stream: file-like object
+                The body of the request.
+            :param max_line_bytes: int, default = 1048576
+                The maximal length of a line, the longer ones are skipped.
+            :param block_size: int, default = 65536
+                The number of bytes read at once.
+            :return: generator
+                The tuples of the line number, the byte offset of the line in the body and the line,
+                None for a line longer than max_line_bytes.
+    '''
+    buffer = bytearray()
+    line_number = 0
+    line_offset = 0
+    buffer_offset = 0
+    oversized = False
+    while True:
+        block = stream.read(block_size)
+        if not block:
+            break
+        buffer += block
+
+        # Yielding the complete lines of the buffer.
+        start = 0
+        end = buffer.find(b"\n", start)
+        while end >= 0:
+            line_number += 1
+            oversized = oversized or end - start > max_line_bytes
+            yield line_number, line_offset, None if oversized else bytes(buffer[start:end])
+            start = end + 1
+            line_offset = buffer_offset + start
+            oversized = False
+            end = buffer.find(b"\n", start)
+        del buffer[:start]
+        buffer_offset += start
+
+        # Dropping the start of a line too long to be kept.
+        if len(buffer) > max_line_bytes:
+            buffer_offset += len(buffer)
+            buffer.clear()
+            oversized = True
+
+    # The last line may have no newline.
+    if buffer or oversized:
+        oversized = oversized or len(buffer) > max_line_bytes
+        yield line_number + 1, line_offset, None if oversized else bytes(buffer)
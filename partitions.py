@@ -0,0 +1,169 @@
+# Importing all needed libraries.
+from datetime import datetime, timedelta, timezone
+import threading
+import logging
+
+from sqlalchemy import text
+
+from models import db
+
+# The logger of the module.
+logger = logging.getLogger(__name__)
+
+
+# The metrics tables partitioned by the ingest time.
+PARTITIONED_TABLES = ["latency", "traffic", "errors", "saturation"]
+
+
+class PartitionManager:
+    def __init__(self, tables : list = PARTITIONED_TABLES, interval : str = "day",
+                 premake : int = 7, retention_days : int = 90) -> None:
+        '''
+            The constructor of the Partition Manager.
+                :param tables: list
+                    The names of the tables range partitioned by ingested_at.
+                :param interval: str, default = 'day'
+                    The time range of a partition, 'day' or 'week'.
+                :param premake: int, default = 7
+                    The number of future partitions created ahead of time.
+                :param retention_days: int, default = 90
+                    The number of days after which a partition is detached and dropped.
+        '''
+        if interval not in ("day", "week"):
+            raise ValueError(f"Unknown partitioning interval: {interval}")
+        self.tables = tables
+        self.interval = interval
+        self.premake = premake
+        self.retention = timedelta(days=retention_days)
+        self.stop_event = threading.Event()
+
+    def period_start(self, moment : datetime) -> datetime:
+        '''
+            This function returns the start of the partition containing the moment.
+                :param moment: datetime
+                    The moment.
+        '''
+        moment = moment.astimezone(timezone.utc)
+        start = datetime(moment.year, moment.month, moment.day, tzinfo=timezone.utc)
+        if self.interval == "week":
+            start -= timedelta(days=start.weekday())
+        return start
+
+    def period_length(self) -> timedelta:
+        '''
+            This function returns the time range of a partition.
+        '''
+        return timedelta(days=7) if self.interval == "week" else timedelta(days=1)
+
+    def partition_name(self, table : str, start : datetime) -> str:
+        '''
+            This function returns the name of the partition of the table starting at the moment.
+                :param table: str
+                    The name of the partitioned table.
+                :param start: datetime
+                    The start of the partition.
+        '''
+        return f"{table}_p{start:%Y%m%d}"
+
+    def create_partitions(self, connection, start : datetime, end : datetime) -> None:
+        '''
+            This function creates the missing partitions covering the time range.
+                :param connection: sqlalchemy.engine.Connection
+                    The connection to the database.
+                :param start: datetime
+                    The start of the time range.
+                :param end: datetime
+                    The end of the time range.
+        '''
+        period_start = self.period_start(start)
+        while period_start < end:
+            period_end = period_start + self.period_length()
+            for table in self.tables:
+                connection.execute(text(
+                    f"CREATE TABLE IF NOT EXISTS {self.partition_name(table, period_start)} "
+                    f"PARTITION OF {table} FOR VALUES FROM ('{period_start.isoformat()}') TO ('{period_end.isoformat()}')"
+                ))
+            period_start = period_end
+
+    def create_future_partitions(self, now : datetime = None) -> None:
+        '''
+            This function creates the partitions of the current and the next premake periods.
+                :param now: datetime, default = None
+                    The current moment, the current UTC time if None.
+        '''
+        now = now or datetime.now(timezone.utc)
+        with db.engine.begin() as connection:
+            self.create_partitions(connection, now, self.period_start(now) + self.period_length() * (self.premake + 1))
+
+    def drop_expired_partitions(self, now : datetime = None) -> list:
+        '''
+            This function detaches and drops the partitions older than the retention and deletes the keys of their records.
+                :param now: datetime, default = None
+                    The current moment, the current UTC time if None.
+                :return: list
+                    The names of the dropped partitions.
+        '''
+        now = now or datetime.now(timezone.utc)
+        dropped = []
+        with db.engine.begin() as connection:
+            for table in self.tables:
+                partitions = connection.execute(text(
+                    "SELECT child.relname FROM pg_inherits "
+                    "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+                    "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+                    "WHERE parent.relname = :table"
+                ), {"table" : table}).scalars().all()
+                for partition in partitions:
+                    # The partitions not created by the manager are left untouched.
+                    try:
+                        start = datetime.strptime(partition[len(table) + 2:], "%Y%m%d").replace(tzinfo=timezone.utc)
+                    except ValueError:
+                        continue
+                    if start + self.period_length() <= now - self.retention:
+                        connection.execute(text(f"ALTER TABLE {table} DETACH PARTITION {partition}"))
+                        connection.execute(text(f"DROP TABLE {partition}"))
+                        dropped.append(partition)
+
+            # Deleting the keys of the dropped records, they have the ingest time of their records.
+            connection.execute(text(
+                "DELETE FROM metric_report_keys WHERE ingested_at < :oldest"
+            ), {"oldest" : self.period_start(now - self.retention)})
+        return dropped
+
+    def maintain(self) -> None:
+        '''
+            This function creates the future partitions and drops the expired ones.
+        '''
+        self.create_future_partitions()
+        self.drop_expired_partitions()
+
+    def run(self, app, check_interval : float) -> None:
+        '''
+            This function is the loop of the maintenance thread.
+                :param app: Flask
+                    The flask application, used for the database connection.
+                :param check_interval: float
+                    The number of seconds between two maintenances.
+        '''
+        while not self.stop_event.wait(check_interval):
+            with app.app_context():
+                try:
+                    self.maintain()
+                except Exception:
+                    logger.exception("Partition maintenance failed")
+
+    def start(self, app, check_interval : float = 3600) -> None:
+        '''
+            This function starts the maintenance thread.
+                :param app: Flask
+                    The flask application, used for the database connection.
+                :param check_interval: float, default = 3600
+                    The number of seconds between two maintenances.
+        '''
+        threading.Thread(target=self.run, args=(app, check_interval), daemon=True).start()
+
+    def stop(self) -> None:
+        '''
+            This function stops the maintenance thread.
+        '''
+        self.stop_event.set()
@@ -0,0 +1,179 @@
+# Importing all needed libraries.
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+import itertools
+import threading
+import cProfile
+import random
+import heapq
+import time
+import os
+
+# The span returned when the current request isn't sampled.
+NULL_SPAN = nullcontext()
+
+
+class RequestTrace:
+    def __init__(self, endpoint : str) -> None:
+        '''
+            The constructor of the trace of a sampled request.
+                :param endpoint: str
+                    The name of the endpoint handling the request.
+        '''
+        self.endpoint = endpoint
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration = 0.0
+        self.spans = dict()
+        self.depth = 0
+        self.profile_path = None
+
+    def to_dict(self) -> dict:
+        '''
+            This function returns the JSON representation of the trace.
+        '''
+        return {
+            "endpoint" : self.endpoint,
+            "started_at" : self.started_at,
+            "duration_ms" : self.duration * 1000,
+            "spans" : [
+                {"name" : name, "depth" : depth, "offset_ms" : offset * 1000, "duration_ms" : duration * 1000,
+                 "count" : count}
+                for (name, depth), (offset, duration, count) in sorted(self.spans.items(), key=lambda span: span[1][0])
+            ],
+            "profile" : self.profile_path
+        }
+
+
+class Profiler:
+    def __init__(self, sample_rate : float = 0.0, slowest : int = 50, profile_dir : str = None) -> None:
+        '''
+            The constructor of the Profiler, timing the named phases of a fraction of the requests.
+                :param sample_rate: float, default = 0.0
+                    The fraction of the requests profiled, 0 disables the profiler.
+                :param slowest: int, default = 50
+                    The number of the slowest request traces kept.
+                :param profile_dir: str, default = None
+                    The directory of the cProfile stats of the sampled requests, no stats are dumped if None.
+        '''
+        self.sample_rate = sample_rate
+        self.slowest_size = slowest
+        self.profile_dir = profile_dir or None
+        if self.profile_dir is not None:
+            os.makedirs(self.profile_dir, exist_ok=True)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.slowest_traces = []
+        self.sequence = itertools.count()
+        self.sampled = 0
+
+    def span(self, name : str):
+        '''
+            This function returns the context manager timing a phase of the current request.
+            Outside of a sampled request the same empty context manager is returned.
+                :param name: str
+                    The name of the phase.
+        '''
+        trace = getattr(self.local, "trace", None)
+        if trace is None:
+            return NULL_SPAN
+        return self.timed_span(trace, name)
+
+    @contextmanager
+    def timed_span(self, trace : RequestTrace, name : str):
+        '''
+            This function times a phase of a sampled request.
+            The repeated phases of the same name and depth are summed into one span, with their count.
+                :param trace: RequestTrace
+                    The trace of the request.
+                :param name: str
+                    The name of the phase.
+        '''
+        start = time.perf_counter()
+        trace.depth += 1
+        try:
+            yield
+        finally:
+            trace.depth -= 1
+            duration = time.perf_counter() - start
+            span = trace.spans.get((name, trace.depth))
+            if span is None:
+                trace.spans[(name, trace.depth)] = [start - trace.start, duration, 1]
+            else:
+                span[1] += duration
+                span[2] += 1
+
+    def profile(self, endpoint : str):
+        '''
+            This function returns the decorator sampling the requests of a flask view.
+                :param endpoint: str
+                    The name of the endpoint in the traces.
+        '''
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+                    return view(*args, **kwargs)
+
+                trace = self.local.trace = RequestTrace(endpoint)
+                profile = cProfile.Profile() if self.profile_dir is not None else None
+                try:
+                    if profile is not None:
+                        profile.enable()
+                    return view(*args, **kwargs)
+                finally:
+                    if profile is not None:
+                        profile.disable()
+                    trace.duration = time.perf_counter() - trace.start
+                    self.local.trace = None
+                    self.record(trace, profile)
+            return wrapper
+        return decorator
+
+    def record(self, trace : RequestTrace, profile : cProfile.Profile = None) -> None:
+        '''
+            This function keeps the trace if it's one of the slowest.
+            Only the kept traces have their cProfile stats dumped, the stats of an evicted trace are deleted.
+                :param trace: RequestTrace
+                    The trace of the finished request.
+                :param profile: cProfile.Profile, default = None
+                    The profile of the request.
+        '''
+        sequence = next(self.sequence)
+
+        # The heap keeps the fastest of the slowest traces on top.
+        with self.lock:
+            self.sampled += 1
+            item = (trace.duration, sequence, trace)
+            evicted = None
+            if len(self.slowest_traces) < self.slowest_size:
+                heapq.heappush(self.slowest_traces, item)
+            elif item > self.slowest_traces[0]:
+                evicted = heapq.heapreplace(self.slowest_traces, item)[2]
+            else:
+                return
+
+            # The files are written under the lock, so an evicted trace never has its stats dumped afterwards.
+            if profile is not None:
+                trace.profile_path = os.path.join(
+                    self.profile_dir, f"{trace.endpoint}-{int(trace.started_at * 1000)}-{sequence}.prof"
+                )
+                profile.dump_stats(trace.profile_path)
+            if evicted is not None and evicted.profile_path is not None:
+                try:
+                    os.remove(evicted.profile_path)
+                except FileNotFoundError:
+                    pass
+
+    def report(self) -> dict:
+        '''
+            This function returns the slowest traces, the slowest first.
+        '''
+        with self.lock:
+            traces = sorted(self.slowest_traces, reverse=True)
+            sampled = self.sampled
+        return {
+            "sample_rate" : self.sample_rate,
+            "sampled" : sampled,
+            "slowest" : [trace.to_dict() for _, _, trace in traces]
+        }
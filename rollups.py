@@ -0,0 +1,233 @@
+# Importing all needed libraries.
+import threading
+import logging
+
+from sqlalchemy import text
+
+from models import db
+from watermarks import committed_until
+
+# The logger of the module.
+logger = logging.getLogger(__name__)
+
+
+# The fields of the Latency table rolled up separately.
+LATENCY_FIELDS = [
+    "lock_time_per_process",
+    "queue_waiting_time",
+    "actual_processing_time",
+    "task_service_time",
+    "database_response_time"
+]
+
+# The levels of the rollups, each one built from the previous one.
+ROLLUP_LEVELS = [("hour", "minute"), ("day", "hour")]
+
+# The key columns and the merge function of every value column of the rollup tables.
+ROLLUP_TABLES = {
+    "latency_rollup" : (
+        ["service_name", "field"],
+        {"count" : "sum", "sum" : "sum", "min" : "min", "max" : "max"}
+    ),
+    "latency_histogram_rollup" : (
+        ["service_name", "field", "histogram_bucket"],
+        {"count" : "sum"}
+    ),
+    "traffic_rollup" : (
+        ["service_name"],
+        {"count" : "sum", "write_query_total" : "sum", "read_query_total" : "sum"}
+    ),
+    "errors_rollup" : (
+        ["service_name", "status_code"],
+        {"count" : "sum"}
+    ),
+    "saturation_rollup" : (
+        ["service_name"],
+        {"count" : "sum", "cpu_utilization_sum" : "sum", "ram_utilization_sum" : "sum"}
+    )
+}
+
+# The unpivoting of the Latency table into (field, value) rows.
+LATENCY_VALUES = "CROSS JOIN LATERAL (VALUES " + ", ".join(
+    f"('{field}', l.{field})" for field in LATENCY_FIELDS
+) + ") AS v(field, value)"
+
+# The queries aggregating the new raw metrics into the minute level,
+# selecting the bucket start, the key columns and the value columns of the rollup table in order.
+MINUTE_QUERIES = {
+    "latency_rollup" : f'''
+        SELECT date_trunc('minute', l.ingested_at), coalesce(l.service_name, ''), v.field,
+               count(*), sum(v.value), min(v.value), max(v.value)
+        FROM latency AS l {LATENCY_VALUES}
+        WHERE l.ingested_at > :lower AND l.ingested_at <= :upper AND v.value IS NOT NULL
+        GROUP BY 1, 2, 3
+    ''',
+    "latency_histogram_rollup" : f'''
+        SELECT date_trunc('minute', l.ingested_at), coalesce(l.service_name, ''), v.field,
+               width_bucket(v.value, CAST(:bounds AS double precision[])), count(*)
+        FROM latency AS l {LATENCY_VALUES}
+        WHERE l.ingested_at > :lower AND l.ingested_at <= :upper AND v.value IS NOT NULL
+        GROUP BY 1, 2, 3, 4
+    ''',
+    "traffic_rollup" : '''
+        SELECT date_trunc('minute', ingested_at), coalesce(service_name, ''),
+               count(*), coalesce(sum(write_query), 0), coalesce(sum(read_query), 0)
+        FROM traffic
+        WHERE ingested_at > :lower AND ingested_at <= :upper
+        GROUP BY 1, 2
+    ''',
+    "errors_rollup" : '''
+        SELECT date_trunc('minute', ingested_at), coalesce(service_name, ''), coalesce(status_code, 0), count(*)
+        FROM errors
+        WHERE ingested_at > :lower AND ingested_at <= :upper
+        GROUP BY 1, 2, 3
+    ''',
+    "saturation_rollup" : '''
+        SELECT date_trunc('minute', ingested_at), coalesce(service_name, ''),
+               count(*), coalesce(sum(cpu_utilization), 0), coalesce(sum(ram_utilization), 0)
+        FROM saturation
+        WHERE ingested_at > :lower AND ingested_at <= :upper
+        GROUP BY 1, 2
+    '''
+}
+
+
+def merge_expression(table : str, column : str, function : str) -> str:
+    '''
+        This function returns the expression merging a rollup value with the one of a new row.
+            :param table: str
+                The name of the rollup table.
+            :param column: str
+                The name of the value column.
+            :param function: str
+                The merge function, 'sum', 'min' or 'max'.
+    '''
+    if function == "min":
+        return f"LEAST({table}.{column}, excluded.{column})"
+    elif function == "max":
+        return f"GREATEST({table}.{column}, excluded.{column})"
+    return f"{table}.{column} + excluded.{column}"
+
+
+class RollupManager:
+    def __init__(self, lag_seconds : float = 30, latency_buckets : list = None) -> None:
+        '''
+            The constructor of the Rollup Manager.
+                :param lag_seconds: float, default = 30
+                    The minimal age of the newest metrics rolled up, they are also older than the start of the open transactions.
+                :param latency_buckets: list, default = None
+                    The upper bounds of the latency histogram buckets, in seconds.
+        '''
+        self.lag_seconds = lag_seconds
+        self.latency_buckets = sorted(latency_buckets or [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10])
+        self.stop_event = threading.Event()
+
+    def roll_up_minutes(self, connection, lower, upper) -> None:
+        '''
+            This function adds the raw metrics ingested in the time range to the minute level.
+                :param connection: sqlalchemy.engine.Connection
+                    The connection to the database.
+                :param lower: datetime
+                    The exclusive start of the time range.
+                :param upper: datetime
+                    The inclusive end of the time range.
+        '''
+        for table, query in MINUTE_QUERIES.items():
+            keys, values = ROLLUP_TABLES[table]
+            conflict_columns = ", ".join(["level", "bucket_start"] + keys)
+            merges = ", ".join(
+                f"{column} = {merge_expression(table, column, function)}" for column, function in values.items()
+            )
+            connection.execute(text(
+                f"INSERT INTO {table} (level, bucket_start, {', '.join(keys + list(values))}) "
+                f"SELECT 'minute', rows.* FROM ({query}) AS rows "
+                f"ON CONFLICT ({conflict_columns}) DO UPDATE SET {merges}"
+            ), {"lower" : lower, "upper" : upper, "bounds" : self.latency_buckets})
+
+    def roll_up_level(self, connection, level : str, source_level : str, lower) -> None:
+        '''
+            This function recomputes the buckets of a level touched since the moment from the lower level.
+                :param connection: sqlalchemy.engine.Connection
+                    The connection to the database.
+                :param level: str
+                    The level recomputed, 'hour' or 'day'.
+                :param source_level: str
+                    The level the buckets are built from.
+                :param lower: datetime
+                    The moment of the oldest change of the lower level.
+        '''
+        for table, (keys, values) in ROLLUP_TABLES.items():
+            columns = ", ".join(keys)
+            aggregates = ", ".join(f"{function}({column})" for column, function in values.items())
+            replaces = ", ".join(f"{column} = excluded.{column}" for column in values)
+            connection.execute(text(
+                f"INSERT INTO {table} (level, bucket_start, {columns}, {', '.join(values)}) "
+                f"SELECT :level, date_trunc(:level, bucket_start), {columns}, {aggregates} FROM {table} "
+                f"WHERE level = :source_level AND bucket_start >= date_trunc(:level, CAST(:lower AS timestamptz)) "
+                f"GROUP BY 2, {columns} "
+                f"ON CONFLICT (level, bucket_start, {columns}) DO UPDATE SET {replaces}"
+            ), {"level" : level, "source_level" : source_level, "lower" : lower})
+
+    def roll_up(self) -> tuple:
+        '''
+            This function rolls up the metrics ingested since the high-water mark.
+                :return: tuple
+                    The previous and the new high-water marks.
+        '''
+        with db.engine.begin() as connection:
+            # Only one process rolls up at a time and the buckets are in UTC.
+            connection.execute(text("SELECT pg_advisory_xact_lock(hashtext('rollups'))"))
+            connection.execute(text("SET LOCAL TIME ZONE 'UTC'"))
+
+            # Getting the range of the metrics not rolled up yet.
+            lower = connection.execute(text(
+                "SELECT high_water_mark FROM rollup_state WHERE name = 'metrics'"
+            )).scalar()
+            if lower is None:
+                lower = connection.execute(text("SELECT CAST('epoch' AS timestamptz)")).scalar()
+            upper = committed_until(connection, self.lag_seconds)
+            if upper <= lower:
+                return lower, lower
+
+            # Adding the new metrics to the minute level and rebuilding the touched hours and days.
+            self.roll_up_minutes(connection, lower, upper)
+            for level, source_level in ROLLUP_LEVELS:
+                self.roll_up_level(connection, level, source_level, lower)
+
+            # Moving the high-water mark in the same transaction as the rollups.
+            connection.execute(text(
+                "INSERT INTO rollup_state (name, high_water_mark) VALUES ('metrics', :upper) "
+                "ON CONFLICT (name) DO UPDATE SET high_water_mark = excluded.high_water_mark"
+            ), {"upper" : upper})
+        return lower, upper
+
+    def run(self, app, check_interval : float) -> None:
+        '''
+            This function is the loop of the rollup thread.
+                :param app: Flask
+                    The flask application, used for the database connection.
+                :param check_interval: float
+                    The number of seconds between two rollups.
+        '''
+        while not self.stop_event.wait(check_interval):
+            with app.app_context():
+                try:
+                    self.roll_up()
+                except Exception:
+                    logger.exception("Metrics rollup failed")
+
+    def start(self, app, check_interval : float = 60) -> None:
+        '''
+            This function starts the rollup thread.
+                :param app: Flask
+                    The flask application, used for the database connection.
+                :param check_interval: float, default = 60
+                    The number of seconds between two rollups.
+        '''
+        threading.Thread(target=self.run, args=(app, check_interval), daemon=True).start()
+
+    def stop(self) -> None:
+        '''
+            This function stops the rollup thread.
+        '''
+        self.stop_event.set()
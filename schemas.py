@@ -1,9 +1,147 @@
 # Importing all needed modules.
-from marshmallow import Schema, fields, ValidationError
+import math
+
+from marshmallow import Schema, fields, ValidationError, RAISE
+
+# The marker returned by the compiled validators when the payload needs the full marshmallow validation.
+FALLBACK = object()
+
+
+def compile_field(field):
+    '''
+        This function compiles a marshmallow field into a function checking the common well-formed values.
+            :param field: marshmallow.fields.Field
+                The field to compile.
+            :return: callable or None
+                The function returning the deserialized value or FALLBACK,
+                None if the field type is not supported.
+    '''
+    if isinstance(field, fields.Nested):
+        if field.many or field.only is not None or field.exclude or field.unknown is not None:
+            return None
+        check_nested = compile_schema(field.nested)
+        if check_nested is None:
+            return None
+        check = check_nested
+    elif isinstance(field, fields.List):
+        check_item = compile_field(field.inner)
+        if check_item is None:
+            return None
+
+        def check(value):
+            if type(value) is not list:
+                return FALLBACK
+            items = []
+            for item in value:
+                item = check_item(item)
+                if item is FALLBACK:
+                    return FALLBACK
+                items.append(item)
+            return items
+    elif isinstance(field, fields.String):
+        def check(value):
+            return value if type(value) is str else FALLBACK
+    elif isinstance(field, fields.Boolean):
+        def check(value):
+            return value if value is True or value is False else FALLBACK
+    elif isinstance(field, fields.Integer):
+        def check(value):
+            return value if type(value) is int else FALLBACK
+    elif isinstance(field, fields.Float):
+        allow_nan = field.allow_nan
+
+        def check(value):
+            if type(value) is float and (allow_nan or math.isfinite(value)):
+                return value
+            elif type(value) is int and -2**53 <= value <= 2**53:
+                return float(value)
+            return FALLBACK
+    elif type(field) is fields.Number:
+        # The plain Number fields keep the infinite and NaN values, as marshmallow does.
+        def check(value):
+            if type(value) is float:
+                return value
+            elif type(value) is int and -2**53 <= value <= 2**53:
+                return float(value)
+            return FALLBACK
+    elif type(field) is fields.Raw:
+        def check(value):
+            return value
+    else:
+        return None
+
+    # Handling the null values as marshmallow does.
+    allow_none = field.allow_none
+
+    def check_value(value):
+        if value is None:
+            return None if allow_none else FALLBACK
+        return check(value)
+    return check_value
+
+
+def compile_schema(schema_class):
+    '''
+        This function compiles a marshmallow schema into a function checking the common well-formed payloads.
+            :param schema_class: type
+                The schema class to compile.
+            :return: callable or None
+                The function returning the deserialized payload or FALLBACK,
+                None if the schema uses features that are not supported.
+    '''
+    if schema_class.opts.unknown != RAISE:
+        return None
+    checks = dict()
+    for name, field in schema_class._declared_fields.items():
+        if field.data_key is not None or field.attribute is not None or field.validators or field.load_only or field.dump_only:
+            return None
+        checks[name] = compile_field(field)
+        if checks[name] is None:
+            return None
+    required = frozenset(name for name, field in schema_class._declared_fields.items() if field.required)
+
+    def fast_load(data):
+        # Unknown and missing fields are left to marshmallow for the error messages.
+        if type(data) is not dict or not required <= data.keys() or not data.keys() <= checks.keys():
+            return FALLBACK
+        result = dict()
+        for name, value in data.items():
+            value = checks[name](value)
+            if value is FALLBACK:
+                return FALLBACK
+            result[name] = value
+        return result
+    return fast_load
+
+
+class ValidatedSchema(Schema):
+    # The compiled validator of the schema, set up at import.
+    fast_load = None
+
+    def validate_json(self, json_data : dict):
+        '''
+            This function validates the requests body.
+            The compiled validator handles the well-formed bodies,
+            marshmallow is used only for the others to produce the same result or error messages.
+                :param json_data: dict
+                    The request body.
+                :returns: dict, int
+                    Returns the validated json or the errors in the json
+                    and the status code.
+        '''
+        if self.fast_load is not None:
+            result = self.fast_load(json_data)
+            if result is not FALLBACK:
+                return result, 200
+        try:
+            result = self.load(json_data)
+        except ValidationError as err:
+            return err.messages, 400
+        return result, 200
 
 
 # Defining the Named-Entities Schema.
-class NamedEntitiesSchema(Schema):
+class NamedEntitiesSchema(ValidatedSchema):
     # Defining the required schema fields.
     PERSON = fields.List(fields.Str(), required=False)
     NORP = fields.List(fields.Str(), required=False)
@@ -24,24 +162,9 @@ class NamedEntitiesSchema(Schema):
     ORDINAL = fields.List(fields.Str(), required=False)
     CARDINAL = fields.List(fields.Str(), required=False)
 
-    def validate_json(self, json_data : dict):
-        '''
-            This function validates the requests body.
-                :param json_data: dict
-                    The request body.
-                :returns: dict, int
-                    Returns the validated json or the errors in the json
-                    and the status code.
-        '''
-        try:
-            result = self.load(json_data)
-        except ValidationError as err:
-            return err.messages, 400
-        return result, 200
-
 
 # Defining the Message Schema.
-class MessageSchema(Schema):
+class MessageSchema(ValidatedSchema):
     # Defining the required schema fields.
     time = fields.Float(required=True)
     correlation_id = fields.Str(required=True)
@@ -58,24 +181,9 @@ class MessageSchema(Schema):
     is_sequence_cached = fields.Bool(required=True)
     telegram_user_id = fields.Integer(required=True)
 
-    def validate_json(self, json_data : dict):
-        '''
-            This function validates the requests body.
-                :param json_data: dict
-                    The request body.
-                :returns: dict, int
-                    Returns the validated json or the errors in the json
-                    and the status code.
-        '''
-        try:
-            result = self.load(json_data)
-        except ValidationError as err:
-            return err.messages, 400
-        return result, 200
-
 
 # Defining the User Schema.
-class UserSchema(Schema):
+class UserSchema(ValidatedSchema):
     # Defining the required schema fields.
     user_id = fields.Str(required=True)
     telegram_user_id = fields.Integer(required=True)
@@ -85,118 +193,43 @@ class UserSchema(Schema):
     telegram_username = fields.Str(required=True)
     app_id = fields.Integer(required=True)
 
-    def validate_json(self, json_data : dict):
-        '''
-            This function validates the requests body.
-                :param json_data: dict
-                    The request body.
-                :returns: dict, int
-                    Returns the validated json or the errors in the json
-                    and the status code.
-        '''
-        try:
-            result = self.load(json_data)
-        except ValidationError as err:
-            return err.messages, 400
-        return result, 200
-
 
 # Defining the Latency Schema.
-class LatencySchema(Schema):
-    # Defining the required schema fields.
-    lock_time = fields.Number(required=True)
-    queue_waiting_time = fields.Number(required=True)
-    actual_processing = fields.Number(required=True)
-    task_service_time = fields.Number(required=True)
-    database_response_time = fields.Number(required=True)
-
-    def validate_json(self, json_data : dict):
-        '''
-            This function validates the requests body.
-                :param json_data: dict
-                    The request body.
-                :returns: dict, int
-                    Returns the validated json or the errors in the json
-                    and the status code.
-        '''
-        try:
-            result = self.load(json_data)
-        except ValidationError as err:
-            return err.messages, 400
-        return result, 200
+class LatencySchema(ValidatedSchema):
+    # Defining the required schema fields, the latencies reject the infinite and NaN values.
+    lock_time = fields.Float(required=True, allow_nan=False)
+    queue_waiting_time = fields.Float(required=True, allow_nan=False)
+    actual_processing = fields.Float(required=True, allow_nan=False)
+    task_service_time = fields.Float(required=True, allow_nan=False)
+    database_response_time = fields.Float(required=True, allow_nan=False)
 
 
 # Defining the Saturation Schema.
-class SaturationSchema(Schema):
+class SaturationSchema(ValidatedSchema):
     # Defining the required schema fields.
     cpu_utilization = fields.Number(required=True)
     ram_utilization = fields.Number(required=True)
     waiting_queue_length = fields.Number(required=True)
     thread_capacity = fields.Number(required=True)
 
-    def validate_json(self, json_data : dict):
-        '''
-            This function validates the requests body.
-                :param json_data: dict
-                    The request body.
-                :returns: dict, int
-                    Returns the validated json or the errors in the json
-                    and the status code.
-        '''
-        try:
-            result = self.load(json_data)
-        except ValidationError as err:
-            return err.messages, 400
-        return result, 200
-
 
 # Defining the Errors Schema.
-class ErrorsSchema(Schema):
+class ErrorsSchema(ValidatedSchema):
     # Defining the required schema fields.
     request_status = fields.Integer(required=True)
     request_reason = fields.Str(required=True)
     db_error = fields.Str(required=True, allow_none=True)
 
-    def validate_json(self, json_data : dict):
-        '''
-            This function validates the requests body.
-                :param json_data: dict
-                    The request body.
-                :returns: dict, int
-                    Returns the validated json or the errors in the json
-                    and the status code.
-        '''
-        try:
-            result = self.load(json_data)
-        except ValidationError as err:
-            return err.messages, 400
-        return result, 200
-
 
 # Defining the Traffic Schema.
-class TrafficSchema(Schema):
+class TrafficSchema(ValidatedSchema):
     # Defining the required schema fields.
     write_query = fields.Integer(required=True)
     read_query = fields.Integer(required=True)
 
-    def validate_json(self, json_data : dict):
-        '''
-            This function validates the requests body.
-                :param json_data: dict
-                    The request body.
-                :returns: dict, int
-                    Returns the validated json or the errors in the json
-                    and the status code.
-        '''
-        try:
-            result = self.load(json_data)
-        except ValidationError as err:
-            return err.messages, 400
-        return result, 200
-
 
 # Defining the Metrics Schema.
-class MetricsSchema(Schema):
+class MetricsSchema(ValidatedSchema):
     # Defining the required schema fields.
     correlation_id = fields.Str(required=True)
     service_name = fields.Str(required=True)
@@ -205,17 +238,17 @@ class MetricsSchema(Schema):
     errors = fields.Nested(ErrorsSchema, required=True)
     traffic = fields.Nested(TrafficSchema, required=False)
 
-    def validate_json(self, json_data : dict):
-        '''
-            This function validates the requests body.
-                :param json_data: dict
-                    The request body.
-                :returns: dict, int
-                    Returns the validated json or the errors in the json
-                    and the status code.
-        '''
-        try:
-            result = self.load(json_data)
-        except ValidationError as err:
-            return err.messages, 400
-        return result, 200
+
+def compile_schemas(schema_classes : tuple) -> None:
+    '''
+        This function sets up the fast-path validators of the schemas.
+            :param schema_classes: tuple
+                The schema classes to compile.
+    '''
+    for schema_class in schema_classes:
+        schema_class.fast_load = staticmethod(compile_schema(schema_class))
+
+
+# Compiling the fast-path validators of the schemas.
+compile_schemas((NamedEntitiesSchema, MessageSchema, UserSchema, LatencySchema,
+                 SaturationSchema, ErrorsSchema, TrafficSchema, MetricsSchema))
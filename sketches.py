@@ -0,0 +1,493 @@
+# Importing all needed libraries.
+from datetime import datetime, timedelta, timezone
+import threading
+import socket
+import math
+import time
+import os
+import logging
+
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+
+from models import db, LatencySketchModel
+from watermarks import committed_until
+
+# The logger of the module.
+logger = logging.getLogger(__name__)
+
+
+# The fields of the Latency table sketched, with the name of the report field they are filled from.
+SKETCHED_FIELDS = {
+    "lock_time_per_process" : "lock_time",
+    "queue_waiting_time" : "queue_waiting_time",
+    "actual_processing_time" : "actual_processing",
+    "task_service_time" : "task_service_time",
+    "database_response_time" : "database_response_time"
+}
+
+# The quantiles returned by the summaries.
+SUMMARY_QUANTILES = {"p50" : 0.5, "p95" : 0.95, "p99" : 0.99}
+
+# The levels of the sketches folded from the lower one, from the coarsest, with the length of their buckets.
+SKETCH_LEVELS = [("day", "hour", 86400), ("hour", "minute", 3600)]
+
+
+def covering_levels(start : int, end : int, levels : list = SKETCH_LEVELS) -> list:
+    '''
+        This function splits a time range into the buckets of the coarsest levels it contains whole,
+        the rest of the range is read from the minute level.
+            :param start: int
+                The inclusive start of the range as a unix timestamp.
+            :param end: int
+                The exclusive end of the range as a unix timestamp.
+            :param levels: list, default = SKETCH_LEVELS
+                The levels tried, from the coarsest.
+            :return: list
+                The tuples of the level, the start and the end of the ranges.
+    '''
+    if start >= end:
+        return []
+    elif not levels:
+        return [("minute", start, end)]
+    (level, _, seconds), finer = levels[0], levels[1:]
+    first = -(-start // seconds) * seconds
+    last = end // seconds * seconds
+    if first >= last:
+        return covering_levels(start, end, finer)
+    return covering_levels(start, first, finer) + [(level, first, last)] + covering_levels(last, end, finer)
+
+
+class LogBucketSketch:
+    def __init__(self, relative_accuracy : float = 0.01) -> None:
+        '''
+            The constructor of the Log Bucket Sketch, a mergeable quantile sketch with logarithmic buckets.
+            Every quantile is returned with a relative error below the relative accuracy,
+            whatever the number of values and the way the sketches are merged.
+                :param relative_accuracy: float, default = 0.01
+                    The maximal relative error of the returned quantiles.
+        '''
+        if not 0 < relative_accuracy < 1:
+            raise ValueError(f"The relative accuracy must be between 0 and 1: {relative_accuracy}")
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.bins = dict()
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value : float) -> None:
+        '''
+            This function adds a value to the sketch.
+                :param value: float
+                    The value added, the values under a nanosecond go to the zero bucket and the infinite ones are skipped.
+        '''
+        if not math.isfinite(value):
+            return
+        elif value > 1e-9:
+            index = math.ceil(math.log(value) / self.log_gamma)
+            self.bins[index] = self.bins.get(index, 0) + 1
+        else:
+            self.zero_count += 1
+        self.count += 1
+
+    def merge(self, other : "LogBucketSketch") -> None:
+        '''
+            This function adds the values of another sketch to the sketch.
+                :param other: LogBucketSketch
+                    The sketch merged, with the same relative accuracy.
+        '''
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Only the sketches with the same relative accuracy can be merged")
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def quantile(self, q : float) -> float:
+        '''
+            This function returns the estimation of a quantile of the values.
+                :param q: float
+                    The quantile, between 0 and 1.
+                :return: float
+                    The estimation, None if the sketch is empty.
+        '''
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if rank < seen:
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.bins) / (self.gamma + 1)
+
+    def to_dict(self) -> dict:
+        '''
+            This function returns the JSON representation of the sketch.
+        '''
+        return {
+            "relative_accuracy" : self.relative_accuracy,
+            "zero_count" : self.zero_count,
+            "count" : self.count,
+            "bins" : {str(index) : count for index, count in self.bins.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, payload : dict) -> "LogBucketSketch":
+        '''
+            This function creates a sketch from its JSON representation.
+                :param payload: dict
+                    The representation returned by to_dict.
+        '''
+        sketch = cls(payload["relative_accuracy"])
+        sketch.bins = {int(index) : count for index, count in payload["bins"].items()}
+        sketch.zero_count = payload["zero_count"]
+        sketch.count = payload["count"]
+        return sketch
+
+
+class SketchStore:
+    def __init__(self, bucket_seconds : int = 60, relative_accuracy : float = 0.01,
+                 local_retention_seconds : int = 3600, retention_days : int = 7,
+                 checkpoint_interval_seconds : float = 30) -> None:
+        '''
+            The constructor of the Sketch Store, keeping a sketch per service, latency field and time bucket.
+            Every worker checkpoints its own sketches, the summaries merge the ones of all the workers.
+                :param bucket_seconds: int, default = 60
+                    The time range of a sketch in seconds.
+                :param relative_accuracy: float, default = 0.01
+                    The maximal relative error of the sketches.
+                :param local_retention_seconds: int, default = 3600
+                    The age after which a checkpointed sketch is removed from the memory.
+                :param retention_days: int, default = 7
+                    The number of days after which the checkpoints are deleted.
+                :param checkpoint_interval_seconds: float, default = 30
+                    The number of seconds between two checkpoints of a worker.
+        '''
+        self.bucket_seconds = bucket_seconds
+        self.checkpoint_interval = checkpoint_interval_seconds
+        self.relative_accuracy = relative_accuracy
+        self.local_retention = local_retention_seconds
+        self.retention = timedelta(days=retention_days)
+        self.sketches = dict()
+        self.dirty = set()
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+
+    @property
+    def worker_id(self) -> str:
+        '''
+            This function returns the id of the worker owning the sketches in memory.
+        '''
+        return f"{socket.gethostname()}-{os.getpid()}"
+
+    def bucket_start(self, unix : float) -> int:
+        '''
+            This function returns the start of the time bucket containing the moment.
+                :param unix: float
+                    The moment as a unix timestamp.
+        '''
+        return int(unix // self.bucket_seconds) * self.bucket_seconds
+
+    def add_reports(self, results : list, unix : float = None) -> None:
+        '''
+            This function adds the latencies of the metrics reports to the sketches.
+                :param results: list
+                    The list of metrics reports validated by the MetricsSchema.
+                :param unix: float, default = None
+                    The moment of the ingest, the current time if None.
+        '''
+        bucket_start = self.bucket_start(time.time() if unix is None else unix)
+        with self.lock:
+            for result in results:
+                if "latency" not in result:
+                    continue
+                for field, report_field in SKETCHED_FIELDS.items():
+                    value = result["latency"][report_field]
+                    if value is None:
+                        continue
+                    key = (result["service_name"], field, bucket_start)
+                    if key not in self.sketches:
+                        self.sketches[key] = LogBucketSketch(self.relative_accuracy)
+                    self.sketches[key].add(value)
+                    self.dirty.add(key)
+
+    def checkpoint(self) -> int:
+        '''
+            This function writes the sketches changed since the last checkpoint to the database
+            and removes the old checkpointed ones from the memory.
+                :return: int
+                    The number of sketches written.
+        '''
+        # Copying the changed sketches, so the ingest isn't blocked by the database.
+        with self.lock:
+            keys = list(self.dirty)
+            rows = [
+                {
+                    "level" : "minute",
+                    "service_name" : service_name,
+                    "field" : field,
+                    "bucket_start" : datetime.fromtimestamp(bucket_start, timezone.utc),
+                    "worker_id" : self.worker_id,
+                    "payload" : self.sketches[(service_name, field, bucket_start)].to_dict()
+                }
+                for service_name, field, bucket_start in keys
+            ]
+            self.dirty.clear()
+
+        try:
+            with db.engine.begin() as connection:
+                if rows:
+                    # The checkpoint of a worker holds the whole sketch, so it replaces the previous one.
+                    statement = insert(LatencySketchModel.__table__).values(rows)
+                    statement = statement.on_conflict_do_update(
+                        index_elements=["level", "service_name", "field", "bucket_start", "worker_id"],
+                        set_={"payload" : statement.excluded.payload, "updated_at" : db.func.now()}
+                    )
+                    connection.execute(statement)
+                connection.execute(text(
+                    "DELETE FROM latency_sketches WHERE bucket_start < :oldest"
+                ), {"oldest" : datetime.now(timezone.utc) - self.retention})
+        except Exception:
+            # The sketches are written again by the next checkpoint.
+            with self.lock:
+                self.dirty.update(keys)
+            raise
+
+        # Removing the old sketches already in the database.
+        oldest = self.bucket_start(time.time() - self.local_retention)
+        with self.lock:
+            for key in [key for key in self.sketches if key[2] < oldest and key not in self.dirty]:
+                del self.sketches[key]
+        return len(rows)
+
+    def summary(self, service_name : str, window_seconds : int) -> dict:
+        '''
+            This function returns the latency quantiles of a service over the last time window.
+            The hours and days folded whole in the window are read from their levels, the rest from the minute sketches.
+                :param service_name: str
+                    The name of the service.
+                :param window_seconds: int
+                    The length of the time window in seconds.
+                :return: dict
+                    The number of values and the quantiles, keyed by the latency field.
+        '''
+        now = time.time()
+        oldest = self.bucket_start(now - window_seconds)
+
+        # The high-water mark of the folds bounds the update times of the minute sketches folded, not their buckets.
+        # The last checkpoint of a minute is written at most one checkpoint interval after its end,
+        # so only the buckets ending one interval before the mark are folded whole, the later ones are read from the minutes.
+        folded = db.session.execute(text(
+            "SELECT high_water_mark FROM rollup_state WHERE name = 'latency_sketches'"
+        )).scalar()
+        if folded is not None:
+            folded = self.bucket_start(min(folded.timestamp(), now) - self.checkpoint_interval)
+        else:
+            folded = oldest
+        ranges = covering_levels(oldest, max(folded, oldest)) + [("minute", max(folded, oldest), None)]
+        minute_ranges = [(start, end) for level, start, end in ranges if level == "minute"]
+
+        # Taking the sketches of this worker from the memory, as they are fresher than their checkpoints.
+        merged = {field : LogBucketSketch(self.relative_accuracy) for field in SKETCHED_FIELDS}
+        local = set()
+        with self.lock:
+            for (sketch_service, field, bucket_start), sketch in self.sketches.items():
+                if sketch_service == service_name and \
+                        any(start <= bucket_start and (end is None or bucket_start < end) for start, end in minute_ranges):
+                    merged[field].merge(sketch)
+                    local.add((field, bucket_start))
+
+        # Merging the folded sketches, the checkpoints of the other workers and the ones of this worker not in the memory.
+        conditions = []
+        parameters = {"service_name" : service_name}
+        for index, (level, start, end) in enumerate(ranges):
+            condition = f"level = :level_{index} AND bucket_start >= :start_{index}"
+            parameters[f"level_{index}"] = level
+            parameters[f"start_{index}"] = datetime.fromtimestamp(start, timezone.utc)
+            if end is not None:
+                condition += f" AND bucket_start < :end_{index}"
+                parameters[f"end_{index}"] = datetime.fromtimestamp(end, timezone.utc)
+            conditions.append(f"({condition})")
+        rows = db.session.execute(text(
+            "SELECT level, field, bucket_start, worker_id, payload FROM latency_sketches "
+            f"WHERE service_name = :service_name AND ({' OR '.join(conditions)})"
+        ), parameters)
+        worker_id = self.worker_id
+        for level, field, bucket_start, row_worker_id, payload in rows:
+            if field not in merged:
+                continue
+            if level == "minute" and row_worker_id == worker_id and (field, int(bucket_start.timestamp())) in local:
+                continue
+            merged[field].merge(LogBucketSketch.from_dict(payload))
+
+        return {
+            field : {
+                "count" : sketch.count,
+                **{name : sketch.quantile(q) for name, q in SUMMARY_QUANTILES.items()}
+            }
+            for field, sketch in merged.items()
+        }
+
+    def run(self, app, check_interval : float) -> None:
+        '''
+            This function is the loop of the checkpoint thread.
+                :param app: Flask
+                    The flask application, used for the database connection.
+                :param check_interval: float
+                    The number of seconds between two checkpoints.
+        '''
+        while not self.stop_event.wait(check_interval):
+            with app.app_context():
+                try:
+                    self.checkpoint()
+                except Exception:
+                    logger.exception("Sketch checkpoint failed")
+
+    def start(self, app, check_interval : float = 30) -> None:
+        '''
+            This function starts the checkpoint thread.
+                :param app: Flask
+                    The flask application, used for the database connection.
+                :param check_interval: float, default = 30
+                    The number of seconds between two checkpoints.
+        '''
+        threading.Thread(target=self.run, args=(app, check_interval), daemon=True).start()
+
+    def stop(self) -> None:
+        '''
+            This function stops the checkpoint thread.
+        '''
+        self.stop_event.set()
+
+
+class SketchFolder:
+    def __init__(self, relative_accuracy : float = 0.01, lag_seconds : float = 30) -> None:
+        '''
+            The constructor of the Sketch Folder, merging the minute sketches of all the workers into hour and day sketches,
+            so the summaries of long windows read a few rows.
+                :param relative_accuracy: float, default = 0.01
+                    The maximal relative error of the sketches.
+                :param lag_seconds: float, default = 30
+                    The minimal age of the newest checkpoints folded, they are also older than the start of the open transactions.
+        '''
+        self.relative_accuracy = relative_accuracy
+        self.lag_seconds = lag_seconds
+        self.stop_event = threading.Event()
+
+    def fold_level(self, connection, level : str, source_level : str, lower, upper) -> int:
+        '''
+            This function recomputes the buckets of a level touched by the sketches of the lower level changed in the range.
+                :param connection: sqlalchemy.engine.Connection
+                    The connection to the database.
+                :param level: str
+                    The level recomputed, 'hour' or 'day'.
+                :param source_level: str
+                    The level the buckets are built from.
+                :param lower: datetime
+                    The exclusive start of the range of the changes.
+                :param upper: datetime
+                    The inclusive end of the range of the changes.
+                :return: int
+                    The number of buckets recomputed.
+        '''
+        rows = connection.execute(text('''
+            WITH touched AS (
+                SELECT DISTINCT service_name, field, date_trunc(:level, bucket_start) AS bucket FROM latency_sketches
+                WHERE level = :source_level AND updated_at > :lower AND updated_at <= :upper
+            )
+            SELECT t.service_name, t.field, t.bucket, s.payload FROM touched AS t
+            JOIN latency_sketches AS s ON s.level = :source_level AND s.service_name = t.service_name AND s.field = t.field
+                 AND s.bucket_start >= t.bucket AND s.bucket_start < t.bucket + CAST('1 ' || :level AS interval)
+        '''), {"level" : level, "source_level" : source_level, "lower" : lower, "upper" : upper})
+
+        # Merging the sketches of every touched bucket, they replace the previous ones.
+        sketches = dict()
+        for service_name, field, bucket, payload in rows:
+            if (service_name, field, bucket) not in sketches:
+                sketches[(service_name, field, bucket)] = LogBucketSketch(self.relative_accuracy)
+            sketches[(service_name, field, bucket)].merge(LogBucketSketch.from_dict(payload))
+        if sketches:
+            statement = insert(LatencySketchModel.__table__).values([
+                {
+                    "level" : level,
+                    "service_name" : service_name,
+                    "field" : field,
+                    "bucket_start" : bucket,
+                    "worker_id" : "",
+                    "payload" : sketch.to_dict()
+                }
+                for (service_name, field, bucket), sketch in sketches.items()
+            ])
+            connection.execute(statement.on_conflict_do_update(
+                index_elements=["level", "service_name", "field", "bucket_start", "worker_id"],
+                set_={"payload" : statement.excluded.payload, "updated_at" : db.func.now()}
+            ))
+        return len(sketches)
+
+    def fold(self) -> tuple:
+        '''
+            This function folds the sketches checkpointed since the high-water mark into the hour and day levels.
+                :return: tuple
+                    The previous and the new high-water marks.
+        '''
+        with db.engine.begin() as connection:
+            # Only one process folds at a time and the buckets are in UTC.
+            connection.execute(text("SELECT pg_advisory_xact_lock(hashtext('latency_sketches'))"))
+            connection.execute(text("SET LOCAL TIME ZONE 'UTC'"))
+
+            # Getting the range of the checkpoints not folded yet.
+            lower = connection.execute(text(
+                "SELECT high_water_mark FROM rollup_state WHERE name = 'latency_sketches'"
+            )).scalar()
+            if lower is None:
+                lower = connection.execute(text("SELECT CAST('epoch' AS timestamptz)")).scalar()
+            upper = committed_until(connection, self.lag_seconds)
+            now = connection.execute(text("SELECT now()")).scalar()
+            if upper <= lower:
+                return lower, lower
+
+            # Folding the minutes into the hours, then the hours changed by this fold or the previous ones into the days.
+            self.fold_level(connection, "hour", "minute", lower, upper)
+            self.fold_level(connection, "day", "hour", lower, now)
+
+            # Moving the high-water mark in the same transaction as the folds.
+            connection.execute(text(
+                "INSERT INTO rollup_state (name, high_water_mark) VALUES ('latency_sketches', :upper) "
+                "ON CONFLICT (name) DO UPDATE SET high_water_mark = excluded.high_water_mark"
+            ), {"upper" : upper})
+        return lower, upper
+
+    def run(self, app, check_interval : float) -> None:
+        '''
+            This function is the loop of the fold thread.
+                :param app: Flask
+                    The flask application, used for the database connection.
+                :param check_interval: float
+                    The number of seconds between two folds.
+        '''
+        while not self.stop_event.wait(check_interval):
+            with app.app_context():
+                try:
+                    self.fold()
+                except Exception:
+                    logger.exception("Sketch fold failed")
+
+    def start(self, app, check_interval : float = 60) -> None:
+        '''
+            This function starts the fold thread.
+                :param app: Flask
+                    The flask application, used for the database connection.
+                :param check_interval: float, default = 60
+                    The number of seconds between two folds.
+        '''
+        threading.Thread(target=self.run, args=(app, check_interval), daemon=True).start()
+
+    def stop(self) -> None:
+        '''
+            This function stops the fold thread.
+        '''
+        self.stop_event.set()
@@ -0,0 +1,127 @@
+# Importing all needed libraries.
+import threading
+import logging
+
+from sqlalchemy import text, JSON
+from sqlalchemy.dialects import postgresql
+
+from models import db, MessagesModel
+
+
+# The logger of the module.
+logger = logging.getLogger(__name__)
+
+
+def field_expression(column) -> str:
+    '''
+        This function returns the expression reading a Messages column from the merged fields of a message.
+            :param column: sqlalchemy.Column
+                The Messages column.
+    '''
+    if isinstance(column.type, JSON):
+        return f"(b.fields -> '{column.name}')::json"
+    return f"CAST(b.fields ->> '{column.name}' AS {column.type.compile(dialect=postgresql.dialect())})"
+
+
+# The assignments of the Messages columns, only the columns present in the merged fields are changed.
+MERGE_ASSIGNMENTS = ", ".join(
+    f"{column.name} = CASE WHEN b.fields ? '{column.name}' THEN {field_expression(column)} ELSE messages.{column.name} END"
+    for column in MessagesModel.__table__.columns
+    if column.name not in ("id", "updated_at")
+) + ", updated_at = now()"
+
+
+class StagingMerger:
+    def __init__(self, batch_size : int = 5000) -> None:
+        '''
+            The constructor of the Staging Merger, folding the staged events into the Messages table.
+                :param batch_size: int, default = 5000
+                    The maximal number of events merged in one transaction.
+        '''
+        self.batch_size = batch_size
+        self.stop_event = threading.Event()
+
+    def merge_batch(self) -> int:
+        '''
+            This function merges the oldest staged events into the Messages table in one transaction.
+            The events of a message are folded in the order they were staged, so a later value wins.
+                :return: int
+                    The number of messages merged.
+        '''
+        with db.engine.begin() as connection:
+            connection.execute(text(
+                "CREATE TEMPORARY TABLE IF NOT EXISTS staged_batch "
+                "(correlation_id varchar(64) PRIMARY KEY, fields jsonb NOT NULL) ON COMMIT DELETE ROWS"
+            ))
+
+            # Taking the events out of the staging table, skipping the ones locked by another merger.
+            merged = connection.execute(text('''
+                WITH batch AS (
+                    DELETE FROM staged_events WHERE id IN (
+                        SELECT id FROM staged_events ORDER BY id LIMIT :batch_size FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING id, correlation_id, payload
+                )
+                INSERT INTO staged_batch (correlation_id, fields)
+                SELECT batch.correlation_id,
+                       coalesce(jsonb_object_agg(field.key, field.value ORDER BY batch.id)
+                                FILTER (WHERE field.key IS NOT NULL), '{}'::jsonb)
+                FROM batch LEFT JOIN LATERAL jsonb_each(batch.payload::jsonb) AS field ON true
+                GROUP BY batch.correlation_id
+            '''), {"batch_size" : self.batch_size}).rowcount
+            if not merged:
+                return 0
+
+            # Creating the messages not seen yet and setting the staged columns of all of them.
+            connection.execute(text(
+                "INSERT INTO messages (id) SELECT correlation_id FROM staged_batch ON CONFLICT (id) DO NOTHING"
+            ))
+            connection.execute(text(
+                f"UPDATE messages SET {MERGE_ASSIGNMENTS} FROM staged_batch AS b WHERE messages.id = b.correlation_id"
+            ))
+        return merged
+
+    def merge(self) -> int:
+        '''
+            This function merges the staged events batch by batch until the staging table is empty.
+                :return: int
+                    The number of messages merged.
+        '''
+        total = 0
+        while not self.stop_event.is_set():
+            merged = self.merge_batch()
+            total += merged
+            if merged == 0:
+                break
+        return total
+
+    def run(self, app, check_interval : float) -> None:
+        '''
+            This function is the loop of the merge thread.
+                :param app: Flask
+                    The flask application, used for the database connection.
+                :param check_interval: float
+                    The number of seconds between two merges.
+        '''
+        while not self.stop_event.wait(check_interval):
+            with app.app_context():
+                try:
+                    self.merge()
+                except Exception:
+                    logger.exception("Staging merge failed")
+
+    def start(self, app, check_interval : float = 1) -> None:
+        '''
+            This function starts the merge thread.
+                :param app: Flask
+                    The flask application, used for the database connection.
+                :param check_interval: float, default = 1
+                    The number of seconds between two merges.
+        '''
+        threading.Thread(target=self.run, args=(app, check_interval), daemon=True).start()
+
+    def stop(self) -> None:
+        '''
+            This function stops the merge thread.
+        '''
+        self.stop_event.set()
@@ -0,0 +1,41 @@
+# Importing all needed libraries.
+import os
+import sys
+
+import pytest
+
+# The modules of the warehouse are at the root of the repository and read config.ini from the working directory.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+# The sqlalchemy uri of a scratch Postgres database, the tests needing one are skipped without it.
+TEST_DATABASE_URI = os.environ.get("DATA_WAREHOUSE_TEST_DATABASE_URI")
+
+requires_database = pytest.mark.skipif(
+    TEST_DATABASE_URI is None, reason="DATA_WAREHOUSE_TEST_DATABASE_URI isn't set"
+)
+
+
+@pytest.fixture(scope="session")
+def database_app():
+    '''
+        This fixture creates a Flask application on the scratch database with the tables of the models,
+        and drops them once the tests are done.
+    '''
+    from flask import Flask
+    from models import db, PARTITIONED_METRICS
+    from partitions import PartitionManager
+
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_DATABASE_URI"] = TEST_DATABASE_URI
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        if PARTITIONED_METRICS:
+            PartitionManager().create_future_partitions()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
@@ -0,0 +1,48 @@
+# Importing all needed libraries.
+import pytest
+from sqlalchemy import text
+
+from conftest import requires_database
+from access_paths import access_path_queries, explain_access_paths
+from models import db
+
+# The number of seeded rows per table, enough for the planner to prefer the indexes.
+SEEDED_ROWS = 5000
+
+# The metrics tables seeded with the rows of every service.
+METRIC_TABLES = ["latency", "traffic", "errors", "saturation"]
+SERVICES = ["intent-service", "named-entity-recognition-service", "sentiment-service", "sequence2sequence-service"]
+
+
+@pytest.fixture(scope="module")
+def access_paths(database_app):
+    '''
+        This fixture seeds the tables and returns the plans of the access paths.
+    '''
+    with database_app.app_context():
+        with db.engine.begin() as connection:
+            for table in METRIC_TABLES:
+                connection.execute(text(
+                    f"INSERT INTO {table} (id, service_name) "
+                    f"SELECT md5('{table}' || i)::uuid, (ARRAY[:services])[1 + i % {len(SERVICES)}] "
+                    f"FROM generate_series(1, {SEEDED_ROWS}) AS i"
+                ), {"services" : SERVICES})
+            connection.execute(text(
+                f'INSERT INTO "user" (id, telegram_id, chat_id, app_id) '
+                f"SELECT md5('user' || i), i, i, i FROM generate_series(1, {SEEDED_ROWS}) AS i"
+            ))
+            connection.execute(text(
+                "INSERT INTO messages (id, user_id, " + ", ".join(f"intent_{table}_id" for table in METRIC_TABLES) + ") "
+                "SELECT md5('message' || i), md5('user' || i), " +
+                ", ".join(f"md5('{table}' || i)::uuid" for table in METRIC_TABLES) +
+                f" FROM generate_series(1, {SEEDED_ROWS}) AS i"
+            ))
+            connection.execute(text("ANALYZE"))
+        return explain_access_paths()
+
+
+@requires_database
+@pytest.mark.parametrize("name", list(access_path_queries()))
+def test_access_path_uses_an_index(access_paths, name):
+    uses_index, plan = access_paths[name]
+    assert uses_index, f"{name} is read with a Seq Scan:\n{plan}"
@@ -0,0 +1,41 @@
+# Importing all needed libraries.
+import uuid
+
+from buffer import WriteBehindBuffer
+from ingestion import save_user
+from conftest import requires_database
+
+
+def new_user() -> dict:
+    '''
+        This function returns a new user validated by the UserSchema.
+    '''
+    user_id = uuid.uuid4()
+    return {
+        "user_id" : str(user_id),
+        "telegram_user_id" : user_id.int % 10 ** 9,
+        "chat_id" : user_id.int % 10 ** 9,
+        "first_name" : "Test",
+        "last_name" : "User",
+        "telegram_username" : f"user_{user_id.hex}",
+        "app_id" : user_id.int % 10 ** 9
+    }
+
+
+def failing_write(result : dict) -> None:
+    raise ValueError("The write failed")
+
+
+@requires_database
+def test_enqueued_writes_call_back_only_once_committed(database_app):
+    write_behind = WriteBehindBuffer(database_app, flush_interval_ms=10, mode="enqueue")
+    committed = []
+    saved = new_user()
+    assert write_behind.submit(save_user, saved, on_commit=lambda: committed.append(saved["user_id"])) is None
+    assert write_behind.submit(failing_write, new_user(), on_commit=lambda: committed.append("failed")) is None
+
+    # The writes are acknowledged once queued, the callbacks run after the flush.
+    write_behind.start()
+    assert write_behind.stop(5) == 0
+    assert committed == [saved["user_id"]]
+    assert write_behind.stats()["written"] == 1
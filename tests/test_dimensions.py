@@ -0,0 +1,21 @@
+# Importing all needed libraries.
+from dimensions import DateDimension
+from models import DateModel
+from conftest import requires_database
+
+
+@requires_database
+def test_lookup_many_inserts_the_buckets_outside_of_the_range_once(database_app):
+    date_dimension = DateDimension(bucket_seconds=60, key_cache_size=2)
+    with database_app.app_context():
+        date_dimension.populate(now=1700000000)
+        # Three old buckets, one of them twice, and one bucket of the populated range.
+        unix_list = [999999960, 999999990, 1000000020, 1000000080, 1700000000]
+        date_ids = date_dimension.lookup_many(unix_list)
+
+        assert date_ids[0] == date_ids[1]
+        assert len(set(date_ids)) == 4
+        assert DateModel.query.filter(DateModel.id.in_(date_ids)).count() == 4
+        # Only the last keys outside of the range are remembered.
+        assert len(date_dimension.keys) == 2
+        assert date_dimension.lookup(999999960) == date_ids[0]
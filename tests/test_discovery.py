@@ -0,0 +1,105 @@
+# Importing all needed libraries.
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+import json
+
+import pytest
+
+from discovery import ServiceDiscoveryClient
+
+
+class StubServiceDiscovery(ThreadingHTTPServer):
+    def __init__(self, failed_registrations : int = 0) -> None:
+        '''
+            The constructor of the Stub Service Discovery, a local server recording the requests of the client.
+                :param failed_registrations: int, default = 0
+                    The number of registrations answered with 503 before the first success.
+        '''
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.failed_registrations = failed_registrations
+        self.requests = []
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        # Recording the request and failing the first registrations.
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append((self.path, self.headers["Token"], body))
+        if self.path.startswith("/heartbeat/") or self.server.failed_registrations <= 0:
+            self.send_response(200)
+        else:
+            self.server.failed_registrations -= 1
+            self.send_response(503)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    '''
+        This fixture serves a stub service discovery failing the first three registrations.
+    '''
+    stub = StubServiceDiscovery(failed_registrations=3)
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+    yield stub
+    stub.shutdown()
+    stub.server_close()
+
+
+def discovery_client(stub, load_provider=None) -> ServiceDiscoveryClient:
+    '''
+        This function returns a client of the stub with short intervals.
+    '''
+    return ServiceDiscoveryClient(
+        "127.0.0.1", stub.server_address[1], "register", "service-discovery-key", "data-warehouse-service",
+        {"general" : {"name" : "data-warehouse-service"}}, heartbeat_interval=0.2, timeout=1, backoff_base=0.05,
+        load_provider=load_provider, min_heartbeat_interval=0.1, max_heartbeat_interval=0.4
+    )
+
+
+def test_start_doesnt_wait_for_the_registration(stub):
+    client = discovery_client(stub)
+    start = time.monotonic()
+    client.start()
+    elapsed = time.monotonic() - start
+    client.stop()
+    assert elapsed < 0.1
+
+
+def test_registration_is_retried_then_heartbeats_are_sent(stub):
+    client = discovery_client(stub)
+    client.start()
+    time.sleep(1.5)
+    client.stop()
+
+    assert client.registered
+    assert client.registration_attempts == 4
+    assert client.heartbeats_sent > 0
+    assert any(path.startswith("/heartbeat/") for path, _, _ in stub.requests)
+
+
+def test_requests_are_signed(stub):
+    client = discovery_client(stub)
+    client.start()
+    time.sleep(1)
+    client.stop()
+
+    assert stub.requests
+    for path, token, body in stub.requests:
+        assert token == client.security_manager._SecurityManager__encode_hmac(body), path
+
+
+def test_heartbeats_carry_the_load(stub):
+    client = discovery_client(stub, load_provider=lambda: {"in_flight_requests" : 5, "ingest_rate" : 100})
+    client.start()
+    time.sleep(1.5)
+    client.stop()
+
+    heartbeats = [body for path, _, body in stub.requests if path.startswith("/heartbeat/")]
+    assert heartbeats
+    for body in heartbeats:
+        assert body["load"]["in_flight_requests"] == 5
+        assert 0.1 <= body["next_heartbeat_seconds"] <= 0.4
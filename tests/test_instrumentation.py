@@ -0,0 +1,65 @@
+# Importing all needed libraries.
+import json
+
+from instrumentation import Instrumentation, LoadSignals, EXITED_WORKER
+
+
+def handle_requests(instrumentation : Instrumentation, count : int) -> None:
+    '''
+        This function handles requests through an instrumented view.
+    '''
+    view = instrumentation.instrument("metrics")(lambda: ({}, 200))
+    for _ in range(count):
+        view()
+
+
+def write_worker_snapshot(shared_dir, worker : str, instrumentation : Instrumentation) -> None:
+    '''
+        This function writes the snapshot of another worker, as its snapshot thread would.
+    '''
+    counters, histograms = instrumentation.collect()
+    (shared_dir / f"{worker}.json").write_text(json.dumps({
+        "counters" : [[name, labels, value] for (name, labels), value in counters.items()],
+        "histograms" : [[name, labels, histogram] for (name, labels), histogram in histograms.items()]
+    }))
+
+
+def test_load_signals_without_shared_dir_count_the_process():
+    instrumentation = Instrumentation()
+    handle_requests(instrumentation, 3)
+
+    requests, in_flight, durations = LoadSignals(instrumentation).totals()
+    assert (requests, in_flight, sum(durations)) == (3, 0, 3)
+
+
+def test_load_signals_sum_the_snapshots_of_all_workers(tmp_path):
+    leader = Instrumentation()
+    leader.shared_dir = str(tmp_path)
+    handle_requests(leader, 2)
+
+    worker = Instrumentation()
+    handle_requests(worker, 5)
+    worker.increment(("warehouse_in_flight_requests", (("endpoint", "metrics"),)), 4)
+    write_worker_snapshot(tmp_path, "other", worker)
+
+    requests, in_flight, durations = LoadSignals(leader).totals()
+    assert (requests, in_flight, sum(durations)) == (7, 4, 7)
+
+
+def test_exited_workers_are_merged_into_one_label(tmp_path):
+    for worker_id, count in (("101-1", 2), ("102-1", 3)):
+        worker = Instrumentation()
+        worker.shared_dir = str(tmp_path)
+        worker.worker_id = worker_id
+        handle_requests(worker, count)
+        worker.write_snapshot()
+        worker.stop()
+
+    scraper = Instrumentation()
+    scraper.shared_dir = str(tmp_path)
+    scraper.worker_id = "103-1"
+    workers = {worker : counters for worker, counters, _ in scraper.worker_metrics()}
+    assert sorted(workers) == ["103-1", EXITED_WORKER]
+    requests_key = ("warehouse_requests_total", (("endpoint", "metrics"), ("status", "200")))
+    assert workers[EXITED_WORKER][requests_key] == 5
+    assert ("warehouse_in_flight_requests", (("endpoint", "metrics"),)) not in workers[EXITED_WORKER]
@@ -0,0 +1,49 @@
+# Importing all needed libraries.
+from sqlalchemy import create_engine, text
+
+from watermarks import committed_until, EXPORT_APPLICATION_NAME
+from conftest import requires_database, TEST_DATABASE_URI
+
+
+def open_transaction(engine, application_name : str = None) -> tuple:
+    '''
+        This function opens a transaction left idle, named if an application name is given.
+            :return: tuple
+                The connection and the start of its transaction.
+    '''
+    connection = engine.connect()
+    if application_name is not None:
+        connection.execute(text("SELECT set_config('application_name', :name, true)"), {"name" : application_name})
+    return connection, connection.execute(text("SELECT now()")).scalar()
+
+
+def bound(engine, idle_seconds : float = 300):
+    '''
+        This function returns the bound of the jobs, read from a new transaction.
+    '''
+    with engine.connect() as connection:
+        return committed_until(connection, 0, idle_seconds)
+
+
+@requires_database
+def test_open_transactions_hold_the_bound_back():
+    engine = create_engine(TEST_DATABASE_URI)
+    connection, start = open_transaction(engine)
+    try:
+        assert bound(engine) < start
+        # The sessions idle in their transaction for longer than the limit are ignored.
+        assert bound(engine, idle_seconds=0) > start
+    finally:
+        connection.close()
+        engine.dispose()
+
+
+@requires_database
+def test_exports_dont_hold_the_bound_back():
+    engine = create_engine(TEST_DATABASE_URI)
+    connection, start = open_transaction(engine, EXPORT_APPLICATION_NAME)
+    try:
+        assert bound(engine) > start
+    finally:
+        connection.close()
+        engine.dispose()
@@ -1,8 +1,9 @@
-from datetime import datetime
+from datetime import datetime, date
+from functools import lru_cache
+import bisect
+import numpy as np
 import holidays
 
-US_HOLIDAYS = holidays.US()
-
 month_int2name = {
     1 : "January",
     2 : "February",
@@ -18,30 +19,87 @@ month_int2name = {
     12 : "December"
 }
 
+# The ordinal of the first day of the UNIX time.
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# The sorted array of the US holidays as days since the UNIX epoch.
+HOLIDAY_DAYS = np.array(sorted(
+    day.toordinal() - EPOCH_ORDINAL for day in holidays.US(years=range(1970, 2100))
+), dtype=np.int64)
+HOLIDAY_DAYS_LIST = HOLIDAY_DAYS.tolist()
+
+# The month names indexed by the month number.
+MONTH_NAMES = np.array([""] + [month_int2name[month] for month in range(1, 13)], dtype=object)
+
+
+# The date features depending only on the day, cached by the day ordinal.
+@lru_cache(maxsize=4096)
+def day_to_date_dict(ordinal):
+    day = date.fromordinal(ordinal)
+    day_of_week = day.isoweekday()
+    holiday_index = bisect.bisect_left(HOLIDAY_DAYS_LIST, ordinal - EPOCH_ORDINAL)
+
+    return {
+        "month" : day.month,
+        "month_str" : month_int2name[day.month],
+        "year" : day.year,
+        "day_of_week" : day_of_week,
+        "is_weekend" : day_of_week in [6, 7],
+        "is_holiday" : holiday_index < len(HOLIDAY_DAYS_LIST) and HOLIDAY_DAYS_LIST[holiday_index] == ordinal - EPOCH_ORDINAL
+    }
+
 
 def unix_to_date_dict(unix):
     date = datetime.utcfromtimestamp(unix)
-    month = date.month
-    month_str = month_int2name[month]
-    year = date.year
-    hour = date.hour
-    minute = date.minute
-    seconds = date.second
-    day_of_week = date.weekday() + 1
-    is_weekend = True if day_of_week in [6, 7] else False
-    is_holiday = True if date.strftime("%d-%m-%Y") in US_HOLIDAYS else False
+    day_dict = day_to_date_dict(date.toordinal())
 
     return {
         "date" : date,
-        "month" : month,
-        "month_str" : month_str,
-        "year" : year,
-        "hour" : hour,
-        "minute" : minute,
-        "seconds" : seconds,
-        "day_of_week" : day_of_week,
-        "is_weekend" : is_weekend,
-        "is_holiday" : is_holiday
+        "month" : day_dict["month"],
+        "month_str" : day_dict["month_str"],
+        "year" : day_dict["year"],
+        "hour" : date.hour,
+        "minute" : date.minute,
+        "seconds" : date.second,
+        "day_of_week" : day_dict["day_of_week"],
+        "is_weekend" : day_dict["is_weekend"],
+        "is_holiday" : day_dict["is_holiday"]
     }
 
 
+def unix_to_date_columns(unix):
+    '''
+        This function converts an array of UNIX timestamps into columns of date features.
+            :param unix: array-like
+                The UNIX timestamps.
+            :return: dict
+                The date features as NumPy arrays, with the same keys as unix_to_date_dict.
+    '''
+    # Rounding the timestamps to microseconds the same way as datetime.utcfromtimestamp.
+    fraction, whole = np.modf(np.asarray(unix, dtype=np.float64))
+    microseconds = np.round(fraction * 1e6).astype(np.int64)
+    whole = whole.astype(np.int64)
+    whole += microseconds // 1000000
+    microseconds %= 1000000
+
+    # Splitting the timestamps into days and seconds of the day.
+    days, day_seconds = np.divmod(whole, 86400)
+    dates = days.astype("datetime64[D]")
+    month = dates.astype("datetime64[M]").astype(np.int64) % 12 + 1
+    day_of_week = (days + 3) % 7 + 1
+
+    # Checking the holidays against the sorted array of holiday days.
+    holiday_index = np.minimum(np.searchsorted(HOLIDAY_DAYS, days), len(HOLIDAY_DAYS) - 1)
+
+    return {
+        "date" : whole.astype("datetime64[s]") + microseconds.astype("timedelta64[us]"),
+        "month" : month,
+        "month_str" : MONTH_NAMES[month],
+        "year" : dates.astype("datetime64[Y]").astype(np.int64) + 1970,
+        "hour" : day_seconds // 3600,
+        "minute" : day_seconds % 3600 // 60,
+        "seconds" : day_seconds % 60,
+        "day_of_week" : day_of_week,
+        "is_weekend" : day_of_week >= 6,
+        "is_holiday" : HOLIDAY_DAYS[holiday_index] == days
+    }
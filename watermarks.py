@@ -0,0 +1,44 @@
+# Importing all needed libraries.
+from sqlalchemy import text
+
+# The application name of the read transactions of the exports, they don't write any row so they don't hold the bound back.
+EXPORT_APPLICATION_NAME = "data-warehouse-export"
+
+# The number of seconds after which a session idle in its transaction stops holding the bound back.
+IDLE_IN_TRANSACTION_SECONDS = 300
+
+# The newest moment before the start of every other open transaction of the database and at least lag seconds old.
+# The exports and the sessions left idle in a transaction for too long are ignored, so they can't freeze the jobs.
+# least() ignores the NULL returned when no other transaction is open.
+COMMITTED_UNTIL = '''
+    SELECT least(
+        now() - make_interval(secs => :lag),
+        (SELECT min(xact_start) - interval '1 microsecond' FROM pg_stat_activity
+         WHERE datname = current_database() AND backend_type = 'client backend'
+               AND pid <> pg_backend_pid() AND xact_start IS NOT NULL
+               AND application_name <> :export_application_name
+               AND NOT (state = 'idle in transaction' AND state_change < now() - make_interval(secs => :idle_seconds)))
+    )
+'''
+
+
+def committed_until(connection, lag_seconds : float, idle_seconds : float = IDLE_IN_TRANSACTION_SECONDS):
+    '''
+        This function returns the upper bound of the jobs reading the rows changed since a high-water mark.
+        The rows are stamped with now(), the start of their transaction, so a row stamped before the bound
+        can only be committed later by a transaction still open, and the bound is kept before the start of all of them.
+            :param connection: sqlalchemy.engine.Connection
+                The connection to the database.
+            :param lag_seconds: float
+                The minimal age of the bound.
+            :param idle_seconds: float, default = IDLE_IN_TRANSACTION_SECONDS
+                The number of seconds after which a session idle in its transaction is ignored,
+                the rows it commits afterwards are missed by the jobs past its start.
+            :return: datetime
+                The bound, every row stamped before it is committed or rolled back.
+    '''
+    return connection.execute(text(COMMITTED_UNTIL), {
+        "lag" : lag_seconds,
+        "export_application_name" : EXPORT_APPLICATION_NAME,
+        "idle_seconds" : idle_seconds
+    }).scalar()